@@ -12,6 +12,9 @@ TARGET_UNDERLYING = {
   ENV_PROD: 'SPX',
   ENV_SANDBOX: 'SPY'
 }
+# Environments one run_automation_routine drives, each in its own thread (server_env.use_env).
+# e.g. (ENV_PROD, ENV_SANDBOX) runs SPX on PROD and SPY on SANDBOX side by side.
+AUTOMATION_ENVS = (ACTIVE_ENV,)
 
 # Guardrail flags
 ENFORCE_TRADING_HOURS = True   #disable to allow after hours automation for testing - refers to market open/close
@@ -32,6 +35,133 @@ QTY_OVERIDE = 1
 
 # Order Execution Limits
 ORDER_TIMEOUT_SECONDS = 15
+ORDER_SUBMIT_ATTEMPTS = 3               # POSTs per tagged order; each resubmit follows a by-tag lookup that found nothing
+ORDER_TAG_LOOKUP_DELAY_SECONDS = 1.0    # lets the broker register a POST that failed in transit before looking it up
+
+# Entry Limit Ladder (server_api.ladder_spread_order): start near mid, walk toward rules['target_debit_max']
+ENTRY_LADDER_ENABLED = True
+ENTRY_LADDER_TICK = 0.05              # limit step per rung (modify-order, not cancel/replace)
+ENTRY_LADDER_STEP_SECONDS = 2.0       # time on each rung before stepping
+ENTRY_LADDER_BUDGET_SECONDS = 15.0    # hard total from submit; then the order is canceled
+
+# Entry Fallbacks: a timed-out entry moves straight to the next-ranked pair, re-quoting only its two legs
+ENTRY_FALLBACK_PAIRS = 3              # ranked pairs kept behind the first choice (calculate_scalpel_strikes)
+
+# Broker Transport (server_transport)
+API_POOL_CONNECTIONS = 4      # keep-alive pools per environment (one per host)
+API_POOL_MAXSIZE = 16         # sockets kept open per pool
+API_MAX_RETRIES = 3           # idempotent GETs only; orders are never retried blindly
+API_BACKOFF_BASE_SECONDS = 0.25
+API_BACKOFF_MAX_SECONDS = 2.0
+API_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# (connect, read) timeouts in seconds, matched by longest path prefix
+API_TIMEOUTS = {
+  'default': (3.05, 10.0),
+  '/markets/clock': (3.05, 5.0),
+  '/markets/quotes': (3.05, 5.0),
+  '/markets/options/chains': (3.05, 20.0),
+  '/markets/timesales': (3.05, 15.0),
+  '/accounts': (3.05, 10.0),
+}
+FETCH_MAX_WORKERS = 6         # concurrent broker reads in the entry-window fetch stage
+QUOTE_BATCH_SIZE = 100        # symbols per /markets/quotes request (keeps the query string short)
+QUOTE_BATCH_MAX_WORKERS = 4   # chunks fetched concurrently by server_api.get_quotes_batch
+
+# Broker Rate Limits (server_ratelimit): paces calls within one process; other runs are
+# only seen through the broker's X-Ratelimit-* headers
+# Priorities: lower number = more important
+PRIORITY_ORDER = 0    # order placement, cancels, fill checks
+PRIORITY_BOT = 1      # automation reads (default)
+PRIORITY_UI = 2       # dashboard reads
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_WINDOW_SECONDS = 60
+RATE_LIMITS = {       # calls per window until X-Ratelimit-* headers say otherwise
+  'market_data': 120,
+  'trading': 60,
+  'account': 120
+}
+RATE_LIMIT_RESERVE = {  # share of each bucket a priority may not consume
+  PRIORITY_ORDER: 0.0,
+  PRIORITY_BOT: 0.1,
+  PRIORITY_UI: 0.3
+}
+RATE_LIMIT_MAX_WAIT_SECONDS = {  # then the call goes out anyway
+  PRIORITY_ORDER: 0.0,
+  PRIORITY_BOT: 5.0,
+  PRIORITY_UI: 10.0
+}
+
+# Broker Circuit Breakers (server_breaker), one per rate-limit endpoint class
+BREAKER_ENABLED = True
+BREAKER_WINDOW_SECONDS = 60       # rolling window of call outcomes
+BREAKER_MIN_CALLS = 5             # no verdict on fewer calls than this
+BREAKER_FAILURE_RATE = 0.5        # trips at or above this share of failures (network errors, timeouts, 5xx)
+BREAKER_COOLDOWN_SECONDS = 30     # open (fail fast) this long, then half-open
+BREAKER_HALF_OPEN_PROBES = 1      # trial calls allowed at once while half-open
+
+# Broker Metrics (server_metrics): per-endpoint latency histograms, flushed to the broker_metrics table
+METRICS_ENABLED = True
+METRICS_RETENTION_DAYS = 14         # older broker_metrics rows are deleted on flush
+METRICS_BUCKET_MIN_SECONDS = 0.001  # upper bound of the first latency bucket
+METRICS_BUCKET_GROWTH = 1.25        # each bucket 25% wider than the last: percentiles are within 25%
+METRICS_BUCKET_COUNT = 56           # 1 ms .. ~4.4 min; slower calls land in the last bucket
+
+# Option Chain Cache (server_api.get_option_chain)
+CHAIN_CACHE_TTL_SECONDS = 5.0     # served without touching the network
+CHAIN_CACHE_STALE_SECONDS = 10.0  # past TTL: served while a background refresh runs
+
+# Option Chain Decoding (server_chain_decode)
+# Preference order, first importable wins: orjson is fastest, ijson streams with flat memory
+CHAIN_DECODER_BACKENDS = ('orjson', 'ijson', 'json')
+CHAIN_STRIKE_WINDOW_PCT = 0.03    # with a reference price, strikes beyond +/- this share are dropped while decoding
+CHAIN_ROOTS = {                   # only these OCC roots are kept per underlying
+  'SPX': ('SPXW',)
+}
+
+# Option Pricing (server_pricing): vectorized Black-Scholes IV and greeks from bid/ask
+PRICING_LOCAL_GREEKS = True       # chains/snapshots request greeks=false (smaller payloads); greeks are computed locally
+PRICING_RISK_FREE_RATE = 0.04     # annual, continuous
+PRICING_IV_MIN = 0.01             # implied-vol search bracket
+PRICING_IV_MAX = 5.0
+PRICING_IV_TOLERANCE = 1e-6       # $ per share between model and market price
+PRICING_IV_MAX_ITER = 50
+
+# Volatility Surface (server_volsurface): IV by expiration x log-moneyness, fed from every chain download
+VOL_SURFACE_ENABLED = True
+VOL_SURFACE_MAX_AGE_SECONDS = 900  # points not re-observed for this long are dropped
+VOL_SURFACE_MIN_POINTS = 3         # strikes an expiration needs before lookups use it
+
+# Entry Shortlist (two-phase entry: full-chain scan before the window, candidate-only quotes at the trigger)
+ENTRY_SHORTLIST_ENABLED = True
+ENTRY_SHORTLIST_LEAD_MINUTES = 5   # scan window before rules['entry_time_est']
+ENTRY_SHORTLIST_SIZE = 20          # OCC symbols kept per side (calls / puts)
+ENTRY_SHORTLIST_MAX_DRIFT = 0.25   # spot may move this share of the shortlisted strike span before the full chain is used
+ENTRY_PREFLIGHT_ENABLED = True     # preview today's likely spread per side during the scan; reuse its payload template at the trigger
+
+# Spread Grid (server_spreads): all pairs x widths scored in one pass
+SPREAD_GRID_TOP_K = 5   # candidates top_spreads returns when no k is given
+
+# Record/Replay (server_cassette)
+CASSETTE_DIR = '/tmp/cassettes'  # <name>.jsonl.gz files used by the test_scripts diagnostics
+
+# Streaming (server_stream)
+STREAM_ENABLED = True
+# The book and the websocket live in process memory. Without Anvil's Persistent Server every
+# run is a fresh process that would open a new stream session and still find the book empty,
+# so nothing is streamed unless the app runs on one (Settings > Persistent Server).
+STREAM_PERSISTENT_SERVER = False
+STREAM_WS_URLS = {
+  ENV_PROD: 'wss://ws.tradier.com/v1',
+  ENV_SANDBOX: None  # Tradier sandbox has no streaming; REST polling only
+}
+STREAM_FILTERS = ('quote', 'trade', 'summary')
+STREAM_MAX_QUOTE_AGE_SECONDS = 5.0     # older book entries fall back to REST
+STREAM_CONNECT_TIMEOUT_SECONDS = 5.0
+STREAM_RECONNECT_MAX_SECONDS = 30.0
+# OCC option roots that belong to a different underlying symbol
+OPTION_ROOT_UNDERLYING = {
+  'SPXW': 'SPX'
+}
 
 # Cycle Status
 STATUS_NEW = 'NEW'
@@ -74,6 +204,9 @@ TARGET_DEBIT_MIN = 1.20
 TARGET_DEBIT_MAX = 1.35
 HARVEST_TARGET_PX = 3.50
 MARKET_OPEN_TIME = dt.time(9, 30)
+MARKET_CLOSE_TIME = dt.time(16, 0)
+MARKET_EARLY_CLOSE_TIME = dt.time(13, 0)  # July 3 / day after Thanksgiving / Christmas Eve (server_calendar)
+CLOCK_CACHE_MAX_SECONDS = 1800  # broker clock is reused until next_change, but never longer than this
 DEFAULT_MULTIPLIER = 100
 MAX_DELTA_ERROR = 0.05   # short strike of income spread must be target_detla +/- MAX_DELTA_ERROR
 MAX_BID_ASK_SPREAD = .75
@@ -112,18 +245,5 @@ LEVEL_ALERT = LOG_CRITICAL   # Only wake human for disasters
 LOG_START_TIME = dt.time(9, 0)  # 9:00 AM ET
 LOG_STOP_TIME = dt.time(17, 0)  # 5:00 PM ET
 
-MARKET_HOLIDAYS = [
-  dt.date(2026, 1, 1),   # New Year's
-  dt.date(2026, 1, 19),  # MLK Day
-  dt.date(2026, 2, 16),  # Presidents' Day
-  dt.date(2026, 4, 3),   # Good Friday
-  dt.date(2026, 5, 25),  # Memorial Day
-  dt.date(2026, 6, 19),  # Juneteenth
-  dt.date(2026, 7, 3),   # Independence Day (Observed)
-  dt.date(2026, 9, 7),   # Labor Day
-  dt.date(2026, 11, 26), # Thanksgiving
-  dt.date(2026, 12, 25), # Christmas
-]
-
 # log sample
 # logger.log(f"", level=, source=, context={})
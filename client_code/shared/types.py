@@ -1,4 +1,4 @@
-from typing import TypedDict, Dict, Optional, Union
+from typing import TypedDict, Any, Dict, Optional, Union
 import datetime as dt
 
 # 1. Sub-components (The details)
@@ -35,9 +35,20 @@ class EnvStatus(TypedDict):
   next_state_change: str  # Raw timestamp from broker (e.g., '16:00' or '13:00')
   today: dt.date
   now: dt.datetime
-  is_holiday: bool
+  is_holiday: bool        # server_calendar (rule-based NYSE holidays)
+  is_short_day: bool      # 13:00 early close today
+  close_time: Optional[dt.time]  # Regular-session close today; None if shut all day
   current_env: str        # 'PROD' or 'SANDBOX'
   target_underlying: str  # 'SPX' or 'SPY'
+  broker_circuits: Dict[str, str]  # endpoint class -> 'closed' / 'open' / 'half_open' (server_breaker)
+
+class EntryContext(TypedDict):
+  market_data: MarketData   # get_market_data_snapshot()
+  scalpel_env: Dict         # VIX / VWAP / price / is_bullish
+  chain: Any               # 0DTE chain as server_chain.OptionChainFrame
+  fetch_seconds: float      # Wall time of the concurrent fetch stage
+  chain_source: str         # 'shortlist' (pre-computed candidates re-quoted) or 'full'
+  preflight: Optional[Dict] # {'call'|'put': order preview result} from the pre-entry scan, or None
 
 class RuleSetDict(TypedDict, total=False):
   # Timing
@@ -50,6 +61,7 @@ class RuleSetDict(TypedDict, total=False):
   # Strategy
   spread_target_delta: float
   spread_width: float
+  spread_widths: list         # optional: several widths scored together (server_spreads)
   spread_min_premium: float
   spread_max_premium: float
   spread_size_factor: float
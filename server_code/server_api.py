@@ -3,103 +3,260 @@ import anvil.secrets
 import anvil.server
 
 import datetime as dt
+import hashlib
+import math
 import requests
-from urllib.parse import urljoin
 from typing import Dict, List, Any, Optional, Tuple
 import time 
 import pytz
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from tradier_python import TradierAPI
 from shared import config
-from shared.types import EnvStatus
+from shared.types import EnvStatus, EntryContext
 from . import server_logging as logger
-
-# Global cache variable (starts empty)
-_CACHED_CLIENT = None
+from . import server_env
+from . import server_transport
+from . import server_stream
+from . import server_calendar
+from . import server_db
+from . import server_libs
+from . import server_chain_decode
+from . import server_pricing
+from . import server_volsurface
+from .server_transport import BrokerTransport
+from .server_ratelimit import request_priority
+from .server_cache import TTLCache
+from .server_chain import OptionChainFrame
+from .server_vwap import VwapAccumulator
+
+# Shared pool for concurrent broker reads (entry-window fetch stage)
+_FETCH_POOL = ThreadPoolExecutor(max_workers=config.FETCH_MAX_WORKERS, thread_name_prefix='broker-fetch')
+# Quote chunks get their own pool: the snapshot itself runs on _FETCH_POOL
+_QUOTE_POOL = ThreadPoolExecutor(max_workers=config.QUOTE_BATCH_MAX_WORKERS, thread_name_prefix='broker-quotes')
+
+# Orders in these states can be submitted again under the same tag
+_DEAD_ORDER_STATUSES = ('canceled', 'rejected', 'expired')
+
+# Quote fields a re-quote copies onto a candidate's legs (requote_spread_candidate)
+_REQUOTE_FIELDS = ('bid', 'ask', 'last', 'bid_date', 'ask_date')
+
+# Parsed option chains keyed (symbol, expiration, greeks, strike window, roots)
+# An empty chain is never cached: it is a glitch far more often than a real answer
+_CHAIN_CACHE = TTLCache('option_chain', config.CHAIN_CACHE_TTL_SECONDS, config.CHAIN_CACHE_STALE_SECONDS, keep_empty=False)
 
 # --- AUTHENTICATION ---
-def _get_client() -> TradierAPI:
-  """Returns the cached client if exist or a new authenticated TradierAPI client based on the current environment"""  
-  global _CACHED_CLIENT
-  if _CACHED_CLIENT is not None:
-    return _CACHED_CLIENT
-  
-  env_prefix = config.ACTIVE_ENV
-
-  api_key = anvil.secrets.get_secret(f'{env_prefix}_TRADIER_API_KEY')
-  account_id = anvil.secrets.get_secret(f'{env_prefix}_TRADIER_ACCOUNT')
-  endpoint_url = anvil.secrets.get_secret(f'{env_prefix}_ENDPOINT_URL').rstrip('/')
-
-  if not api_key or not account_id:
-    raise ValueError(f"Missing API Credentials for {env_prefix}")
-
-  return TradierAPI(token=api_key, default_account_id=account_id, endpoint=endpoint_url)
+def _get_client() -> BrokerTransport:
+  """Returns the pooled, authenticated broker transport for the current environment"""  
+  return server_transport.get_transport(server_env.current_env())
 
 # --- ENVIRONMENT & MARKET STATUS ---
 #@anvil.server.callable  # why callable?  delete this line
 def get_scalpel_environment() -> dict:
-  """Fetches VIX and calculates today's 1-minute VWAP for SPX."""
+  """Fetches VIX and today's 1-minute VWAP for SPX (incremental: only bars since the last call)."""
   t = _get_client()
-  symbol = config.TARGET_UNDERLYING[config.ACTIVE_ENV]
+  symbol = server_env.target_underlying()
+  today = dt.date.today()
 
   # 1. Fetch VIX (Standard Quote)
   vix_quote = _get_quote_direct(t, "VIX")
-  vix_price = float(vix_quote.get('last') or 0)
-  today_str = dt.date.today().strftime('%Y-%m-%d')
-  params = {
-    'symbol': symbol,
-    'interval': '1min',
-    'start': f"{today_str} 09:30",
-    'end': f"{today_str} 16:00",
-    'session_filter': 'open'
-  }
 
-  vwap = 0.0
-  current_price = 0.0
+  # 2. Fetch 1-minute bars newer than the stored accumulator
+  acc = _load_vwap(symbol, today)
+  try:
+    _update_vwap(acc, _get_timesales(t, symbol, today, start=acc.next_start()))
+  except Exception as e:
+    logger.log(f"Error calculating VWAP: {e}", level=config.LOG_WARNING)
+
+  return _build_scalpel_environment(vix_quote, acc)
+
+def get_session_last_price(symbol: str = None) -> float:
+  """Latest 1-minute close for today (EOD settlement), via the VWAP accumulator's incremental fetch."""
+  t = _get_client()
+  symbol = symbol or server_env.target_underlying()
+  today = dt.date.today()
 
+  acc = _load_vwap(symbol, today)
   try:
-    # Endpoint: /v1/markets/history
-    resp = t.session.get(f"{t.endpoint}/markets/timesales", params=params, headers={'Accept': 'application/json'})
-    history = resp.json().get('series', {}).get('data', [])
-  
-    if isinstance(history, dict): 
-      history = [history]
-
-    if history:
-      cum_pv = 0.0
-      cum_vol = 0.0
-      for bar in history:
-        # VWAP = Sum(Typical Price * Volume) / Sum(Volume)
-        high = float(bar['high'])
-        low = float(bar['low'])
-        close = float(bar['close'])
-        vol = float(bar['volume'])
-
-        typical_price = (high + low + close) / 3.0
-        cum_pv += (typical_price * vol)
-        cum_vol += vol
-        current_price = close # Most recent bar is current price
-
-      if cum_vol > 0:
-        vwap = cum_pv / cum_vol
+    _update_vwap(acc, _get_timesales(t, symbol, today, start=acc.next_start()))
+  except Exception as e:
+    logger.log(f"Error fetching last price for {symbol}: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+  return acc.last_price
 
+def prepare_entry_shortlist(cycle, env_status: EnvStatus, account_equity: float = None) -> Optional[Dict]:
+  """
+  Phase one of the entry: scans the full 0DTE chain ahead of the window and stores the
+  symbols near today's candidates (server_libs.build_entry_shortlist) for get_entry_context.
+  With account_equity, today's candidates are also previewed (preflight_entry_orders) until both pass.
+  """
+  t = _get_client()
+  symbol = server_env.target_underlying()
+  today = env_status['today']
+  try:
+    quote = _get_quote_direct(t, symbol) or {}
+    spot = float(quote.get('last') or 0.0)
+    chain = OptionChainFrame.from_options(_get_cached_chain(t, symbol, today, near=spot))
+  except Exception as e:
+    logger.log(f"Entry shortlist scan failed: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+    return None
+  if not spot or not len(chain):
+    return None
+
+  symbols = server_libs.build_entry_shortlist(chain, cycle.rules, spot)
+  previous = server_db.get_entry_shortlist(server_env.current_env(), today)
+  server_db.save_entry_shortlist(server_env.current_env(), today, symbol, spot, symbols)
+  logger.log(f"Entry shortlist: {sum(len(v) for v in symbols.values())} of {len(chain)} options around {spot:.2f}",
+             level=config.LOG_DEBUG,
+             source=config.LOG_SOURCE_API)
+
+  preflight = (previous or {}).get('preflight')
+  if config.ENTRY_PREFLIGHT_ENABLED and account_equity and not (preflight and all(p['ok'] for p in preflight.values())):
+    preflight = preflight_entry_orders(chain, cycle.rules, spot, account_equity)
+    server_db.save_entry_preflight(server_env.current_env(), today, preflight)
+  return symbols
+
+def preflight_entry_orders(chain, rules: Dict, spot: float, account_equity: float) -> Dict[str, Dict]:
+  """
+  Order preview of today's likely entry on each side, sized as _execute_scalpel_entry would.
+  Per side: ok, the payload template to reuse at the trigger, the previewed legs and the broker's
+  cost / margin figures, or the rejection. A rejection is alerted now, minutes before the window.
+  """
+  results = {}
+  for is_bullish in (True, False):
+    option_type = config.TRADIER_OPTION_TYPE_CALL if is_bullish else config.TRADIER_OPTION_TYPE_PUT
+    candidate = server_libs.calculate_scalpel_strikes(chain, rules, spot, is_bullish)
+    if not candidate:
+      continue
+    candidate['quantity'] = server_libs.get_scalpel_quantity(account_equity, candidate['debit'])
+    template = spread_payload_template(is_debit=True)
+    preview, error = {}, None
+    try:
+      preview = open_spread_position(candidate, is_debit=True, preview=True, template=template).get('preview') or {}
+      if preview.get('result') is False or preview.get('errors'):
+        error = str(preview.get('errors') or 'preview result false')
+    except requests.exceptions.HTTPError as e:
+      error = e.response.text if e.response is not None else str(e)
+    except requests.exceptions.RequestException as e:
+      error = str(e)
+
+    results[option_type] = {
+      'ok': error is None,
+      'template': template,
+      'short_symbol': candidate['short_leg_data']['symbol'],
+      'long_symbol': candidate['long_leg_data']['symbol'],
+      'quantity': candidate['quantity'],
+      'debit': candidate['debit'],
+      'cost': preview.get('cost'),
+      'order_cost': preview.get('order_cost'),
+      'commission': preview.get('commission'),
+      'margin_change': preview.get('margin_change'),
+      'error': error,
+      'checked_at': dt.datetime.now().isoformat()
+    }
+    if error:
+      logger.log(f"Entry preflight REJECTED ({option_type} {candidate['quantity']}x @ {candidate['debit']:.2f}): {error}",
+                 level=config.LOG_CRITICAL,
+                 source=config.LOG_SOURCE_API)
+    else:
+      logger.log(f"Entry preflight ok ({option_type} {candidate['quantity']}x @ {candidate['debit']:.2f}): "
+                 f"cost {preview.get('cost')}, margin change {preview.get('margin_change')}",
+                 level=config.LOG_INFO,
+                 source=config.LOG_SOURCE_API)
+  return results
+
+def get_entry_context(cycle, env_status: EnvStatus) -> EntryContext:
+  """
+  Fetches every broker input the entry window needs in one concurrent stage:
+  quote snapshot, VIX, today's timesales (VWAP) and the 0DTE option chain.
+  With a shortlist from prepare_entry_shortlist, the chain is just those symbols
+  re-quoted in one /markets/quotes call instead of the full chain, unless spot has drifted
+  too far from the scan (_shortlist_drifted), in which case the full chain is read instead.
+  Wall time is roughly the slowest single request instead of their sum.
+  The full chain only downloads on the pool (and only on a cache miss); decoding, local
+  greeks and the IV surface update run on this thread once everything is back.
+  """
+  t = _get_client()
+  symbol = server_env.target_underlying()
+  today = env_status['today']
+  start_time = time.time()
+  # An entry order may follow: have order events flowing before it is submitted
+  server_stream.ensure_account_stream(t.env)
+
+  f_snapshot = server_env.submit(_FETCH_POOL, get_market_data_snapshot, cycle)
+  f_vix = server_env.submit(_FETCH_POOL, _get_quote_direct, t, "VIX")
+  acc = _load_vwap(symbol, today)  # DB reads stay on this thread
+  shortlist = server_db.get_entry_shortlist(server_env.current_env(), today) if config.ENTRY_SHORTLIST_ENABLED else None
+  f_bars = server_env.submit(_FETCH_POOL, _get_timesales, t, symbol, today, acc.next_start())
+  # Last loop's close is close enough to centre the strike window (and to spot a drift)
+  near = acc.last_price or None
+  if shortlist and shortlist.get('underlying') == symbol and not _shortlist_drifted(shortlist, near):
+    chain_source = 'shortlist'
+    shortlist_symbols = [s for side in shortlist['symbols'].values() for s in side]
+    f_chain = server_env.submit(_FETCH_POOL, _get_shortlist_chain, t, shortlist_symbols)
+  else:
+    chain_source = 'full'
+    f_chain = None
+    if not _CHAIN_CACHE.contains(_chain_key(t, symbol, today, True, near)):
+      f_chain = server_env.submit(_FETCH_POOL, _fetch_option_chain, t, symbol, today, not config.PRICING_LOCAL_GREEKS)
+
+  try:
+    _update_vwap(acc, f_bars.result())
   except Exception as e:
     logger.log(f"Error calculating VWAP: {e}", level=config.LOG_WARNING)
 
-  vwap_pct = (current_price - vwap) / vwap if vwap > 0 else None
-  return_dict = {
-    'vix': vix_price,
-    'vwap': round(vwap, 2),
-    'price': current_price,
-    'is_bullish': vwap_pct >= 0,
-    'vwp_pct': vwap_pct
+  chain = []
+  try:
+    if chain_source == 'shortlist':
+      chain = f_chain.result()
+      spot = f_snapshot.result().get('price')
+      if _shortlist_drifted(shortlist, spot):
+        logger.log(f"Spot {spot:.2f} drifted from the entry shortlist ({shortlist['spot']:.2f}); using the full chain",
+                   level=config.LOG_INFO,
+                   source=config.LOG_SOURCE_API)
+        chain_source, near, f_chain = 'full', spot, None
+    if chain_source == 'full':
+      chain = _get_cached_chain(t, symbol, today, True, near, download=f_chain, spot=f_snapshot.result().get('price'))
+  except Exception as e:
+    logger.log(f"API Error fetching chain for {today}: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+
+  if chain and chain_source == 'shortlist' and config.VOL_SURFACE_ENABLED:
+    # Fresh quotes for the strikes that matter most: refresh just those surface points
+    server_volsurface.update_from_chain(symbol, chain, f_snapshot.result().get('price'))
+
+  context = {
+    'market_data': f_snapshot.result(),
+    'scalpel_env': _build_scalpel_environment(f_vix.result(), acc),
+    'chain': OptionChainFrame.from_options(chain),
+    'fetch_seconds': time.time() - start_time,
+    'chain_source': chain_source,
+    'preflight': (shortlist or {}).get('preflight')
   }
-  print(f'vwap: {return_dict}')
+  logger.log(f"Entry context fetched in {context['fetch_seconds']:.2f}s ({len(chain)} options, {chain_source})",
+             level=config.LOG_DEBUG,
+             source=config.LOG_SOURCE_API)
+  return context
 
-  return return_dict
+def _shortlist_drifted(shortlist: Dict, spot: Optional[float]) -> bool:
+  """
+    True when spot has moved from the scan's spot by more than ENTRY_SHORTLIST_MAX_DRIFT of
+    the narrowest side's shortlisted strike span: the selector may then want strikes it lacks.
+    """
+  if not spot or not shortlist.get('spot'):
+    return False
+  spans = []
+  for symbols in shortlist['symbols'].values():
+    strikes = [int(s[-8:]) / 1000.0 for s in symbols]  # OCC: strike * 1000 in the last 8 digits
+    if strikes:
+      spans.append(max(strikes) - min(strikes))
+  if not spans:
+    return True
+  return abs(spot - shortlist['spot']) > config.ENTRY_SHORTLIST_MAX_DRIFT * min(spans)
 
 def get_environment_status() -> EnvStatus:
-  """Checks market clock and returns operational status"""
+  """
+  Checks market clock and returns operational status.
+  The broker clock is cached until its next state change (server_calendar),
+  so most loop/UI calls make no request; holiday/short-day flags come from the calendar.
+  """
   t = _get_client()
   
   # 1. Get Timezone-Aware UTC
@@ -112,35 +269,39 @@ def get_environment_status() -> EnvStatus:
   # This prevents "can't compare offset-naive and offset-aware" errors downstream
   # and ensures 9:30 AM ET looks like 09:30:00 to the bot.
   wall_clock_now = et_now.replace(tzinfo=None)
+  today = wall_clock_now.date()
 
   status_data = {
     'status': 'CLOSED',
     'status_message': 'Market is Closed',
-    'today': wall_clock_now.date(),
+    'today': today,
     'now': wall_clock_now,
-    'is_holiday': False,
+    'is_holiday': server_calendar.is_holiday(today),
+    'is_short_day': server_calendar.is_short_day(today),
+    'close_time': server_calendar.close_time(today),
     'next_state_change': '00:00',
-    'current_env': config.ACTIVE_ENV,
-    'target_underlying': config.TARGET_UNDERLYING[config.ACTIVE_ENV]
+    'current_env': server_env.current_env(),
+    'target_underlying': server_env.target_underlying()
   }
 
   try:
-    response = t.session.get(f"{t.endpoint}/markets/clock", headers={'Accept': 'application/json'})
-    if response.status_code == 200:
-      clock = response.json().get('clock', {})
-      state = clock.get('state')
-      status_data['next_state_change'] = str(clock.get('next_change', '16:00'))
-    
-      if state == 'open':
-        status_data['status'] = 'OPEN'
-        status_data['status_message'] = 'Market is Open'
-      else:
-        status_data['status_message'] = f"Market is {state}"
+    clock = server_calendar.get_clock(t.env, wall_clock_now, lambda: _fetch_clock(t))
+    state = clock.get('state')
+    status_data['next_state_change'] = str(clock.get('next_change', '16:00'))
+  
+    if state == 'open':
+      status_data['status'] = 'OPEN'
+      status_data['status_message'] = 'Market is Open'
+    else:
+      status_data['status_message'] = f"Market is {state}"
 
   except Exception as e:
     logger.log(f"API Error checking clock: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
     status_data['status_message'] = f"API Error: {e}"
+    # Stay CLOSED (no trading without the broker), but keep the schedule from the calendar
+    status_data['next_state_change'] = server_calendar.local_clock(wall_clock_now)['next_change']
 
+  status_data['broker_circuits'] = t.breakers.states()
   return status_data
 
 # --- DATA FETCHING ---
@@ -152,7 +313,13 @@ def get_current_positions() -> List[Dict]:
     """
   t = _get_client()
   try:
-    raw_positions = t.get_positions()
+    resp = t.get(f"/accounts/{t.account_id}/positions")
+    resp.raise_for_status()
+    positions_container = (resp.json() or {}).get('positions')
+    if not isinstance(positions_container, dict):
+      # Tradier returns the string 'null' when the account is flat
+      return []
+    raw_positions = positions_container.get('position')
     if not raw_positions:
       return []
 
@@ -188,7 +355,7 @@ def get_current_positions() -> List[Dict]:
 def get_market_data_snapshot(cycle) -> Dict:
   """
   Fetches quotes for underlying, hedge, AND active spreads.
-  Now includes Greeks for Hedge Maintenance checks.
+  Now includes Greeks for Hedge Maintenance checks (computed locally under PRICING_LOCAL_GREEKS).
   """
   t = _get_client()
   snapshot = {
@@ -215,17 +382,25 @@ def get_market_data_snapshot(cycle) -> Dict:
     for leg in trade.legs:
       symbols.append(leg.occ_symbol)
 
-  # 2. Single Multi-Quote Call
-  symbol_str = ",".join(list(set(symbols))) # Deduplicate
-  params = {'symbols': symbol_str, 'greeks': 'true'}
-  resp = t.session.get(f"{t.endpoint}/markets/quotes", params=params, headers={'Accept': 'application/json'})
-
-  # 3. Map Results
-  raw_quotes = resp.json().get('quotes', {}).get('quote', [])
-  if isinstance(raw_quotes, dict): 
-    raw_quotes = [raw_quotes]
-
-  quote_map = {q['symbol']: q for q in raw_quotes}
+  # 2. Streamed marks first: underlying + spread legs straight from the quote book.
+  # Hedge greeks/expiration are not streamed, so the hedge is always a REST quote.
+  hedge_symbol = hedge.legs[0].occ_symbol if hedge and hedge.legs else None
+  quote_map = _read_quote_book(cycle.underlying, [s for s in symbols[1:] if s != hedge_symbol])
+  if quote_map is None:
+    quote_map = {}
+    rest_symbols = list(set(symbols)) # Deduplicate
+  else:
+    rest_symbols = [hedge_symbol] if hedge_symbol else []
+
+  # 3. Batched quotes for whatever the book could not serve (broker greeks only for the hedge)
+  if rest_symbols:
+    greeks_for = [hedge_symbol] if hedge_symbol and not config.PRICING_LOCAL_GREEKS else []
+    quotes, errors = get_quotes_batch(rest_symbols, greeks_for=greeks_for, t=t)
+    quote_map.update(quotes)
+    if errors:
+      logger.log(f"Snapshot missing {len(errors)} quote(s): {errors}",
+                 level=config.LOG_WARNING,
+                 source=config.LOG_SOURCE_API)
 
   def safe_float(val, default=0.0) -> float:
     try:
@@ -251,6 +426,10 @@ def get_market_data_snapshot(cycle) -> Dict:
     if h_q:
       snapshot['hedge_last'] = (safe_float(h_q.get('bid')) + safe_float(h_q.get('ask'))) / 2.0 or safe_float(h_q.get('last'))
       greeks = h_q.get('greeks')
+      if not isinstance(greeks, dict) or greeks.get('delta') is None:
+        priced = dict(h_q)
+        server_pricing.fill_missing_greeks([priced], snapshot['price'])
+        greeks = priced.get('greeks')
       if isinstance(greeks, dict):
         snapshot['hedge_delta'] = safe_float(greeks.get('delta'))
         snapshot['hedge_theta'] = abs(safe_float(greeks.get('theta')))
@@ -275,79 +454,82 @@ def get_market_data_snapshot(cycle) -> Dict:
 
   return snapshot
   
-def get_option_chain(date: dt.date, symbol: str = None) -> List[Dict]:
+def get_quotes_batch(symbols: List[str], greeks_for: List[str] = (), t: BrokerTransport = None) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+  """
+    Quotes for any number of symbols: split into QUOTE_BATCH_SIZE chunks fetched concurrently,
+    with greeks requested only for the symbols in `greeks_for`.
+    Returns (quotes by symbol, error by symbol); a failed chunk or unmatched symbol
+    only costs its own symbols.
+    """
+  t = t or _get_client()
+  wanted = list(dict.fromkeys(s for s in symbols if s))
+  greek_set = set(greeks_for)
+  size = max(config.QUOTE_BATCH_SIZE, 1)
+  chunks = []
+  for greeks in (True, False):
+    group = [s for s in wanted if (s in greek_set) == greeks]
+    chunks += [(group[i:i + size], greeks) for i in range(0, len(group), size)]
+
+  if len(chunks) <= 1:
+    results = [_fetch_quote_chunk(t, chunk, greeks) for chunk, greeks in chunks]
+  else:
+    # Each task runs in a copy of the caller's context, so request priority carries over
+    futures = [server_env.submit(_QUOTE_POOL, _fetch_quote_chunk, t, chunk, greeks)
+               for chunk, greeks in chunks]
+    results = [f.result() for f in futures]
+
+  quotes, errors = {}, {}
+  for chunk_quotes, chunk_errors in results:
+    quotes.update(chunk_quotes)
+    errors.update(chunk_errors)
+  return quotes, errors
+
+def get_option_chain(date: dt.date, symbol: str = None, greeks: bool = True, near: float = None) -> List[Dict]:
   """
-  Fetches chain for a specific date using your resilient legacy parsing.
+  Fetches chain for a specific date (decoded by server_chain_decode: slim dicts, CHAIN_ROOTS only).
   If symbol is None, defaults to the current environment's target (SPY/SPX).
+  near: reference price; strikes outside +/- CHAIN_STRIKE_WINDOW_PCT of it are dropped while decoding.
+  Served from the TTL chain cache; repeated calls within CHAIN_CACHE_TTL_SECONDS are free.
   """
   t = _get_client()
   if symbol is None:
-    symbol = config.TARGET_UNDERLYING[config.ACTIVE_ENV]
-  exp_str = date.strftime('%Y-%m-%d')
-  params = {'symbol': symbol, 'expiration': exp_str, 'greeks': 'true'}
-
-  clean_chain = []
+    symbol = server_env.target_underlying()
 
   try:
-    # Raw GET request
-    resp = t.session.get(f"{t.endpoint}/markets/options/chains", params=params, headers={'Accept': 'application/json'})
-    data = resp.json()
-    if data is None:
-      return []
-    options_container = data.get('options')
-    if options_container is None:
-      return []
-
-    options_list = options_container.get('option', [])
-    
-    # Normalize to list
-    if isinstance(options_list, dict): 
-      options_list = [options_list]
-    elif options_list == 'null' or options_list is None:
-      options_list = []
-
-    for opt in options_list:
-      try:
-        # Basic validation (Price > 0, Strike Exists)
-
-        # only trade SPXW, not SPX
-        #root = opt.get('root_symbol')
-        #if symbol == 'SPX' and root != 'SPXW': continue 
-        if not opt.get('strike') or not opt.get('bid'): 
-          continue
-
-          # Ensure floats
-        opt['strike'] = float(opt['strike'])
-        opt['bid'] = float(opt['bid'])
-        opt['ask'] = float(opt['ask'])
+    return _get_cached_chain(t, symbol, date, greeks, near)
+  except Exception as e:
+    logger.log(f"API Error fetching chain for {date}: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+    return []
 
-        # Parse Greeks (nested or flat depending on Tradier mood)
-        # Your logic used 'greeks' key
-        greeks = opt.get('greeks', {})
-        if greeks:
-          opt['delta'] = float(greeks.get('delta', 0))
-          # You can add gamma/theta here if needed
+def get_option_chain_frame(date: dt.date, symbol: str = None, greeks: bool = True, near: float = None) -> OptionChainFrame:
+  """Columnar (NumPy struct-of-arrays) view of get_option_chain for the strike selectors."""
+  return OptionChainFrame.from_options(get_option_chain(date, symbol, greeks, near))
 
-        clean_chain.append(opt)
+def get_chain_cache_stats() -> Dict:
+  """Hit/miss/refresh counters for the option chain cache."""
+  return _CHAIN_CACHE.stats()
 
-      except (ValueError, TypeError):
-        continue
+def clear_chain_cache() -> None:
+  _CHAIN_CACHE.clear()
 
-  except Exception as e:
-    logger.log(f"API Error fetching chain for {date}: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+def get_breaker_stats() -> Dict:
+  """Per-endpoint-class circuit state, window counts and trip/reject counters for the active environment."""
+  return _get_client().breakers.stats()
 
-  return clean_chain
+def get_rate_limit_stats() -> Dict:
+  """Per-bucket capacity/availability and local wait counters for the active environment."""
+  return _get_client().scheduler.stats()
 
 def get_expirations(symbol: str = None) -> List[dt.date]:
   """Fetches ALL valid expiration dates for a symbol"""
   t = _get_client()
   if symbol is None: 
-    symbol = config.TARGET_UNDERLYING[config.ACTIVE_ENV]
+    symbol = server_env.target_underlying()
 
   try:
     # Endpoint: /v1/markets/options/expirations
     params = {'symbol': symbol, 'includeAllRoots': 'true'}
-    resp = t.session.get(f"{t.endpoint}/markets/options/expirations", params=params, headers={'Accept': 'application/json'})
+    resp = t.get("/markets/options/expirations", params=params)
     data = resp.json()
 
     # Handle "expiration" key (could be list or dict)
@@ -375,55 +557,46 @@ def get_expirations(symbol: str = None) -> List[dt.date]:
 
 # --- EXECUTION ---
 
-def open_spread_position(trade_data: Dict, is_debit: bool=True, preview: bool=False, is_dry_run: bool=False) -> Dict:
+def open_spread_position(trade_data: Dict, is_debit: bool=True, preview: bool=False, is_dry_run: bool=False, tag: str = None,
+                         template: Dict = None) -> Dict:
   """
     Submits a multileg order (Vertical Spread).
     Uses your 'build_multileg_payload' logic.
+    tag: order_tag() for idempotent submission (see _submit_order).
+    template: spread_payload_template() already validated by a preview; only legs,
+    quantities and price are filled in. A preview's report carries the broker's figures under 'preview'.
     """
   t = _get_client()
-  underlying = config.TARGET_UNDERLYING[config.ACTIVE_ENV]
-  
-  # 1. Construct Payload
-  legs_list = []
-
-  # Short Leg
-  legs_list.append({
-    'symbol': trade_data['short_leg_data']['symbol'],
-    'side': 'sell_to_open',
-    'quantity': str(trade_data['quantity'])
-  })
-
-  # Long Leg
-  legs_list.append({
-    'symbol': trade_data['long_leg_data']['symbol'],
-    'side': 'buy_to_open',
-    'quantity': str(trade_data['quantity'])
-  })
-
-  # Build indexed payload (option_symbol[0], side[0], etc.)
-  payload = {
-    'class': 'multileg',
-    'symbol': underlying, # Underlying
-    'duration': 'day',
-    'type': 'debit' if is_debit else 'credit',
-    'price': f"{trade_data['debit']:.2f}"
-  }
+  payload = dict(template or spread_payload_template(is_debit))
+  payload['price'] = f"{trade_data['debit']:.2f}"
   # Inject Preview Flag
   if preview:
     payload['preview'] = 'true'
 
-  for i, leg in enumerate(legs_list):
+  # Indexed legs (option_symbol[0], quantity[0], etc.): short first, as in the template
+  for i, leg in enumerate((trade_data['short_leg_data'], trade_data['long_leg_data'])):
     payload[f'option_symbol[{i}]'] = leg['symbol']
-    payload[f'side[{i}]'] = leg['side']
-    payload[f'quantity[{i}]'] = leg['quantity']
+    payload[f'quantity[{i}]'] = str(trade_data['quantity'])
+
+  return _submit_order(t, payload, is_dry_run, tag=tag)
 
-  return _submit_order(t, payload, is_dry_run)
+def spread_payload_template(is_debit: bool = True) -> Dict:
+  """Fixed part of a vertical-spread open for this environment: everything but legs, quantities and price."""
+  return {
+    'class': 'multileg',
+    'symbol': server_env.target_underlying(), # Underlying
+    'duration': 'day',
+    'type': 'debit' if is_debit else 'credit',
+    'side[0]': 'sell_to_open',
+    'side[1]': 'buy_to_open'
+  }
 
-def close_position(trade, order_type: str = 'limit', limit_price: float = 3.5, is_dry_run: bool=False) -> Dict:
+def close_position(trade, order_type: str = 'limit', limit_price: float = 3.5, is_dry_run: bool=False, tag: str = None) -> Dict:
   """
     Closes a position (Spread or Hedge).
     Dynamically switches between 'option' and 'multileg' endpoints.
     order_type: 'limit' (default, uses target price) or 'market' (for panic).
+    tag: order_tag() for idempotent submission (see _submit_order).
     """
   t = _get_client()
 
@@ -450,7 +623,7 @@ def close_position(trade, order_type: str = 'limit', limit_price: float = 3.5, i
     })
 
     # 2. Dynamic Symbol Resolution
-  root = config.TARGET_UNDERLYING[config.ACTIVE_ENV]
+  root = server_env.target_underlying()
   check_leg = short_leg or long_leg
   if check_leg:
     if 'SPX' in check_leg.occ_symbol: 
@@ -496,14 +669,16 @@ def close_position(trade, order_type: str = 'limit', limit_price: float = 3.5, i
       payload[f'quantity[{i}]'] = leg['quantity']
 
   # 4. Submit
-  result = _submit_order(t, payload, is_dry_run=is_dry_run)
+  result = _submit_order(t, payload, is_dry_run=is_dry_run, tag=tag)
   return result
 
 def wait_for_order_fill(order_id: str, timeout_seconds: int = 15, fill_px_fallback: float=0.0) -> Tuple[str, float]:
   """
-    Polls Tradier for specific order ID until it is 'filled' or timeout occurs.
+    Waits for a specific order ID until it is 'filled', dies, or timeout occurs.
+    With the account event stream up, this blocks on order events (no broker calls);
+    otherwise, or when the registry can't be trusted, it polls the order once a second.
     Returns (status_string, avg_fill_price).
-    status_string values: 'filled', 'canceled', 'rejected', 'expired', 'timeout'
+    status_string values: 'filled', 'canceled', 'rejected', 'expired', False (timeout)
     """
   t = _get_client()
   # Dry Run handling
@@ -518,53 +693,177 @@ def wait_for_order_fill(order_id: str, timeout_seconds: int = 15, fill_px_fallba
       if fill_px_fallback == 0.0:
         fill_px_fallback = 3.50
     return 'filled', fill_px_fallback  # Or pass the price back if you want to test PnL math
-    
-  url = f"{t.endpoint}/accounts/{t.default_account_id}/orders/{order_id}"
+
+  stream = server_stream.ensure_account_stream(t.env)
+  registry = server_stream.get_order_registry(t.env)
   start_time = time.time()
 
-  while (time.time() - start_time) < timeout_seconds:
-    try:
-      resp = t.session.get(url, headers={'Accept': 'application/json'})
-      if resp.status_code == 200:
-        data = resp.json()
-        # Tradier structure: {'order': {'status': 'filled', ...}}
-        order_data = data.get('order', {})
-        reason = order_data.get('reason_description', 'No reason provided')
-        status = order_data.get('status')
-        if status == 'filled':
-          fill_price = abs(float(order_data.get('avg_fill_price') or 0.0))
-          logger.log(f"Order {order_id} FILLED at ${fill_price}", 
-                     level=config.LOG_INFO, 
-                     source=config.LOG_SOURCE_API)
-          return 'filled', fill_price
-
-        if status in ['canceled', 'rejected', 'expired']:
-          logger.log(f"Order {order_id} died: {status.upper()} - {reason}", 
-                     level=config.LOG_WARNING, 
-                     source=config.LOG_SOURCE_API)
-          return status, 0.0
-
-          # If 'open' or 'pending', wait and retry
-      time.sleep(1.0)
+  while True:
+    order_data, from_stream = _current_order_state(t, order_id, stream)
+    result = _order_outcome(order_id, order_data)
+    if result:
+      return result
+
+    remaining = timeout_seconds - (time.time() - start_time)
+    if remaining <= 0:
+      break
+    # If 'open' or 'pending': wait for an event (short slices, so a dropped stream falls back to REST)
+    if from_stream:
+      registry.wait(order_id, min(remaining, 1.0))
+    else:
+      time.sleep(min(remaining, 1.0))
 
-    except Exception as e:
-      logger.log(f"API Polling Error: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
-      time.sleep(1.0)
-      
   #logger.log(f"Order {order_id} timed out (not filled)", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
   return False, 0.0
 
+def check_order_status(order_id: str) -> Tuple[str, float]:
+  """
+    Non-blocking status check (harvest limit order in ACTIVE_HUNT).
+    Reads the order registry when it is current, otherwise makes one REST lookup.
+    Same return contract as wait_for_order_fill.
+    """
+  if order_id.startswith("DRY_"):
+    return wait_for_order_fill(order_id, timeout_seconds=0)
+
+  t = _get_client()
+  stream = server_stream.ensure_account_stream(t.env)
+  order_data, _ = _current_order_state(t, order_id, stream)
+  return _order_outcome(order_id, order_data) or (False, 0.0)
+
+def modify_order(order_id: str, price: float) -> bool:
+  """Reprices a working limit/debit/credit order in place (PUT). True if the broker accepted it."""
+  t = _get_client()
+  try:
+    resp = t.put(f"/accounts/{t.account_id}/orders/{order_id}", data={'price': f"{price:.2f}"})
+    if resp.status_code == 200:
+      return True
+    logger.log(f"Modify {order_id} -> {price:.2f} failed ({resp.status_code}): {resp.text}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+  except Exception as e:
+    logger.log(f"API Error modifying order {order_id}: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+  return False
+
+def ladder_spread_order(trade_data: Dict, max_debit: float, tag: str = None, template: Dict = None) -> Tuple[Dict, Dict]:
+  """
+    Opens a debit spread near mid and walks the limit up by ENTRY_LADDER_TICK every
+    ENTRY_LADDER_STEP_SECONDS (modify-order) until it fills or reaches max_debit, all within
+    ENTRY_LADDER_BUDGET_SECONDS; an unfilled order is then canceled.
+    Returns (execution report with the settled status and fill_price, execution stats for the
+    transaction row); the stats are None when the tag recovered an earlier live order, which is
+    returned untouched.
+    """
+  long_leg, short_leg = trade_data['long_leg_data'], trade_data['short_leg_data']
+  mid = ((long_leg['bid'] + long_leg['ask']) - (short_leg['bid'] + short_leg['ask'])) / 2.0
+  tick = config.ENTRY_LADDER_TICK
+  start_px = min(math.ceil(round(mid / tick, 6)) * tick, max_debit)
+  rungs = int(round((max_debit - start_px) / tick)) if max_debit > start_px else 0
+  prices = [round(start_px + i * tick, 2) for i in range(rungs + 1)]
+
+  start = time.time()
+  order_res = open_spread_position(dict(trade_data, debit=prices[0]), is_debit=True, tag=tag, template=template)
+  if order_res.get('recovered'):
+    return order_res, None  # an earlier order under this tag, not priced from these legs: never reprice it
+  order_id = order_res['id']
+  steps = [{'price': prices[0], 'at': 0.0, 'ack_ms': round((time.time() - start) * 1000, 1)}]
+  status, fill_px = False, 0.0
+
+  for i, price in enumerate(prices):
+    if i > 0:
+      sent = time.time()
+      if not modify_order(order_id, price):
+        break  # filled/canceled meanwhile, or rejected: settle below
+      steps.append({'price': price, 'at': round(sent - start, 3), 'ack_ms': round((time.time() - sent) * 1000, 1)})
+    remaining = config.ENTRY_LADDER_BUDGET_SECONDS - (time.time() - start)
+    if remaining <= 0:
+      break
+    # Last rung keeps the rest of the budget
+    wait = remaining if i == len(prices) - 1 else min(config.ENTRY_LADDER_STEP_SECONDS, remaining)
+    status, fill_px = wait_for_order_fill(order_id, wait)
+    if status:
+      break
+
+  if not status:
+    cancel_order(order_id)
+    status, fill_px = check_order_status(order_id)  # it may have filled while the cancel was in flight
+
+  filled = status == 'filled'
+  execution = {
+    'fill_latency': round(time.time() - start, 3) if filled else None,
+    'slippage': round(fill_px - mid, 4) if filled else None,
+    'ladder_steps': {'mid': round(mid, 4), 'natural': trade_data.get('debit'), 'steps': steps, 'status': status or 'open'}
+  }
+  order_res = dict(order_res, status=status or order_res.get('status'), price=steps[-1]['price'], fill_price=fill_px)
+  logger.log(f"Ladder {order_id}: {status or 'unresolved'} after {len(steps)} rung(s), {time.time() - start:.1f}s "
+             f"(mid {mid:.2f}, last {steps[-1]['price']:.2f}, fill {fill_px:.2f})",
+             level=config.LOG_INFO,
+             source=config.LOG_SOURCE_API)
+  return order_res, execution
+
+def requote_spread_candidate(trade_data: Dict, t: BrokerTransport = None) -> Optional[Dict]:
+  """
+    Re-prices a ranked fallback pair (server_libs.calculate_scalpel_strikes) from one
+    /markets/quotes call for just its two legs. Returns a copy with fresh legs, debit
+    (Ask on Long, Bid on Short) and quote_time, or None if either leg came back unquoted.
+    """
+  t = t or _get_client()
+  long_leg, short_leg = trade_data['long_leg_data'], trade_data['short_leg_data']
+  with request_priority(config.PRIORITY_ORDER):
+    quotes, errors = get_quotes_batch([long_leg['symbol'], short_leg['symbol']], t=t)
+  if errors:
+    logger.log(f"Re-quote of {long_leg['symbol']}/{short_leg['symbol']} failed: {errors}",
+               level=config.LOG_WARNING,
+               source=config.LOG_SOURCE_API)
+    return None
+
+  fresh = OptionChainFrame.from_options([
+    dict(leg, **{k: quotes[leg['symbol']][k] for k in _REQUOTE_FIELDS if k in quotes[leg['symbol']]})
+    for leg in (long_leg, short_leg)
+  ])
+  # Older leg's quote time; receipt time when the broker sent none
+  stamps = [float(s) for s in fresh.quote_time if not math.isnan(s)]
+  return dict(trade_data,
+              long_leg_data=fresh.leg(0),
+              short_leg_data=fresh.leg(1),
+              debit=round(float(fresh.ask_or_last()[0] - fresh.bid_or_last()[1]), 2),
+              quote_time=min(stamps) if stamps else time.time())
+
+def order_tag(cycle_id, trade_id, action: str, session_date: dt.date = None) -> str:
+  """
+    Deterministic client tag for one order intent (cycle + trade + action + day).
+    Tradier tags allow letters, digits and dashes only; the hash keeps Anvil row ids out of it.
+    """
+  session_date = session_date or dt.date.today()
+  raw = f"{server_env.current_env()}|{cycle_id}|{trade_id or 'new'}|{action}|{session_date:%Y%m%d}"
+  digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+  return f"{action.lower().replace('_', '-')}-{digest}"
+
+def find_order_by_tag(tag: str, t: BrokerTransport = None) -> Optional[Dict]:
+  """
+    Today's broker order carrying `tag`: a live or filled one if any, else the newest.
+    Raises on transport errors (callers must not assume "not found").
+    """
+  t = t or _get_client()
+  with request_priority(config.PRIORITY_ORDER):
+    resp = t.get(f"/accounts/{t.account_id}/orders", params={'includeTags': 'true'})
+  resp.raise_for_status()
+  container = resp.json().get('orders')  # 'null' when there are none today
+  orders = container.get('order') or [] if isinstance(container, dict) else []
+  if isinstance(orders, dict):
+    orders = [orders]
+  matches = sorted((o for o in orders if o.get('tag') == tag), key=lambda o: int(o.get('id') or 0), reverse=True)
+  live = [o for o in matches if o.get('status') not in _DEAD_ORDER_STATUSES]
+  return (live or matches or [None])[0]
+
 def cancel_order(order_id: str) -> bool:
   """
     Cancels a specific order.
     Returns True if successful (or already gone), False if failed.
     """
   t = _get_client()
-  url = f"{t.endpoint}/accounts/{t.default_account_id}/orders/{order_id}"
+  path = f"/accounts/{t.account_id}/orders/{order_id}"
 
   try:
     logger.log(f"Canceling Order {order_id}...", level=config.LOG_INFO, source=config.LOG_SOURCE_API)
-    resp = t.session.delete(url, headers={'Accept': 'application/json'})
+    resp = t.delete(path)
 
     # 200 OK means successfully cancelled
     if resp.status_code == 200:
@@ -580,10 +879,13 @@ def cancel_order(order_id: str) -> bool:
     
 # --- PRIVATE HELPERS ---
 
-def _submit_order(t: TradierAPI, payload: Dict, is_dry_run:bool=False) -> Dict:
+def _submit_order(t: BrokerTransport, payload: Dict, is_dry_run:bool=False, tag: str = None) -> Dict:
   """
     Raw POST to /accounts/{id}/orders
     Returns normalized execution report.
+    With a tag (order_tag), the intent is recorded first and the order is idempotent:
+    an earlier live/filled order with the same tag is returned instead of a new POST,
+    and a POST that fails in transit is only retried once a by-tag lookup finds nothing.
     """
   if is_dry_run:
     logger.log(f"DRY RUN: Order Suppressed -> {payload}", 
@@ -599,48 +901,126 @@ def _submit_order(t: TradierAPI, payload: Dict, is_dry_run:bool=False) -> Dict:
       'time': dt.datetime.now(dt.timezone.utc)
     }
     
-  url = f"{t.endpoint}/accounts/{t.default_account_id}/orders"
+  path = f"/accounts/{t.account_id}/orders"
+  # Connect the order event stream before the order exists, so its fill event is not missed
+  server_stream.ensure_account_stream(t.env)
+
+  idempotent = bool(tag) and payload.get('preview') != 'true'
+  if idempotent:
+    payload['tag'] = tag
+    existing = _recover_tagged_order(t, tag, payload)
+    if existing:
+      return existing
+    server_db.save_order_intent(tag, t.env, payload)
+  attempts = config.ORDER_SUBMIT_ATTEMPTS if idempotent else 1
+
+  for attempt in range(attempts):
+    try:
+      logger.log(f"Submitting Order -> {payload}", level=config.LOG_INFO, source=config.LOG_SOURCE_API)
+      resp = t.post(path, data=payload)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+      if not idempotent:
+        logger.log(f"API Execution Error: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+        raise e
+      # The broker may have accepted it anyway: look it up by tag before any resubmit
+      logger.log(f"Order {tag} POST failed ({e}); checking broker by tag...", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+      time.sleep(config.ORDER_TAG_LOOKUP_DELAY_SECONDS)
+      found = find_order_by_tag(tag, t)
+      if found and found.get('status') not in _DEAD_ORDER_STATUSES:
+        return _tagged_order_report(t, tag, found, payload)
+      if attempt == attempts - 1:
+        server_db.update_order_intent(tag, status='unknown')
+        raise e
+      continue
 
-  try:
-    logger.log(f"Submitting Order -> {payload}", level=config.LOG_INFO, source=config.LOG_SOURCE_API)
-    resp = t.session.post(url, data=payload, headers={'accept': 'application/json'})
-    if resp.status_code == 500 and "sandbox" in t.endpoint:
-      logger.log("WARNING: Tradier Sandbox 500 Error (Known Glitch). Bypassing...", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
-      return {
-        'id': f"FAKE_{dt.datetime.now().strftime('%H%M%S')}",
-        'status': 'filled', # Pretend it filled
-        'price': float(payload.get('price', 0) or 0),
+    try:
+      if resp.status_code == 500 and "sandbox" in t.endpoint:
+        logger.log("WARNING: Tradier Sandbox 500 Error (Known Glitch). Bypassing...", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+        return {
+          'id': f"FAKE_{dt.datetime.now().strftime('%H%M%S')}",
+          'status': 'filled', # Pretend it filled
+          'price': float(payload.get('price', 0) or 0),
+          'time': dt.datetime.now()
+        }
+        # --- SANDBOX BYPASS END ---
+      if resp.status_code >= 400:
+        logger.log(f"API FAILED ({resp.status_code}): {resp.text}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+
+      resp.raise_for_status()
+
+      data = resp.json()
+      order_info = data.get('order', {})
+      if order_info.get('id') and payload.get('preview') != 'true':
+        server_stream.get_order_registry(t.env).track(order_info['id'], order_info.get('status') or 'pending')
+      if idempotent:
+        server_db.update_order_intent(tag, status='submitted', order_id=str(order_info.get('id')))
+
+      report = {
+        'id': str(order_info.get('id')),
+        'status': order_info.get('status'),
+        'price': float(payload.get('price', 0) or 0), # Estimated fill price
         'time': dt.datetime.now()
       }
-      # --- SANDBOX BYPASS END ---
-    if resp.status_code >= 400:
-      logger.log(f"API FAILED ({resp.status_code}): {resp.text}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+      if payload.get('preview') == 'true':
+        report['preview'] = dict(order_info, errors=data.get('errors') or order_info.get('errors'))
+      return report
+  
+    except requests.exceptions.HTTPError as e:
+      logger.log(f"API HTTP Error: {e.response.text}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+      if idempotent:
+        server_db.update_order_intent(tag, status='rejected')
+      raise e
+  
+    except Exception as e:
+      logger.log(f"API Execution Error: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+      raise e
 
-    resp.raise_for_status()
+def _recover_tagged_order(t: BrokerTransport, tag: str, payload: Dict) -> Optional[Dict]:
+  """
+    Report for an earlier live/filled order with this tag, or None if it is safe to submit.
+    Only asks the broker when an intent was already recorded (i.e. this is a resubmit).
+    """
+  if not server_db.get_order_intent(tag):
+    return None
+  found = find_order_by_tag(tag, t)
+  if not found or found.get('status') in _DEAD_ORDER_STATUSES:
+    return None
+  logger.log(f"Order {tag} already at broker as {found.get('id')} ({found.get('status')}); not resubmitting",
+             level=config.LOG_WARNING,
+             source=config.LOG_SOURCE_API)
+  return _tagged_order_report(t, tag, found, payload)
 
-    data = resp.json()
-    order_info = data.get('order', {})
+def _tagged_order_report(t: BrokerTransport, tag: str, order: Dict, payload: Dict) -> Dict:
+  """
+    Execution report (same shape as a fresh submit) for an order found by tag, flagged
+    'recovered': it was built from an earlier payload, so its legs and price may differ.
+    """
+  order_id = str(order.get('id'))
+  server_stream.get_order_registry(t.env).apply(order)
+  server_db.update_order_intent(tag, status='submitted', order_id=order_id)
+  return {
+    'id': order_id,
+    'status': order.get('status'),
+    'price': float(payload.get('price', 0) or 0),
+    'time': dt.datetime.now(),
+    'recovered': True
+  }
 
-    return {
-      'id': str(order_info.get('id')),
-      'status': order_info.get('status'),
-      'price': float(payload.get('price', 0) or 0), # Estimated fill price
-      'time': dt.datetime.now()
-    }
-  
-  except requests.exceptions.HTTPError as e:
-    logger.log(f"API HTTP Error: {e.response.text}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
-    raise e
-  
-  except Exception as e:
-    logger.log(f"API Execution Error: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
-    raise e
+def _fetch_clock(t: BrokerTransport) -> Dict:
+  """Raw /markets/clock body; raises so a failed lookup is never cached."""
+  response = t.get("/markets/clock")
+  response.raise_for_status()
+  return response.json().get('clock', {})
 
-def _get_quote_direct(t: TradierAPI, symbol: str, greeks: bool=False) -> Optional[Dict]:
+def _get_quote_direct(t: BrokerTransport, symbol: str, greeks: bool=False) -> Optional[Dict]:
   """Your robust quote fetcher"""
+  if not greeks and server_stream.ensure_market_stream([symbol], t.env):
+    streamed = server_stream.get_quote_book(t.env).get(symbol, config.STREAM_MAX_QUOTE_AGE_SECONDS, fields=('last',))
+    if streamed:
+      return streamed
   try:
     params = {'symbols': symbol, 'greeks': str(greeks).lower()}
-    resp = t.session.get(f"{t.endpoint}/markets/quotes", params=params, headers={'Accept': 'application/json'})
+    resp = t.get("/markets/quotes", params=params)
     data = resp.json()
 
     quotes = data.get('quotes', {}).get('quote')
@@ -651,4 +1031,194 @@ def _get_quote_direct(t: TradierAPI, symbol: str, greeks: bool=False) -> Optiona
 
     return None
   except Exception:
-    return None
\ No newline at end of file
+    return None
+
+def _fetch_quote_chunk(t: BrokerTransport, symbols: List[str], greeks: bool) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+  """One /markets/quotes request. Never raises: failures come back as per-symbol errors."""
+  try:
+    resp = t.get("/markets/quotes", params={'symbols': ",".join(symbols), 'greeks': str(greeks).lower()})
+    resp.raise_for_status()
+    body = resp.json().get('quotes') or {}
+  except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+    reason = f"{type(e).__name__}: {e}"
+    return {}, {s: reason for s in symbols}
+
+  raw_quotes = body.get('quote') or []
+  if isinstance(raw_quotes, dict):
+    raw_quotes = [raw_quotes]
+  quotes = {q['symbol']: q for q in raw_quotes if isinstance(q, dict) and q.get('symbol')}
+  errors = {s: 'unmatched' for s in symbols if s not in quotes}
+  return quotes, errors
+
+def _get_shortlist_chain(t: BrokerTransport, symbols: List[str]) -> List[Dict]:
+  """Shortlisted options re-quoted and normalised like a chain (greeks are not needed for selection)."""
+  quotes, errors = get_quotes_batch(symbols, t=t)
+  if not quotes:
+    raise requests.exceptions.RequestException(f"No shortlist quotes: {next(iter(errors.values()), 'empty')}")
+  return server_chain_decode.parse_chain({'options': {'option': list(quotes.values())}})
+
+def _read_quote_book(underlying: str, option_symbols: List[str]) -> Optional[Dict[str, Dict]]:
+  """
+    Quote map served from the streaming quote book, or None if anything is missing/stale.
+    Also (re)subscribes the symbols, so the next call can hit the book.
+    """
+  env = server_env.current_env()
+  if not server_stream.ensure_market_stream([underlying] + option_symbols, env):
+    return None
+  book = server_stream.get_quote_book(env)
+  max_age = config.STREAM_MAX_QUOTE_AGE_SECONDS
+  quotes = book.get_many([underlying], max_age, fields=('last',))
+  legs = book.get_many(option_symbols, max_age, fields=('bid', 'ask'))
+  if quotes is None or legs is None:
+    return None
+  quotes.update(legs)
+  return quotes
+
+def _current_order_state(t: BrokerTransport, order_id: str, stream) -> Tuple[Optional[Dict], bool]:
+  """
+    Latest order dict and whether it came from the event registry.
+    Falls back to GET /accounts/{id}/orders/{order_id}, which also seeds the registry.
+    """
+  registry = server_stream.get_order_registry(t.env)
+  state = registry.get(order_id)
+  if stream and stream.is_current(state):
+    return state, True
+
+  try:
+    # Fill checks share order priority: they must not queue behind dashboard reads
+    with request_priority(config.PRIORITY_ORDER):
+      resp = t.get(f"/accounts/{t.account_id}/orders/{order_id}")
+    if resp.status_code != 200:
+      return None, False
+    # Tradier structure: {'order': {'status': 'filled', ...}}
+    order_data = resp.json().get('order', {})
+  except Exception as e:
+    logger.log(f"API Polling Error: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+    return None, False
+
+  if order_data.get('id') is None:
+    order_data['id'] = order_id
+  registry.apply(order_data)
+  return order_data, False
+
+def _order_outcome(order_id: str, order_data: Optional[Dict]) -> Optional[Tuple[str, float]]:
+  """(status, fill_price) once the order is final, else None."""
+  if not order_data:
+    return None
+  status = order_data.get('status')
+  if status == 'filled':
+    fill_price = abs(float(order_data.get('avg_fill_price') or 0.0))
+    logger.log(f"Order {order_id} FILLED at ${fill_price}", 
+               level=config.LOG_INFO, 
+               source=config.LOG_SOURCE_API)
+    return 'filled', fill_price
+
+  if status in ['canceled', 'rejected', 'expired']:
+    reason = order_data.get('reason_description', 'No reason provided')
+    logger.log(f"Order {order_id} died: {status.upper()} - {reason}", 
+               level=config.LOG_WARNING, 
+               source=config.LOG_SOURCE_API)
+    return status, 0.0
+  return None
+
+def _chain_key(t: BrokerTransport, symbol: str, date: dt.date, greeks: bool, near: Optional[float]) -> Tuple:
+  """Chain cache key: (symbol, expiration, greeks, strike window, roots, env)."""
+  return (symbol, date.strftime('%Y-%m-%d'), greeks, _strike_window(near), config.CHAIN_ROOTS.get(symbol), t.env)
+
+def _get_cached_chain(t: BrokerTransport, symbol: str, date: dt.date, greeks: bool = True, near: float = None,
+                      download: Future = None, spot: float = None) -> List[Dict]:
+  """
+    Decoded chain via the TTL cache, keyed by _chain_key.
+    Expirations before today are evicted first so the cache rolls with the date.
+    download: a pending _fetch_option_chain to decode on a miss instead of fetching here.
+    spot: underlying price for local greeks (default `near`, else one quote).
+    Raises on transport errors (safe to call from worker threads).
+    """
+  today_str = dt.date.today().strftime('%Y-%m-%d')
+  _CHAIN_CACHE.evict(lambda key: key[1] < today_str)
+  key = _chain_key(t, symbol, date, greeks, near)
+  window, roots = key[3], key[4]
+
+  chain = _CHAIN_CACHE.get(key, lambda: _load_chain(t, symbol, date, greeks, window, roots, spot or near, download))
+  # Shallow copy: callers sort/filter their own list, the cached one stays intact
+  return list(chain)
+
+def _load_chain(t: BrokerTransport, symbol: str, date: dt.date, greeks: bool, window, roots, spot: Optional[float],
+                download: Future = None) -> List[Dict]:
+  """
+    Fetch (or a pending download's result) + decode for the chain cache. With greeks, options
+    that came without them are priced locally (server_pricing); under PRICING_LOCAL_GREEKS the
+    broker is not asked at all. Every download also feeds the IV surface (server_volsurface)
+    when the spot is known.
+    """
+  broker_greeks = greeks and not config.PRICING_LOCAL_GREEKS
+  payload = download.result() if download else _fetch_option_chain(t, symbol, date, broker_greeks)
+  options = server_chain_decode.decode_chain(payload, window, roots)
+  if greeks:
+    spot = spot or float((_get_quote_direct(t, symbol) or {}).get('last') or 0)
+    server_pricing.fill_missing_greeks(options, spot)
+  if config.VOL_SURFACE_ENABLED and spot:
+    server_volsurface.update_from_chain(symbol, options, spot)
+  return options
+
+def _fetch_option_chain(t: BrokerTransport, symbol: str, date: dt.date, greeks: bool = True) -> bytes:
+  """Raw GET of the chain payload, undecoded. Raises on transport errors and error statuses."""
+  params = {'symbol': symbol, 'expiration': date.strftime('%Y-%m-%d'), 'greeks': str(greeks).lower()}
+  resp = t.get("/markets/options/chains", params=params)
+  resp.raise_for_status()  # a fault body would decode to an empty chain
+  return resp.content
+
+def _strike_window(near: Optional[float]) -> Optional[Tuple[float, float]]:
+  """
+    (low, high) strikes around a reference price, rounded outward to a coarse step
+    (100 for SPX, 10 for SPY) so the cache key only changes when price moves a lot.
+    """
+  if not near or near <= 0:
+    return None
+  step = 10 ** math.floor(math.log10(near)) / 10
+  low = math.floor(near * (1 - config.CHAIN_STRIKE_WINDOW_PCT) / step) * step
+  high = math.ceil(near * (1 + config.CHAIN_STRIKE_WINDOW_PCT) / step) * step
+  return (low, high)
+
+def _get_timesales(t: BrokerTransport, symbol: str, day: dt.date, start: str = None) -> List[Dict]:
+  """Regular-session 1-minute bars for a day, from `start` ('YYYY-MM-DD HH:MM', default the open). Raises on transport errors."""
+  day_str = day.strftime('%Y-%m-%d')
+  params = {
+    'symbol': symbol,
+    'interval': '1min',
+    'start': start or f"{day_str} 09:30",
+    'end': f"{day_str} 16:00",
+    'session_filter': 'open'
+  }
+  # Endpoint: /v1/markets/timesales
+  resp = t.get("/markets/timesales", params=params)
+  history = (resp.json().get('series') or {}).get('data', [])
+  if isinstance(history, dict): 
+    history = [history]
+  return history or []
+
+def _load_vwap(symbol: str, day: dt.date) -> VwapAccumulator:
+  return VwapAccumulator.from_state(symbol, day, server_db.get_vwap_state(server_env.current_env(), symbol, day))
+
+def _update_vwap(acc: VwapAccumulator, bars: List[Dict]) -> None:
+  """Folds freshly fetched bars and persists the accumulator if any bar was committed."""
+  if acc.fold(bars):
+    server_db.save_vwap_state(server_env.current_env(), acc.symbol, acc.session_date, acc.to_state())
+
+def _build_scalpel_environment(vix_quote: Optional[Dict], acc: VwapAccumulator) -> dict:
+  """VIX + session VWAP from the intraday accumulator."""
+  vix_price = float((vix_quote or {}).get('last') or 0)
+  vwap = acc.vwap
+  current_price = acc.last_price # Most recent bar is current price
+
+  vwap_pct = (current_price - vwap) / vwap if vwap > 0 else None
+  return_dict = {
+    'vix': vix_price,
+    'vwap': round(vwap, 2),
+    'price': current_price,
+    'is_bullish': vwap_pct >= 0,
+    'vwp_pct': vwap_pct
+  }
+  print(f'vwap: {return_dict}')
+
+  return return_dict
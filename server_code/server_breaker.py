@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import requests
+
+from shared import config
+from .server_ratelimit import endpoint_class
+
+# Circuit states
+CLOSED = 'closed'        # calls flow; outcomes are counted
+OPEN = 'open'            # calls fail fast with BrokerUnavailable until the cooldown ends
+HALF_OPEN = 'half_open'  # a few probe calls decide between CLOSED and OPEN
+
+class BrokerUnavailable(requests.exceptions.RequestException):
+  """Raised instead of calling the broker while an endpoint class's circuit is open."""
+
+class CircuitBreaker:
+  """
+    Failure-rate breaker for one endpoint class (market_data / trading / account).
+    Trips when at least BREAKER_FAILURE_RATE of the calls in the last BREAKER_WINDOW_SECONDS
+    failed (network errors, timeouts, 5xx), with BREAKER_MIN_CALLS or more in the window.
+    After BREAKER_COOLDOWN_SECONDS it lets BREAKER_HALF_OPEN_PROBES calls through:
+    a success closes it, a failure re-opens it.
+    Times are wall-clock so the state can be shared between processes: on_change(name, state)
+    is called with to_state() after every transition and every failure, and from_state()
+    restores it (server_transport.persist_breakers).
+    """
+  def __init__(self, name: str, on_change: Callable[[str, Dict], None] = None):
+    self.name = name
+    self.on_change = on_change
+    self._state = CLOSED
+    self._opened_at = 0.0
+    self._probes = 0
+    self._probe_at = 0.0
+    self._outcomes = deque()  # (epoch time, ok)
+    self._lock = threading.Lock()
+    self._stats = {'trips': 0, 'rejected': 0, 'failures': 0}
+
+  def allow(self) -> bool:
+    """True if a call may go out now (in half-open, only while probe slots remain)."""
+    now = time.time()
+    with self._lock:
+      state = self._current_state(now)
+      if state == CLOSED:
+        return True
+      # A slot held longer than a cooldown belongs to a process that died mid-probe
+      if state == HALF_OPEN and now - self._probe_at >= config.BREAKER_COOLDOWN_SECONDS:
+        self._probes = 0
+      if state == HALF_OPEN and self._probes < config.BREAKER_HALF_OPEN_PROBES:
+        self._state = HALF_OPEN
+        self._probes += 1
+        self._probe_at = now
+        changed = self._snapshot()
+      else:
+        self._stats['rejected'] += 1
+        return False
+    self._notify(changed)
+    return True
+
+  def record(self, ok: bool) -> None:
+    now = time.time()
+    changed = None
+    with self._lock:
+      if not ok:
+        self._stats['failures'] += 1
+      if self._state == HALF_OPEN:
+        self._probes = max(self._probes - 1, 0)
+        if ok:
+          self._state = CLOSED
+          self._outcomes.clear()
+        else:
+          self._trip(now)
+        changed = self._snapshot()
+      elif self._state == CLOSED:  # OPEN: a call that started before the trip
+        self._outcomes.append((now, ok))
+        self._prune(now)
+        calls = len(self._outcomes)
+        failures = sum(1 for _, good in self._outcomes if not good)
+        if calls >= config.BREAKER_MIN_CALLS and failures / calls >= config.BREAKER_FAILURE_RATE:
+          self._trip(now)
+        if not ok:
+          changed = self._snapshot()
+    self._notify(changed)
+
+  def to_state(self) -> Dict:
+    with self._lock:
+      return self._snapshot()
+
+  def from_state(self, state: Optional[Dict]) -> None:
+    """Restores a persisted to_state() (no-op for None)."""
+    if not state:
+      return
+    with self._lock:
+      self._state = state.get('state') or CLOSED
+      self._opened_at = float(state.get('opened_at') or 0.0)
+      self._probes = int(state.get('probes') or 0)
+      self._probe_at = float(state.get('probe_at') or 0.0)
+      self._outcomes = deque((float(t), bool(ok)) for t, ok in (state.get('outcomes') or []))
+      self._prune(time.time())
+
+  @property
+  def state(self) -> str:
+    with self._lock:
+      return self._current_state(time.time())
+
+  def stats(self) -> Dict:
+    with self._lock:
+      now = time.time()
+      self._prune(now)
+      data = dict(self._stats)
+      data.update({
+        'name': self.name,
+        'state': self._current_state(now),
+        'window_calls': len(self._outcomes),
+        'window_failures': sum(1 for _, good in self._outcomes if not good),
+        'retry_in': round(max(self._opened_at + config.BREAKER_COOLDOWN_SECONDS - now, 0.0), 1) if self._state == OPEN else 0.0
+      })
+    return data
+
+  def _snapshot(self) -> Dict:
+    return {
+      'state': self._state,
+      'opened_at': self._opened_at,
+      'probes': self._probes,
+      'probe_at': self._probe_at,
+      'outcomes': [[t, ok] for t, ok in self._outcomes]
+    }
+
+  def _notify(self, state: Optional[Dict]) -> None:
+    if state is not None and self.on_change:
+      self.on_change(self.name, state)
+
+  def _current_state(self, now: float) -> str:
+    """OPEN reads as HALF_OPEN once the cooldown is over (the next allow() takes a probe slot)."""
+    if self._state == OPEN and now - self._opened_at >= config.BREAKER_COOLDOWN_SECONDS:
+      return HALF_OPEN
+    return self._state
+
+  def _trip(self, now: float) -> None:
+    self._state = OPEN
+    self._opened_at = now
+    self._probes = 0
+    self._outcomes.clear()
+    self._stats['trips'] += 1
+
+  def _prune(self, now: float) -> None:
+    horizon = now - config.BREAKER_WINDOW_SECONDS
+    while self._outcomes and self._outcomes[0][0] < horizon:
+      self._outcomes.popleft()
+
+class BreakerSet:
+  """One CircuitBreaker per endpoint class, keyed like the rate-limit buckets."""
+  def __init__(self):
+    self.breakers = {name: CircuitBreaker(name) for name in config.RATE_LIMITS}
+
+  def share(self, states: Dict[str, Dict], on_change: Callable[[str, Dict], None]) -> None:
+    """Restores persisted states ({endpoint class: to_state()}) and reports every change to on_change."""
+    for name, breaker in self.breakers.items():
+      breaker.from_state(states.get(name))
+      breaker.on_change = on_change
+
+  def allow(self, method: str, path: str) -> bool:
+    if not config.BREAKER_ENABLED:
+      return True
+    return self.breakers[endpoint_class(method, path)].allow()
+
+  def record(self, method: str, path: str, ok: bool) -> None:
+    if config.BREAKER_ENABLED:
+      self.breakers[endpoint_class(method, path)].record(ok)
+
+  def states(self) -> Dict[str, str]:
+    return {name: breaker.state for name, breaker in self.breakers.items()}
+
+  def stats(self) -> Dict[str, Dict]:
+    return {name: breaker.stats() for name, breaker in self.breakers.items()}
@@ -0,0 +1,107 @@
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from shared import config
+from . import server_logging as logger
+
+class TTLCache:
+  """
+    Small in-process cache with stale-while-revalidate.
+    - age <= ttl: served as a hit.
+    - ttl < age <= ttl + stale: served as-is while one background thread reloads it.
+    - older (or absent): loaded synchronously by the caller.
+    Loader errors on a synchronous load propagate; background errors keep the stale value
+    and are logged by the next get() (the refresh thread itself never logs).
+    keep_empty=False: empty (falsy) values are returned but not stored.
+    """
+  def __init__(self, name: str, ttl_seconds: float, stale_seconds: float = 0.0, keep_empty: bool = True):
+    self.name = name
+    self.ttl_seconds = ttl_seconds
+    self.stale_seconds = stale_seconds
+    self.keep_empty = keep_empty
+    self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+    self._refreshing = set()
+    self._refresh_failures: Dict[Hashable, Exception] = {}
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0, 'evictions': 0}
+
+  def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+    self._log_refresh_failures()
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        age = now - entry[0]
+        if age <= self.ttl_seconds:
+          self._stats['hits'] += 1
+          return entry[1]
+        if age <= self.ttl_seconds + self.stale_seconds:
+          self._stats['stale_hits'] += 1
+          if key not in self._refreshing:
+            self._refreshing.add(key)
+            # Caller's context (environment, request priority) goes with the refresh
+            threading.Thread(target=contextvars.copy_context().run, args=(self._refresh, key, loader), daemon=True).start()
+          return entry[1]
+      self._stats['misses'] += 1
+
+    value = loader()
+    self.put(key, value)
+    return value
+
+  def contains(self, key: Hashable) -> bool:
+    """True if get() would answer from the cache (fresh or stale) instead of loading."""
+    with self._lock:
+      entry = self._entries.get(key)
+      return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds + self.stale_seconds
+
+  def put(self, key: Hashable, value: Any) -> None:
+    if not value and not self.keep_empty:
+      return
+    with self._lock:
+      self._entries[key] = (time.monotonic(), value)
+
+  def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+    """Drops every key for which predicate(key) is True. Returns the count."""
+    with self._lock:
+      doomed = [k for k in self._entries if predicate(k)]
+      for k in doomed:
+        del self._entries[k]
+      self._stats['evictions'] += len(doomed)
+    return len(doomed)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      data = dict(self._stats)
+      data['size'] = len(self._entries)
+    lookups = data['hits'] + data['stale_hits'] + data['misses']
+    data['hit_rate'] = round((data['hits'] + data['stale_hits']) / lookups, 3) if lookups else 0.0
+    data['name'] = self.name
+    return data
+
+  def _refresh(self, key: Hashable, loader: Callable[[], Any]) -> None:
+    try:
+      self.put(key, loader())
+      with self._lock:
+        self._stats['refreshes'] += 1
+    except Exception as e:
+      with self._lock:
+        self._stats['refresh_errors'] += 1
+        self._refresh_failures[key] = e
+    finally:
+      with self._lock:
+        self._refreshing.discard(key)
+
+  def _log_refresh_failures(self) -> None:
+    """Logs background refresh errors from the calling thread (logging may write to the DB)."""
+    with self._lock:
+      if not self._refresh_failures:
+        return
+      failures, self._refresh_failures = self._refresh_failures, {}
+    for key, e in failures.items():
+      logger.log(f"{self.name} cache refresh failed for {key}: {e}", level=config.LOG_DEBUG, source=config.LOG_SOURCE_API)
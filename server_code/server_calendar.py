@@ -0,0 +1,154 @@
+import datetime as dt
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+from shared import config
+
+# NYSE full-day holidays and 13:00 early closes, derived from the exchange rules
+# so no year-specific list needs maintaining. Ad-hoc closures (national days of
+# mourning, weather) are not predictable; the broker clock still covers those.
+
+# --- HOLIDAY RULES ---
+
+@lru_cache(maxsize=16)
+def holidays(year: int) -> Dict[dt.date, str]:
+  """Full-day NYSE closures for a year, keyed by the observed date."""
+  days = {
+    _observed(dt.date(year, 1, 1), allow_friday=False): "New Year's Day",
+    _nth_weekday(year, 1, 0, 3): 'Martin Luther King Jr. Day',
+    _nth_weekday(year, 2, 0, 3): "Washington's Birthday",
+    _easter(year) - dt.timedelta(days=2): 'Good Friday',
+    _last_weekday(year, 5, 0): 'Memorial Day',
+    _observed(dt.date(year, 7, 4)): 'Independence Day',
+    _nth_weekday(year, 9, 0, 1): 'Labor Day',
+    _nth_weekday(year, 11, 3, 4): 'Thanksgiving Day',
+    _observed(dt.date(year, 12, 25)): 'Christmas Day',
+  }
+  if year >= 2022:
+    days[_observed(dt.date(year, 6, 19))] = 'Juneteenth'
+  # A Saturday New Year's Day is not made up on the prior Friday, so _observed gave None
+  days.pop(None, None)
+  return days
+
+@lru_cache(maxsize=16)
+def early_closes(year: int) -> Dict[dt.date, dt.time]:
+  """13:00 closes: July 3 and Christmas Eve (Mon-Thu only), and the day after Thanksgiving."""
+  closes = {}
+  for day in (dt.date(year, 7, 3), dt.date(year, 12, 24)):
+    if day.weekday() <= 3 and day not in holidays(year):
+      closes[day] = config.MARKET_EARLY_CLOSE_TIME
+  closes[_nth_weekday(year, 11, 3, 4) + dt.timedelta(days=1)] = config.MARKET_EARLY_CLOSE_TIME
+  return closes
+
+def is_holiday(day: dt.date) -> bool:
+  return day in holidays(day.year)
+
+def is_trading_day(day: dt.date) -> bool:
+  return day.weekday() < 5 and not is_holiday(day)
+
+def is_short_day(day: dt.date) -> bool:
+  return is_trading_day(day) and day in early_closes(day.year)
+
+def close_time(day: dt.date) -> Optional[dt.time]:
+  """Regular-session close for a trading day; None when the market is shut all day."""
+  if not is_trading_day(day):
+    return None
+  return early_closes(day.year).get(day, config.MARKET_CLOSE_TIME)
+
+def next_trading_day(day: dt.date) -> dt.date:
+  day += dt.timedelta(days=1)
+  while not is_trading_day(day):
+    day += dt.timedelta(days=1)
+  return day
+
+# --- LOCAL CLOCK ---
+
+def local_clock(now: dt.datetime) -> Dict:
+  """
+    Calendar-only equivalent of Tradier's /markets/clock for a naive ET wall-clock time.
+    Only regular-session states are modelled ('open' / 'closed').
+    """
+  today = now.date()
+  close_t = close_time(today)
+  if close_t and config.MARKET_OPEN_TIME <= now.time() < close_t:
+    return {'state': 'open', 'next_change': close_t.strftime('%H:%M'), 'next_state': 'closed'}
+  return {'state': 'closed', 'next_change': config.MARKET_OPEN_TIME.strftime('%H:%M'), 'next_state': 'open'}
+
+# --- BROKER CLOCK CACHE ---
+
+# env -> (expires_at_monotonic, clock_dict)
+_CLOCK_CACHE: Dict[str, tuple] = {}
+_CLOCK_LOCK = threading.Lock()
+
+def get_clock(env: str, now: dt.datetime, fetcher: Callable[[], Dict]) -> Dict:
+  """
+    Broker clock, fetched at most once per state: the response is reused until its
+    'next_change' wall time (capped at CLOCK_CACHE_MAX_SECONDS). fetcher() errors propagate.
+    """
+  with _CLOCK_LOCK:
+    cached = _CLOCK_CACHE.get(env)
+    if cached and time.monotonic() < cached[0]:
+      return cached[1]
+
+  clock = fetcher()
+  ttl = min(_seconds_until(now, clock.get('next_change')), config.CLOCK_CACHE_MAX_SECONDS)
+  with _CLOCK_LOCK:
+    _CLOCK_CACHE[env] = (time.monotonic() + ttl, clock)
+  return clock
+
+def reset_clock_cache() -> None:
+  with _CLOCK_LOCK:
+    _CLOCK_CACHE.clear()
+
+# --- PRIVATE HELPERS ---
+
+def _seconds_until(now: dt.datetime, hhmm: Optional[str]) -> float:
+  """
+    Seconds from now until the next occurrence of 'HH:MM' (today, else tomorrow).
+    0 (don't cache) if unparseable, or if the change time has only just passed:
+    the broker may not have flipped state yet and must be asked again.
+    """
+  try:
+    h, m = map(int, str(hhmm).split(':')[:2])
+  except ValueError:
+    return 0.0
+  target = dt.datetime.combine(now.date(), dt.time(h, m))
+  if target <= now:
+    if (now - target).total_seconds() < 300:
+      return 0.0
+    target += dt.timedelta(days=1)
+  return (target - now).total_seconds()
+
+def _observed(day: dt.date, allow_friday: bool = True) -> Optional[dt.date]:
+  """Saturday holidays move to Friday, Sunday holidays to Monday."""
+  if day.weekday() == 5:
+    return day - dt.timedelta(days=1) if allow_friday else None
+  if day.weekday() == 6:
+    return day + dt.timedelta(days=1)
+  return day
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> dt.date:
+  first = dt.date(year, month, 1)
+  offset = (weekday - first.weekday()) % 7
+  return first + dt.timedelta(days=offset + 7 * (n - 1))
+
+def _last_weekday(year: int, month: int, weekday: int) -> dt.date:
+  nxt = dt.date(year + (month == 12), month % 12 + 1, 1)
+  last = nxt - dt.timedelta(days=1)
+  return last - dt.timedelta(days=(last.weekday() - weekday) % 7)
+
+def _easter(year: int) -> dt.date:
+  """Gregorian Easter Sunday (anonymous / Meeus algorithm)."""
+  a = year % 19
+  b, c = divmod(year, 100)
+  d, e = divmod(b, 4)
+  f = (b + 8) // 25
+  g = (b - f + 1) // 3
+  h = (19 * a + b - d - g + 15) % 30
+  i, k = divmod(c, 4)
+  l = (32 + 2 * e + 2 * i - h - k) % 7
+  m = (a + 11 * h + 22 * l) // 451
+  month, day = divmod(h + l - 7 * m + 114, 31)
+  return dt.date(year, month, day + 1)
@@ -0,0 +1,212 @@
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from shared import config
+from . import server_env
+
+# Record/replay for broker HTTP traffic. A cassette is a gzip JSON-lines file:
+# one header line, then one line per request/response pair in call order.
+# The adapter sits under BrokerTransport's session, so retries, timeouts and
+# rate limiting behave exactly as they do live.
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'   # unmatched -> closest recorded response for the same method/path
+MODE_STRICT = 'strict'   # unmatched or exhausted -> CassetteMiss
+TIMING_REALTIME = 'realtime'
+TIMING_FAST = 'fast'
+
+_CASSETTE_VERSION = 1
+# Only these response headers are kept (rate-limit state and content type)
+_KEPT_HEADERS = ('Content-Type', 'X-Ratelimit-Allowed', 'X-Ratelimit-Used', 'X-Ratelimit-Available', 'X-Ratelimit-Expiry')
+
+class CassetteMiss(requests.exceptions.RequestException):
+  """No recorded response for a request (strict mode, or nothing for that endpoint at all)."""
+
+class CassetteAdapter(BaseAdapter):
+  """
+    requests transport adapter that records through a real HTTPAdapter or replays from a cassette.
+    Requests are matched on (method, path, sorted query, sorted form body); the account id
+    is normalised out of paths so cassettes are portable between accounts.
+    Repeated identical requests replay their recorded responses in order.
+    """
+  def __init__(self, path: str, mode: str = MODE_REPLAY, timing: str = TIMING_FAST,
+               account_id: str = None, live_adapter: HTTPAdapter = None):
+    super().__init__()
+    self.path = path
+    self.mode = mode
+    self.timing = timing
+    self.account_id = account_id
+    self._live = live_adapter
+    self._lock = threading.Lock()
+    self._file = None
+    self._started = time.monotonic()
+    self._queues: Dict[Tuple, deque] = defaultdict(deque)
+    self._last: Dict[Tuple, Dict] = {}
+    self._by_endpoint: Dict[Tuple[str, str], Dict] = {}
+    self.stats = {'recorded': 0, 'replayed': 0, 'fallbacks': 0, 'misses': 0, 'replay_seconds': 0.0}
+
+    if mode == MODE_RECORD:
+      self._file = gzip.open(path, 'wt', encoding='utf-8')
+      self._write({'cassette': _CASSETTE_VERSION, 'recorded_at': time.time(), 'env': server_env.current_env()})
+    else:
+      self._load()
+
+  # --- ADAPTER INTERFACE ---
+  def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+    key = self._key(request.method, request.url, request.body)
+    if self.mode == MODE_RECORD:
+      start = time.monotonic()
+      resp = self._live.send(request, stream=False, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+      self._record(key, resp, time.monotonic() - start)
+      return resp
+
+    entry = self._match(key)
+    if self.timing == TIMING_REALTIME:
+      time.sleep(entry.get('elapsed', 0.0))
+    return _build_response(request, entry)
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+    if self._live is not None:
+      self._live.close()
+
+  # --- RECORD ---
+  def _record(self, key: Tuple, resp: requests.Response, elapsed: float) -> None:
+    self._write({
+      'method': key[0],
+      'path': key[1],
+      'query': key[2],
+      'body': key[3],
+      'offset': round(time.monotonic() - self._started, 4),
+      'elapsed': round(elapsed, 4),
+      'status': resp.status_code,
+      'headers': {h: resp.headers[h] for h in _KEPT_HEADERS if h in resp.headers},
+      'text': resp.text
+    })
+    self.stats['recorded'] += 1
+
+  def _write(self, line: Dict) -> None:
+    with self._lock:
+      self._file.write(json.dumps(line, separators=(',', ':')) + '\n')
+      self._file.flush()
+
+  # --- REPLAY ---
+  def _load(self) -> None:
+    with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+      for raw in f:
+        line = json.loads(raw)
+        if 'cassette' in line:
+          continue
+        key = (line['method'], line['path'], _as_pairs(line['query']), _as_pairs(line['body']))
+        self._queues[key].append(line)
+        self._by_endpoint[(line['method'], line['path'])] = line
+
+  def _match(self, key: Tuple) -> Dict:
+    with self._lock:
+      queue = self._queues.get(key)
+      if queue:
+        entry = queue.popleft()
+        self._last[key] = entry
+        self.stats['replayed'] += 1
+      elif self.mode == MODE_STRICT:
+        self.stats['misses'] += 1
+        raise CassetteMiss(f"Unmatched request in strict replay: {key[0]} {key[1]} {dict(key[2])}")
+      elif key in self._last:
+        entry = self._last[key]
+        self.stats['replayed'] += 1
+      elif (key[0], key[1]) in self._by_endpoint:
+        entry = self._by_endpoint[(key[0], key[1])]
+        self.stats['fallbacks'] += 1
+      else:
+        self.stats['misses'] += 1
+        raise CassetteMiss(f"No recording for {key[0]} {key[1]}")
+      self.stats['replay_seconds'] += entry.get('elapsed', 0.0)
+      return entry
+
+  # --- MATCHING ---
+  def _key(self, method: str, url: str, body) -> Tuple:
+    parsed = urlparse(url)
+    path = parsed.path
+    # Endpoint prefix (/v1, /sandbox/v1 ...) is dropped: match on the API path only
+    for marker in ('/markets', '/accounts', '/user', '/beta'):
+      idx = path.find(marker)
+      if idx >= 0:
+        path = path[idx:]
+        break
+    if self.account_id:
+      path = path.replace(f'/{self.account_id}', '/{account}')
+    if isinstance(body, bytes):
+      body = body.decode('utf-8')
+    return (method, path, _as_pairs(parse_qsl(parsed.query)), _as_pairs(parse_qsl(body or '')))
+
+# --- INSTALL / CONTEXT ---
+
+def install(transport, path: str, mode: str = MODE_REPLAY, timing: str = TIMING_FAST) -> CassetteAdapter:
+  """Mounts a cassette on a BrokerTransport's session (both schemes). Returns the adapter."""
+  live = transport.session.get_adapter(transport.endpoint)
+  adapter = CassetteAdapter(path, mode, timing, account_id=transport.account_id, live_adapter=live)
+  transport.session.mount('https://', adapter)
+  transport.session.mount('http://', adapter)
+  return adapter
+
+def uninstall(transport, adapter: CassetteAdapter) -> None:
+  """Closes the cassette and restores the live pooled adapter."""
+  live = adapter._live
+  adapter._live = None
+  adapter.close()
+  transport.session.mount('https://', live)
+  transport.session.mount('http://', live)
+
+@contextmanager
+def use_cassette(path: str, mode: str = MODE_REPLAY, timing: str = TIMING_FAST, env: str = None):
+  """
+    Records or replays all broker HTTP traffic of `env` inside the block.
+    Streaming is switched off and the clock/chain caches are emptied, so recording
+    and replay issue the same REST calls. The bot's own clock is not virtualised.
+    """
+  from . import server_transport, server_calendar, server_api
+  transport = server_transport.get_transport(env)
+  server_calendar.reset_clock_cache()
+  server_api.clear_chain_cache()
+  adapter = install(transport, path, mode, timing)
+  stream_enabled = config.STREAM_ENABLED
+  config.STREAM_ENABLED = False
+  try:
+    yield adapter
+  finally:
+    config.STREAM_ENABLED = stream_enabled
+    uninstall(transport, adapter)
+
+def read_cassette(path: str) -> List[Dict]:
+  """All recorded pairs (header line excluded), e.g. for inspection in a diagnostic."""
+  with gzip.open(path, 'rt', encoding='utf-8') as f:
+    return [line for line in map(json.loads, f) if 'cassette' not in line]
+
+# --- PRIVATE HELPERS ---
+
+def _as_pairs(pairs) -> Tuple:
+  return tuple(sorted((str(k), str(v)) for k, v in pairs))
+
+def _build_response(request, entry: Dict) -> requests.Response:
+  resp = requests.Response()
+  resp.status_code = entry['status']
+  resp.headers = CaseInsensitiveDict(entry.get('headers') or {})
+  resp._content = entry.get('text', '').encode('utf-8')
+  resp.encoding = 'utf-8'
+  resp.url = request.url
+  resp.request = request
+  resp.reason = 'REPLAYED'
+  return resp
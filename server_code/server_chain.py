@@ -0,0 +1,201 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
+
+class OptionChainFrame:
+  """
+    Struct-of-arrays option chain.
+    Parallel NumPy arrays (strike, bid, ask, last, delta, quote_time, option_type, root) share one
+    row index; symbols and the original option dicts live in side arrays for order/DB code.
+    Missing prices are stored as 0.0, missing deltas and quote times as NaN.
+    """
+  def __init__(self, records: List[Dict]):
+    n = len(records)
+    self.records = records
+    self.symbol = np.empty(n, dtype=object)
+    self.strike = np.zeros(n, dtype=np.float64)
+    self.bid = np.zeros(n, dtype=np.float64)
+    self.ask = np.zeros(n, dtype=np.float64)
+    self.last = np.zeros(n, dtype=np.float64)
+    self.delta = np.full(n, np.nan, dtype=np.float64)
+    self.quote_time = np.full(n, np.nan, dtype=np.float64)  # epoch seconds of the newer of bid/ask
+    option_type = []
+    root = []
+
+    for i, opt in enumerate(records):
+      self.symbol[i] = opt.get('symbol')
+      self.strike[i] = _num(opt.get('strike'))
+      self.bid[i] = _num(opt.get('bid'))
+      self.ask[i] = _num(opt.get('ask'))
+      self.last[i] = _num(opt.get('last'))
+      self.delta[i] = _num(opt.get('delta'), np.nan)
+      # Tradier bid_date / ask_date are epoch milliseconds
+      stamp = max(_num(opt.get('bid_date')), _num(opt.get('ask_date')))
+      if stamp > 0:
+        self.quote_time[i] = stamp / 1000.0
+      option_type.append(opt.get('option_type') or '')
+      root.append(opt.get('root_symbol') or '')
+
+    self.option_type = np.array(option_type, dtype='U4')
+    self.root = np.array(root, dtype='U8')
+    self._index = None
+
+  @classmethod
+  def from_options(cls, options: List[Dict]) -> 'OptionChainFrame':
+    return cls(list(options or []))
+
+  def __len__(self) -> int:
+    return len(self.records)
+
+  # --- ROW ACCESS ---
+  def leg(self, i: int) -> Dict:
+    """Original option dict for row i (what open_spread_position/record_new_trade expect)."""
+    return self.records[int(i)]
+
+  def side(self, option_type: str) -> np.ndarray:
+    """Row indices of one option type, in original chain order."""
+    return np.flatnonzero(self.option_type == option_type)
+
+  def leg_at_strike(self, option_type: str, strike: float, root: str = None) -> Optional[Dict]:
+    row = self.index.exact(option_type, strike, root)
+    return self.leg(row) if row is not None else None
+
+  @property
+  def index(self) -> 'ChainIndex':
+    """Strike index, built on first use (frames are not modified after construction)."""
+    if self._index is None:
+      self._index = ChainIndex(self)
+    return self._index
+
+  # --- PRICE VIEWS ---
+  def ask_or_last(self) -> np.ndarray:
+    return np.where(self.ask != 0, self.ask, self.last)
+
+  def bid_or_last(self) -> np.ndarray:
+    return np.where(self.bid != 0, self.bid, self.last)
+
+class ChainIndex:
+  """
+    Strike index over an OptionChainFrame, keyed by (option_type, root); root None = all roots.
+    Each key keeps its rows sorted by strike once (stable: equal strikes stay in chain order),
+    so exact / nearest / pair lookups are binary searches instead of scans of the side.
+    """
+  EXACT_TOL = 1e-6
+
+  def __init__(self, frame: OptionChainFrame):
+    self.frame = frame
+    self._groups: Dict[Tuple[str, Optional[str]], Tuple[np.ndarray, np.ndarray]] = {}
+    self._descending: Dict[Tuple[str, Optional[str]], np.ndarray] = {}
+    # Per row: position of its (option_type, root) key in _pair_keys, for match()
+    self._pair_keys: List[Tuple[str, str]] = []
+    self._row_key = np.zeros(len(frame), dtype=np.int64)
+    if not len(frame):
+      return
+
+    types, type_code = np.unique(frame.option_type, return_inverse=True)
+    roots, root_code = np.unique(frame.root, return_inverse=True)
+    # One stable sort: by type, then root, then strike (chain order within equal strikes)
+    order = np.lexsort((frame.strike, root_code, type_code))
+    pair_code = type_code[order] * len(roots) + root_code[order]
+    starts = np.flatnonzero(np.r_[True, pair_code[1:] != pair_code[:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], order.size]):
+      rows = order[start:end]
+      key = (str(types[type_code[rows[0]]]), str(roots[root_code[rows[0]]]))
+      self._groups[key] = (rows, frame.strike[rows])
+      self._row_key[rows] = len(self._pair_keys)
+      self._pair_keys.append(key)
+
+    for i, option_type in enumerate(types):
+      keys = [key for key in self._pair_keys if key[0] == option_type]
+      if len(keys) == 1:
+        self._groups[(str(option_type), None)] = self._groups[keys[0]]
+      else:
+        rows = np.flatnonzero(type_code == i)
+        rows = rows[np.argsort(frame.strike[rows], kind='stable')]
+        self._groups[(str(option_type), None)] = (rows, frame.strike[rows])
+
+  def _group(self, option_type: str, root: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    return self._groups.get((option_type, root), (np.empty(0, dtype=np.int64), np.empty(0)))
+
+  # --- SINGLE LOOKUPS ---
+  def exact(self, option_type: str, strike: float, root: str = None) -> Optional[int]:
+    """Row at exactly `strike` (first in chain order), or None."""
+    return self.nearest(option_type, strike, self.EXACT_TOL, root)
+
+  def nearest(self, option_type: str, strike: float, tol: float, root: str = None) -> Optional[int]:
+    """Row whose strike is closest to `strike` and within `tol` (ties: the lower strike), or None."""
+    rows, strikes = self._group(option_type, root)
+    if rows.size == 0:
+      return None
+    pos = int(np.searchsorted(strikes, strike, side='left'))
+    best = None
+    for i in (pos - 1, pos):
+      if 0 <= i < rows.size and abs(strikes[i] - strike) <= tol:
+        if best is None or abs(strikes[i] - strike) < abs(strikes[best] - strike):
+          best = i
+    if best is None:
+      return None
+    # Equal strikes: the first of the run is the earliest in chain order
+    first = int(np.searchsorted(strikes, strikes[best], side='left'))
+    return int(rows[first])
+
+  # --- ORDERED VIEWS ---
+  def by_strike(self, option_type: str, root: str = None, descending: bool = False) -> np.ndarray:
+    """Rows ordered by strike; equal strikes keep chain order either way."""
+    rows, strikes = self._group(option_type, root)
+    if not descending:
+      return rows
+    if (option_type, root) not in self._descending:
+      # From chain order, so equal strikes keep it here too
+      by_row = np.sort(rows)
+      self._descending[(option_type, root)] = by_row[np.argsort(-self.frame.strike[by_row], kind='stable')]
+    return self._descending[(option_type, root)]
+
+  def outward(self, option_type: str, price: float, direction: int = 0, root: str = None) -> np.ndarray:
+    """
+      Rows ordered from the money outward.
+      direction +1: strikes above price, ascending; -1: strikes below price, descending;
+      0: every strike by distance from price (ties: the lower strike).
+      """
+    rows, strikes = self._group(option_type, root)
+    if direction > 0:
+      return rows[np.searchsorted(strikes, price, side='right'):]
+    if direction < 0:
+      below = int(np.searchsorted(strikes, price, side='left'))
+      return self.by_strike(option_type, root, descending=True)[rows.size - below:]
+    return rows[np.argsort(np.abs(strikes - price), kind='stable')]
+
+  # --- PAIRING ---
+  def match(self, rows: np.ndarray, targets: np.ndarray, tol: float) -> np.ndarray:
+    """
+      Partner row for each of `rows`: same option type and root, strike strictly within `tol`
+      of its target (lowest such strike; equal strikes -> earliest in chain order). -1 where none.
+      """
+    rows = np.asarray(rows, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.float64)
+    out = np.full(rows.shape, -1, dtype=np.int64)
+    if rows.size == 0:
+      return out
+    keys = self._row_key[rows]
+    for key in (np.unique(keys) if len(self._pair_keys) > 1 else (0,)):
+      members = np.flatnonzero(keys == key) if len(self._pair_keys) > 1 else np.arange(rows.size)
+      group_rows, strikes = self._group(*self._pair_keys[key])
+      want = targets[members]
+      pos = np.searchsorted(strikes, want - tol, side='right')
+      pos_c = np.minimum(pos, group_rows.size - 1)
+      found = (pos < group_rows.size) & (np.abs(strikes[pos_c] - want) < tol)
+      out[members] = np.where(found, group_rows[pos_c], -1)
+    return out
+
+def as_frame(chain: Union[List[Dict], OptionChainFrame]) -> OptionChainFrame:
+  """Selectors accept either representation; list chains are converted once."""
+  if isinstance(chain, OptionChainFrame):
+    return chain
+  return OptionChainFrame.from_options(chain)
+
+def _num(val, default: float = 0.0) -> float:
+  try:
+    if val is None or val == '':
+      return default
+    return float(val)
+  except (ValueError, TypeError):
+    return default
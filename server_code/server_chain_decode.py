@@ -0,0 +1,92 @@
+import io
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from shared import config
+
+# Optional fast backends; whichever of config.CHAIN_DECODER_BACKENDS imports first is used
+try:
+  import ijson
+except ImportError:
+  ijson = None
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# Chain decoding for /markets/options/chains. Only the fields the selectors, order code
+# and trade records read are kept; options outside the strike window or root filter
+# are dropped as they are decoded, so nothing else is ever materialised.
+
+KEPT_FIELDS = ('symbol', 'root_symbol', 'underlying', 'option_type', 'strike', 'bid', 'ask', 'last',
+               'bid_date', 'ask_date', 'expiration_date', 'contract_size')
+KEPT_GREEKS = ('delta', 'gamma', 'theta', 'vega', 'mid_iv', 'smv_vol')
+
+def available_backends() -> List[str]:
+  modules = {'ijson': ijson, 'orjson': orjson, 'json': json}
+  return [name for name in config.CHAIN_DECODER_BACKENDS if modules.get(name) is not None]
+
+def decode_chain(raw: bytes, strike_window: Optional[Tuple[float, float]] = None,
+                 roots: Optional[Iterable[str]] = None, backend: str = None) -> List[Dict]:
+  """
+    Chain payload bytes -> list of slim option dicts (floats for strike/bid/ask/delta).
+    backend: 'ijson' streams item by item (memory stays flat as the chain grows);
+    'orjson' / 'json' parse the whole payload, then filter. Default: first available.
+    """
+  backend = backend or available_backends()[0]
+  roots = frozenset(roots) if roots else None
+  if backend == 'ijson':
+    kept, seen = [], 0
+    for opt in ijson.items(io.BytesIO(raw), 'options.option.item', use_float=True):
+      seen += 1
+      slim = normalize_option(opt, strike_window, roots)
+      if slim is not None:
+        kept.append(slim)
+    if seen:
+      return kept
+    # Nothing under options.option.item: a single-option (dict) or empty chain, tiny either way
+    backend = 'json'
+
+  return parse_chain(orjson.loads(raw) if backend == 'orjson' else json.loads(raw), strike_window, roots)
+
+def parse_chain(data: Optional[Dict], strike_window: Optional[Tuple[float, float]] = None,
+                roots: Optional[Iterable[str]] = None) -> List[Dict]:
+  """Same filtering for an already-decoded {'options': {'option': ...}} payload."""
+  roots = frozenset(roots) if roots else None
+  return [slim for slim in (normalize_option(opt, strike_window, roots) for opt in _option_list(data)) if slim is not None]
+
+def normalize_option(opt: Dict, strike_window: Optional[Tuple[float, float]] = None,
+                     roots: Optional[frozenset] = None) -> Optional[Dict]:
+  """Slim copy of one option, or None if it has no strike/bid or falls outside the filters."""
+  try:
+    if not isinstance(opt, dict) or not opt.get('strike') or not opt.get('bid'):
+      return None
+    strike = float(opt['strike'])
+    if strike_window and not strike_window[0] <= strike <= strike_window[1]:
+      return None
+    if roots and opt.get('root_symbol') not in roots:
+      return None
+
+    slim = {field: opt[field] for field in KEPT_FIELDS if field in opt}
+    slim['strike'] = strike
+    slim['bid'] = float(opt['bid'])
+    slim['ask'] = float(opt['ask'])
+    greeks = opt.get('greeks')
+    if isinstance(greeks, dict) and greeks:
+      slim['greeks'] = {k: greeks[k] for k in KEPT_GREEKS if k in greeks}
+      if greeks.get('delta') is not None:
+        # Left unset when missing: server_pricing fills it rather than a misleading 0
+        slim['delta'] = float(greeks['delta'])
+    return slim
+  except (ValueError, TypeError, KeyError):
+    return None
+
+def _option_list(data) -> List[Dict]:
+  """options.option normalised to a list (Tradier sends a dict for one option, 'null' for none)."""
+  container = data.get('options') if isinstance(data, dict) else None
+  if not isinstance(container, dict):
+    return []
+  options = container.get('option') or []
+  if isinstance(options, dict):
+    return [options]
+  return options if isinstance(options, list) else []
@@ -10,8 +10,12 @@ import statistics
 from shared import config
 from shared.classes import Cycle
 from . import server_db
+from . import server_env
 from . import server_api
 from . import server_libs
+from . import server_metrics
+from . import server_volsurface
+from .server_ratelimit import with_priority
 
 # timezone helper
 def _is_today(dt_val, today_date):
@@ -26,6 +30,7 @@ def _is_today(dt_val, today_date):
 
 # --- DASHBOARD DATA ---
 @anvil.server.callable
+@with_priority(config.PRIORITY_UI)
 def get_dashboard_state():
   """Fetches all data required to render the Dashboard UI"""
   # 1. Global Settings & Env
@@ -34,13 +39,14 @@ def get_dashboard_state():
   env_status = server_api.get_environment_status()
   
   # 2. Active Cycle
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if not cycle:
     return {
-      'active_env': config.ACTIVE_ENV,
+      'active_env': server_env.current_env(),
       'automation_enabled': settings.get('automation_enabled', False),
       'market_status': env_status.get('status', 'CLOSED'),
       'market_time': env_status.get('now'),
+      'broker_circuits': env_status.get('broker_circuits', {}),
       'cycle_active': False, # UI uses this to hide cards
       'net_daily_pnl': 0.0,
       'bot_status_text': "IDLE (NO CYCLE)",
@@ -73,10 +79,11 @@ def get_dashboard_state():
   data = {
     'last_heartbeat': last_hb,
     'bot_is_stale': is_stale,
-    'active_env': config.ACTIVE_ENV,
+    'active_env': server_env.current_env(),
     'automation_enabled': settings['automation_enabled'] if settings else False,
     'market_status': env_status.get('status', 'CLOSED'),
     'market_time': env_status.get('now'),
+    'broker_circuits': env_status.get('broker_circuits', {}),
     'cycle_active': False,
     'net_daily_pnl': 0.0,
     # Status
@@ -251,9 +258,19 @@ def get_log_stream(level_filter=None, limit=50):
   # Return the iterator directly (Anvil handles pagination)
   return app_tables.logs.search(
     tables.order_by("timestamp", ascending=False),
-    environment=config.ACTIVE_ENV
+    environment=server_env.current_env()
   )
 
+@anvil.server.callable
+def get_broker_latency_stats(minutes: int = 60, env: str = None) -> list:
+  """Per-endpoint p50/p95/p99, call counts and share of broker time over the last `minutes` (server_metrics)."""
+  return server_metrics.latency_report(minutes, env)
+
+@anvil.server.callable
+def get_vol_surface_stats() -> list:
+  """IV surface coverage per environment/underlying: spot, last update, points per expiration (server_volsurface)."""
+  return server_volsurface.surface_stats()
+
 # ---Private helpers ---
 def _get_bot_status_metadata(settings: dict, env_status: dict, cycle: Cycle) -> dict:
   """Determines the dashboard status text and color for the Scalpel strategy."""
@@ -269,6 +286,12 @@ def _get_bot_status_metadata(settings: dict, env_status: dict, cycle: Cycle) ->
   if env_status.get('status') != 'OPEN' and not has_active_trade:
     return {'text': "SLEEPING (MARKET CLOSED)", 'color': "gray"}
 
+  # 2b. Broker health (server_breaker): open -> runs are skipped, half_open -> recovering
+  circuits = env_status.get('broker_circuits') or {}
+  open_circuits = [name for name, state in circuits.items() if state != 'closed']
+  if open_circuits:
+    return {'text': f"BROKER DEGRADED ({', '.join(open_circuits).upper()})", 'color': "#FF0000"}
+
   # 3. Campaign Check
   if not cycle:
     return {'text': "NO CAMPAIGN", 'color': "orange"}
@@ -302,7 +325,7 @@ def _get_bot_status_metadata(settings: dict, env_status: dict, cycle: Cycle) ->
 @anvil.server.callable
 def get_trades_crud_list() -> list:
   """Returns a list of dictionaries for the CRUD data grid."""
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if not cycle: 
     return []
 
@@ -333,7 +356,7 @@ def get_performance_dashboard_stats() -> dict:
   # 1. Fetch all closed cycles for the active environment
   cycles = list(app_tables.cycles.search(
     status=config.STATUS_CLOSED, 
-    account=config.ACTIVE_ENV
+    account=server_env.current_env()
   ))
 
   total_cycles = len(cycles)
@@ -400,7 +423,7 @@ def get_performance_headlines() -> dict:
   # 1. Fetch all closed trades for environment
   all_closed = list(app_tables.trades.search(
     status=config.STATUS_CLOSED,
-    cycle=anvil.tables.query.any_of(*app_tables.cycles.search(account=config.ACTIVE_ENV))
+    cycle=anvil.tables.query.any_of(*app_tables.cycles.search(account=server_env.current_env()))
   ))
 
   if not all_closed:
@@ -436,7 +459,7 @@ def get_strategic_efficiency() -> dict:
   """Calculates tactical KPIs and the EV Forecast model."""
   
   # 1. Fetch all cycles (Open and Closed) to get a full trade history
-  cycles = list(app_tables.cycles.search(account=config.ACTIVE_ENV))
+  cycles = list(app_tables.cycles.search(account=server_env.current_env()))
   if not cycles:
     return {'active': False, 'trade_count': 0}
 
@@ -470,7 +493,7 @@ def get_strategic_efficiency() -> dict:
   actual_ev = (harvest_rate * avg_win_val) + ((1 - harvest_rate) * avg_loss_val)
 
   # Theoretical Baseline (15 Delta)
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   theoretical_ev = cycle.rules.get('theo_ev', 50)
 
   return {
@@ -491,7 +514,7 @@ def get_equity_curve_data() -> dict:
   all_closed = list(app_tables.trades.search(
     status=config.STATUS_CLOSED,
     exclude_from_stats=False,
-    cycle=anvil.tables.query.any_of(*app_tables.cycles.search(account=config.ACTIVE_ENV))
+    cycle=anvil.tables.query.any_of(*app_tables.cycles.search(account=server_env.current_env()))
   ))
 
   if not all_closed:
@@ -533,17 +556,18 @@ def get_equity_curve_data() -> dict:
   }
 
 @anvil.server.callable
+@with_priority(config.PRIORITY_UI)
 def get_continuous_pulse_stats() -> dict:
   # 1. REALIZED: Sum of EVERY closed trade in the environment
   # This captures harvests from both past cycles and the current active campaign
   all_closed_trades = app_tables.trades.search(
     status=config.STATUS_CLOSED, 
-    cycle=q.any_of(*app_tables.cycles.search(account=config.ACTIVE_ENV))
+    cycle=q.any_of(*app_tables.cycles.search(account=server_env.current_env()))
   )
   realized_pnl = sum([(t['pnl'] or 0) * (t['quantity'] or 0) * 100 for t in all_closed_trades])
 
   # 2. UNREALIZED: Current Mark-to-Market of OPEN trades
-  active_cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  active_cycle = server_db.get_active_cycle(server_env.current_env())
   unrealized_pnl = 0.0
 
   if active_cycle:
@@ -566,7 +590,7 @@ def get_continuous_pulse_stats() -> dict:
 @anvil.server.callable
 def get_kpi_benchmarks() -> dict:
   """Calculates specific KPIs for the Confidence Dashboard."""
-  cycles = list(app_tables.cycles.search(account=config.ACTIVE_ENV))
+  cycles = list(app_tables.cycles.search(account=server_env.current_env()))
 
   all_income = list(app_tables.trades.search(
     role=config.ROLE_INCOME, status=config.STATUS_CLOSED,
@@ -2,10 +2,12 @@ import anvil.email
 import anvil.server
 import anvil.tables
 from anvil.tables import app_tables
+import anvil.tables.query as q
 import datetime as dt
 
 from shared.classes import Cycle, Trade, Leg, Transaction
 from shared import config
+from . import server_env
 from . import server_logging as logger
 
 def _fmt(val):
@@ -143,11 +145,13 @@ def record_new_trade(
   fees: float = 0.0,
   entry_reason: str = None,
   vwap_pct: float = 0.0,
-  entry_bias: str = None
+  entry_bias: str = None,
+  execution: dict = None
 ) -> Trade:
   """
   Persists a fully executed trade to the database.
   Creates: Trade -> Transaction -> Legs (1 or 2 depending on role).
+  execution: optional fill_latency / slippage / ladder_steps for the opening transaction.
   """
     
   def _parse_date(val):
@@ -194,7 +198,8 @@ def record_new_trade(
     quantity=trade_dict['quantity'],
     fees=_fmt(fees),
     timestamp=fill_time,
-    order_id_external=order_id
+    order_id_external=order_id,
+    **(execution or {})
   )
 
   # 3. Create Leg Rows
@@ -363,7 +368,7 @@ def _hydrate_cycle_children(cycle, cycle_row):
 # ------CRUD-----------------#
 @anvil.server.callable
 def get_all_trades_for_editor() -> list:
-  cycle = get_active_cycle(config.ACTIVE_ENV)
+  cycle = get_active_cycle(server_env.current_env())
   if not cycle: return []
 
   trades_list = []
@@ -529,6 +534,134 @@ def sync_campaign_pnl(cycle_id: str) -> float:
   row['total_pnl'] = round(total, 2)
   return row['total_pnl']
 
+#--------------------------------------------------------------#
+# Intraday VWAP state (server_vwap.VwapAccumulator)
+
+def get_vwap_state(account: str, symbol: str, session_date: dt.date) -> dict | None:
+  """Persisted accumulator for one account/symbol/day, or None before the first bar."""
+  row = app_tables.vwap_state.get(account=account, symbol=symbol, session_date=session_date)
+  return dict(row) if row else None
+
+def save_vwap_state(account: str, symbol: str, session_date: dt.date, state: dict) -> None:
+  """Upserts today's accumulator. The first save of a day drops earlier days' rows."""
+  row = app_tables.vwap_state.get(account=account, symbol=symbol, session_date=session_date)
+  if row:
+    row.update(updated=dt.datetime.now(), **state)
+    return
+
+  for old in app_tables.vwap_state.search(account=account, symbol=symbol):
+    old.delete()
+  app_tables.vwap_state.add_row(
+    account=account,
+    symbol=symbol,
+    session_date=session_date,
+    updated=dt.datetime.now(),
+    **state
+  )
+
+#--------------------------------------------------------------#
+# Entry shortlist (server_api.prepare_entry_shortlist)
+
+def get_entry_shortlist(account: str, session_date: dt.date) -> dict | None:
+  """Latest pre-entry shortlist for the day, or None if the scan has not run."""
+  row = app_tables.entry_shortlists.get(account=account, session_date=session_date)
+  return dict(row) if row else None
+
+def save_entry_shortlist(account: str, session_date: dt.date, underlying: str, spot: float, symbols: dict) -> None:
+  """Upserts today's shortlist (each scan replaces the last). The first save of a day drops earlier days' rows."""
+  row = app_tables.entry_shortlists.get(account=account, session_date=session_date)
+  if row:
+    row.update(underlying=underlying, spot=spot, symbols=symbols, updated=dt.datetime.now())
+    return
+
+  for old in app_tables.entry_shortlists.search(account=account):
+    old.delete()
+  app_tables.entry_shortlists.add_row(
+    account=account,
+    session_date=session_date,
+    underlying=underlying,
+    spot=spot,
+    symbols=symbols,
+    updated=dt.datetime.now()
+  )
+
+def save_entry_preflight(account: str, session_date: dt.date, preflight: dict) -> None:
+  """Attaches the order preview results to today's shortlist row (saved by the same scan just before)."""
+  row = app_tables.entry_shortlists.get(account=account, session_date=session_date)
+  if row:
+    row.update(preflight=preflight, updated=dt.datetime.now())
+
+#--------------------------------------------------------------#
+# Order intents (server_api._submit_order idempotency)
+
+def get_order_intent(tag: str) -> dict | None:
+  row = app_tables.order_intents.get(tag=tag)
+  return dict(row) if row else None
+
+def save_order_intent(tag: str, account: str, payload: dict) -> None:
+  """Records the intent before its POST; a resubmit of the same tag bumps attempts."""
+  row = app_tables.order_intents.get(tag=tag)
+  if row:
+    row.update(payload=payload, status='submitting', attempts=(row['attempts'] or 0) + 1, updated=dt.datetime.now())
+    return
+  app_tables.order_intents.add_row(
+    tag=tag,
+    account=account,
+    payload=payload,
+    status='submitting',
+    order_id=None,
+    attempts=1,
+    created=dt.datetime.now(),
+    updated=dt.datetime.now()
+  )
+
+def update_order_intent(tag: str, **fields) -> None:
+  row = app_tables.order_intents.get(tag=tag)
+  if row:
+    row.update(updated=dt.datetime.now(), **fields)
+
+#--------------------------------------------------------------#
+# Broker metrics (server_metrics)
+
+def save_broker_metrics(rows: list) -> None:
+  """One row per (minute, account, endpoint) window; a minute flushed twice just has two rows."""
+  for row in rows:
+    app_tables.broker_metrics.add_row(**row)
+
+def get_broker_metrics(since: dt.datetime, account: str = None) -> list:
+  query = {'minute': q.greater_than_or_equal_to(since)}
+  if account:
+    query['account'] = account
+  return [dict(row) for row in app_tables.broker_metrics.search(**query)]
+
+def prune_broker_metrics(before: dt.datetime) -> None:
+  for row in app_tables.broker_metrics.search(minute=q.less_than(before)):
+    row.delete()
+
+#--------------------------------------------------------------#
+# Broker circuit breakers (server_breaker, shared across processes)
+
+def get_breaker_states(account: str) -> dict:
+  """{endpoint class: CircuitBreaker.to_state()} as last written by any process."""
+  return {row['endpoint_class']: dict(row) for row in app_tables.broker_breakers.search(account=account)}
+
+def save_breaker_state(account: str, endpoint_class: str, state: dict) -> None:
+  """Upserts one breaker's state (last writer wins)."""
+  row = app_tables.broker_breakers.get(account=account, endpoint_class=endpoint_class)
+  if row:
+    row.update(updated=dt.datetime.now(), **state)
+    return
+  app_tables.broker_breakers.add_row(
+    account=account,
+    endpoint_class=endpoint_class,
+    updated=dt.datetime.now(),
+    **state
+  )
+
+def delete_breaker_states(account: str) -> None:
+  for row in app_tables.broker_breakers.search(account=account):
+    row.delete()
+
 #--------------------------------------------------------------#
 # Settings page
 
@@ -0,0 +1,48 @@
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Tuple
+
+from shared import config
+
+# Broker environment (PROD / SANDBOX) of the current automation run or request.
+# Unset means config.ACTIVE_ENV, so single-environment deployments behave as before.
+# Per-environment state lives in registries keyed by this value: transports and their
+# connection pools (server_transport), streams (server_stream), clocks (server_calendar),
+# and cycles/shortlists/VWAP state in the DB (account column).
+_ENV = contextvars.ContextVar('broker_env', default=None)
+
+@contextmanager
+def use_env(env: str):
+  """Runs the enclosed code (broker calls, cycle lookups, logs) against `env`."""
+  if env not in config.TARGET_UNDERLYING:
+    raise ValueError(f"Unknown environment: {env}")
+  token = _ENV.set(env)
+  try:
+    yield
+  finally:
+    _ENV.reset(token)
+
+def with_env(env: str):
+  """Decorator form of use_env."""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with use_env(env):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def current_env() -> str:
+  return _ENV.get() or config.ACTIVE_ENV
+
+def target_underlying(env: str = None) -> str:
+  return config.TARGET_UNDERLYING[env or current_env()]
+
+def automation_envs() -> Tuple[str, ...]:
+  """Environments run_automation_routine drives, in config order, without duplicates."""
+  return tuple(dict.fromkeys(config.AUTOMATION_ENVS or (config.ACTIVE_ENV,)))
+
+def submit(pool, func, *args, **kwargs):
+  """pool.submit that carries the caller's context (environment, request priority) into the worker."""
+  return pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
@@ -0,0 +1,642 @@
+import base64
+import datetime as dt
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+# Local stand-ins for Tradier services, used by the diagnostics in test_scripts.
+# Standard library only, so they run anywhere the server code runs.
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# --- STREAMING STAND-IN ---
+
+class FakeStreamServer:
+  """
+    Minimal WebSocket server speaking Tradier's streaming protocol.
+    - Market clients send {"symbols": [...], "sessionid": ..., "filter": [...]}.
+    - Account clients send {"events": ["order"], "sessionid": ...}.
+    - publish() pushes one event (as Tradier would) to every client subscribed to it.
+    - session_provider() stands in for POST /markets|accounts/events/session.
+    Text frames only; enough protocol for websocket-client, not a general server.
+    """
+  def __init__(self, host: str = '127.0.0.1', port: int = 0):
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._sock.bind((host, port))
+    self._sock.listen(8)
+    self.host, self.port = self._sock.getsockname()
+    self.sessions = set()
+    self.subscriptions: List[Dict] = []
+    self._clients: Dict[socket.socket, Dict] = {}
+    self._lock = threading.Lock()
+    self._running = False
+
+  @property
+  def url(self) -> str:
+    return f'ws://{self.host}:{self.port}/v1/markets/events'
+
+  @property
+  def account_url(self) -> str:
+    return f'ws://{self.host}:{self.port}/v1/accounts/events'
+
+  def start(self) -> 'FakeStreamServer':
+    self._running = True
+    threading.Thread(target=self._accept_loop, name='fake-stream', daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    self._running = False
+    with self._lock:
+      clients = list(self._clients)
+      self._clients.clear()
+    for conn in clients:
+      _close_quietly(conn)
+    _close_quietly(self._sock)
+
+  def session_provider(self) -> str:
+    session_id = uuid.uuid4().hex
+    self.sessions.add(session_id)
+    return session_id
+
+  def client_count(self) -> int:
+    with self._lock:
+      return len([s for s in self._clients.values() if s.get('symbols') or s.get('events')])
+
+  def publish(self, event: Dict) -> int:
+    """Sends the event to subscribed clients; returns how many received it."""
+    frame = _encode_frame(json.dumps(event) + '\n')
+    sent = 0
+    with self._lock:
+      targets = [c for c, sub in self._clients.items() if _wants(sub, event)]
+    for conn in targets:
+      try:
+        conn.sendall(frame)
+        sent += 1
+      except OSError:
+        self._drop(conn)
+    return sent
+
+  def drop_clients(self) -> None:
+    """Severs every connection (exercises client reconnect)."""
+    with self._lock:
+      clients = list(self._clients)
+      self._clients.clear()
+    for conn in clients:
+      _close_quietly(conn)
+
+  # --- INTERNALS ---
+  def _accept_loop(self) -> None:
+    while self._running:
+      try:
+        conn, _ = self._sock.accept()
+      except OSError:
+        return
+      threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+  def _serve(self, conn: socket.socket) -> None:
+    try:
+      if not _handshake(conn):
+        _close_quietly(conn)
+        return
+      with self._lock:
+        self._clients[conn] = {}
+      while self._running:
+        opcode, payload = _read_frame(conn)
+        if opcode is None or opcode == 0x8:
+          break
+        if opcode == 0x9:
+          conn.sendall(_encode_frame(payload, opcode=0xA))
+          continue
+        if opcode == 0x1:
+          self._on_message(conn, json.loads(payload.decode('utf-8')))
+    except (OSError, ValueError):
+      pass
+    finally:
+      self._drop(conn)
+
+  def _on_message(self, conn: socket.socket, message: Dict) -> None:
+    if message.get('sessionid') not in self.sessions:
+      conn.sendall(_encode_frame(json.dumps({'error': 'invalid session'}) + '\n'))
+      return
+    with self._lock:
+      self.subscriptions.append(message)
+      if conn in self._clients:
+        self._clients[conn] = {
+          'symbols': set(message.get('symbols') or []),
+          'events': set(message.get('events') or []),
+          'message': message
+        }
+
+  def _drop(self, conn: socket.socket) -> None:
+    with self._lock:
+      self._clients.pop(conn, None)
+    _close_quietly(conn)
+
+def _wants(sub: Dict, event: Dict) -> bool:
+  if 'event' in event:
+    return event['event'] in sub.get('events', ())
+  return event.get('symbol') in sub.get('symbols', ())
+
+# --- REST STAND-IN ---
+
+_OCC = re.compile(r'^([A-Z]+)(\d{6})([CP])(\d{8})$')
+
+class FakeTradierServer:
+  """
+    Local HTTP stand-in for the Tradier REST endpoints this project uses:
+    /markets/clock, quotes, options/chains, options/expirations, timesales,
+    /accounts/{id}/orders (POST/GET/DELETE) and /accounts/{id}/positions.
+    Quotes come from a seeded random walk per underlying priced with Black-Scholes;
+    a matching engine fills market and limit orders (single leg, multileg debit/credit)
+    against those quotes on submit, on modify (PUT) and on every tick.
+    Point {ENV}_ENDPOINT_URL at `url` (or use server_transport.use_transport) to run with no broker.
+    """
+  def __init__(self, spots: Dict[str, float] = None, vol: float = 0.18, seed: int = 7,
+               tick_seconds: float = 0.25, latency: float = 0.0, hours_to_close: float = 3.0,
+               host: str = '127.0.0.1', port: int = 0):
+    self.spots = dict(spots or {'SPX': 5800.0, 'SPY': 580.0, 'VIX': 18.0})
+    self.opens = dict(self.spots)
+    self.vol = vol
+    self.tick_seconds = tick_seconds
+    self.latency = latency
+    self.submit_delay = 0.0  # extra delay after an order is accepted (POST timeouts that still place the order)
+    self.buying_power = None  # set to reject orders (and previews) costing more than this
+    self.hours_to_close = hours_to_close
+    self.market_state = 'open'
+    self.orders: Dict[str, Dict] = {}
+    self.positions: Dict[str, float] = {}
+    self.request_count = 0
+    self._rng = random.Random(seed)
+    self._ids = itertools.count(100001)
+    self._lock = threading.RLock()
+    self._stop = threading.Event()
+    self._bars = {sym: self._make_bars(sym) for sym in self.spots}
+
+    fake = self
+    class _Handler(_FakeHandler):
+      server_fake = fake
+    self._httpd = ThreadingHTTPServer((host, port), _Handler)
+    self._httpd.daemon_threads = True
+    self.host, self.port = self._httpd.server_address[:2]
+
+  @property
+  def url(self) -> str:
+    return f'http://{self.host}:{self.port}/v1'
+
+  def start(self) -> 'FakeTradierServer':
+    threading.Thread(target=self._httpd.serve_forever, name='fake-tradier', daemon=True).start()
+    if self.tick_seconds:
+      threading.Thread(target=self._tick_loop, name='fake-tradier-ticks', daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    self._stop.set()
+    self._httpd.shutdown()
+    self._httpd.server_close()
+
+  # --- SCENARIO CONTROLS ---
+  def set_spot(self, symbol: str, price: float) -> None:
+    with self._lock:
+      self.spots[symbol] = price
+      self._match_all()
+
+  def tick(self) -> None:
+    """One random-walk step for every underlying, then a matching pass."""
+    with self._lock:
+      step = math.sqrt(max(self.tick_seconds, 0.01) / (252 * 6.5 * 3600))
+      for sym, spot in self.spots.items():
+        if sym != 'VIX':
+          self.spots[sym] = round(spot * math.exp(self._rng.gauss(0, self.vol * step)), 2)
+      self._match_all()
+
+  # --- MARKET DATA ---
+  def quote(self, symbol: str, greeks: bool = False) -> Optional[Dict]:
+    with self._lock:
+      if symbol in self.spots:
+        spot = self.spots[symbol]
+        return {
+          'symbol': symbol, 'type': 'index' if symbol in ('SPX', 'VIX') else 'etf',
+          'last': spot, 'bid': round(spot - 0.05, 2), 'ask': round(spot + 0.05, 2),
+          'open': self.opens[symbol], 'high': max(spot, self.opens[symbol]), 'low': min(spot, self.opens[symbol]),
+          'prevclose': self.opens[symbol], 'change': round(spot - self.opens[symbol], 2), 'volume': 0
+        }
+      parsed = _parse_occ(symbol)
+      if not parsed or parsed[0] not in self.spots:
+        return None
+      underlying, expiration, opt_type, strike, root = parsed
+      return self._option_quote(symbol, underlying, expiration, opt_type, strike, greeks=greeks, root=root)
+
+  def chain(self, underlying: str, expiration: str, greeks: bool = True) -> List[Dict]:
+    with self._lock:
+      spot = self.spots.get(underlying)
+      if spot is None:
+        return []
+      step = 5.0 if spot > 1000 else 1.0
+      root = 'SPXW' if underlying == 'SPX' else underlying
+      center = round(spot / step) * step
+      options = []
+      for i in range(-60, 61):
+        strike = center + i * step
+        for opt_type in ('call', 'put'):
+          symbol = _occ(root, expiration, opt_type, strike)
+          options.append(self._option_quote(symbol, underlying, expiration, opt_type, strike, greeks=greeks, root=root))
+      return options
+
+  def expirations(self, underlying: str) -> List[str]:
+    today = dt.date.today()
+    days = [today + dt.timedelta(days=i) for i in range(0, 45)]
+    return [d.strftime('%Y-%m-%d') for d in days if d.weekday() < 5]
+
+  def timesales(self, symbol: str, start: str = None) -> List[Dict]:
+    bars = self._bars.get(symbol, [])
+    if start:
+      start_iso = start.replace(' ', 'T')
+      bars = [b for b in bars if b['time'] >= start_iso]
+    return bars
+
+  # --- ORDERS ---
+  def submit(self, form: Dict) -> Dict:
+    legs = _order_legs(form)
+    if not legs:
+      return {'errors': {'error': ['Invalid order: no legs']}}
+    quantity = max(leg['quantity'] for leg in legs)
+    cost = round(float(form.get('price') or 0) * 100 * quantity, 2)
+    if self.buying_power is not None and form.get('type') in ('debit', 'limit') and cost > self.buying_power:
+      return {'errors': {'error': ['Insufficient buying power for this order']}}
+    if form.get('preview') == 'true':
+      return {'order': {'status': 'ok', 'commission': 0.35 * len(legs), 'cost': cost, 'order_cost': cost,
+                        'margin_change': cost, 'fees': 0.0, 'class': form.get('class'), 'type': form.get('type'),
+                        'result': True}}
+    with self._lock:
+      order_id = str(next(self._ids))
+      self.orders[order_id] = {
+        'id': int(order_id), 'class': form.get('class'), 'symbol': form.get('symbol'),
+        'type': form.get('type'), 'duration': form.get('duration', 'day'),
+        'price': float(form['price']) if form.get('price') else None,
+        'status': 'open', 'legs': legs, 'avg_fill_price': 0.0, 'exec_quantity': 0.0,
+        'tag': form.get('tag'), 'create_date': dt.datetime.now().isoformat()
+      }
+      self._match(self.orders[order_id])
+    if self.submit_delay:
+      time.sleep(self.submit_delay)
+    return {'order': {'id': int(order_id), 'status': 'ok', 'partner_id': 'fake'}}
+
+  def get_order(self, order_id: str) -> Optional[Dict]:
+    with self._lock:
+      self._match_all()
+      order = self.orders.get(order_id)
+      return _public_order(order) if order else None
+
+  def list_orders(self) -> List[Dict]:
+    with self._lock:
+      self._match_all()
+      return [_public_order(order) for order in self.orders.values()]
+
+  def modify(self, order_id: str, form: Dict) -> Optional[Dict]:
+    with self._lock:
+      order = self.orders.get(order_id)
+      if not order or order['status'] != 'open':
+        return None
+      if form.get('price'):
+        order['price'] = float(form['price'])
+      order['type'] = form.get('type', order['type'])
+      self._match(order)
+      return {'order': {'id': order['id'], 'status': 'ok'}}
+
+  def cancel(self, order_id: str) -> Optional[Dict]:
+    with self._lock:
+      order = self.orders.get(order_id)
+      if not order:
+        return None
+      if order['status'] in ('open', 'pending', 'partially_filled'):
+        order['status'] = 'canceled'
+      return {'order': {'id': order['id'], 'status': 'ok'}}
+
+  # --- MATCHING ENGINE ---
+  def _match_all(self) -> None:
+    for order in self.orders.values():
+      if order['status'] == 'open':
+        self._match(order)
+
+  def _match(self, order: Dict) -> None:
+    """Fills at the natural price when it is at least as good as the limit."""
+    if self.market_state != 'open':
+      return
+    quotes = [self.quote(leg['symbol']) for leg in order['legs']]
+    if any(q is None for q in quotes):
+      order['status'] = 'rejected'
+      order['reason_description'] = 'Unknown symbol'
+      return
+
+    # Net natural cost of the package per unit (positive = pay, negative = receive)
+    natural = 0.0
+    for leg, q in zip(order['legs'], quotes):
+      natural += q['ask'] if leg['side'].startswith('buy') else -q['bid']
+
+    order_type, limit = order['type'], order['price']
+    if order_type == 'market':
+      fill = natural
+    elif order_type == 'debit':
+      fill = natural if natural <= limit else None
+    elif order_type == 'credit':
+      fill = natural if -natural >= limit else None
+    elif order_type == 'limit':
+      buying = order['legs'][0]['side'].startswith('buy')
+      fill = natural if (natural <= limit if buying else -natural >= limit) else None
+    else:
+      order['status'] = 'rejected'
+      order['reason_description'] = f'Unsupported order type {order_type}'
+      return
+
+    if fill is None:
+      return
+    order['status'] = 'filled'
+    order['avg_fill_price'] = round(fill, 2)
+    order['exec_quantity'] = order['legs'][0]['quantity']
+    order['transaction_date'] = dt.datetime.now().isoformat()
+    for leg in order['legs']:
+      signed = leg['quantity'] if leg['side'].startswith('buy') else -leg['quantity']
+      self.positions[leg['symbol']] = self.positions.get(leg['symbol'], 0.0) + signed
+      if not self.positions[leg['symbol']]:
+        del self.positions[leg['symbol']]
+
+  # --- PRICING ---
+  def _option_quote(self, symbol: str, underlying: str, expiration: str, opt_type: str, strike: float,
+                    greeks: bool, root: str) -> Dict:
+    spot = self.spots[underlying]
+    sigma = max(self.spots.get('VIX', 18.0) / 100.0, 0.05)
+    days = max((dt.date.fromisoformat(expiration) - dt.date.today()).days, 0)
+    t = (days * 6.5 + self.hours_to_close) / (252 * 6.5)
+    mid, delta, gamma, theta, vega = _black_scholes(spot, strike, t, sigma, opt_type == 'call')
+    half = max(0.05, round(mid * 0.02 / 0.05) * 0.05)
+    bid = max(round(round((mid - half) / 0.05) * 0.05, 2), 0.0)
+    ask = round(round((mid + half) / 0.05) * 0.05, 2) or 0.05
+    quote = {
+      'symbol': symbol, 'type': 'option', 'root_symbol': root,
+      'underlying': underlying, 'option_type': opt_type, 'strike': strike,
+      'expiration_date': expiration, 'bid': bid, 'ask': ask, 'last': round(mid, 2),
+      'bid_date': int(time.time() * 1000), 'ask_date': int(time.time() * 1000),
+      'volume': 0, 'open_interest': 0, 'contract_size': 100
+    }
+    if greeks:
+      quote['greeks'] = {'delta': round(delta, 4), 'gamma': round(gamma, 6), 'theta': round(theta, 4),
+                         'vega': round(vega, 4), 'mid_iv': sigma, 'smv_vol': sigma}
+    return quote
+
+  def _make_bars(self, symbol: str, minutes: int = 390) -> List[Dict]:
+    """A full seeded session of 1-minute bars ending at the current spot."""
+    spot = self.spots[symbol]
+    today = dt.date.today().strftime('%Y-%m-%d')
+    bars, px = [], spot
+    for i in range(minutes):
+      nxt = px * math.exp(self._rng.gauss(0, 0.0005))
+      minute = 570 + i
+      bars.append({
+        'time': f'{today}T{minute // 60:02d}:{minute % 60:02d}:00',
+        'price': round(nxt, 2), 'open': round(px, 2), 'close': round(nxt, 2),
+        'high': round(max(px, nxt) + 0.1, 2), 'low': round(min(px, nxt) - 0.1, 2),
+        'volume': self._rng.randint(1000, 5000), 'vwap': round((px + nxt) / 2, 2)
+      })
+      px = nxt
+    return bars
+
+  def _tick_loop(self) -> None:
+    while not self._stop.wait(self.tick_seconds):
+      self.tick()
+
+class _FakeHandler(BaseHTTPRequestHandler):
+  server_fake: FakeTradierServer = None
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    self._dispatch('GET')
+
+  def do_POST(self):
+    self._dispatch('POST')
+
+  def do_PUT(self):
+    self._dispatch('PUT')
+
+  def do_DELETE(self):
+    self._dispatch('DELETE')
+
+  def _dispatch(self, method: str) -> None:
+    fake = self.server_fake
+    fake.request_count += 1
+    if fake.latency:
+      time.sleep(fake.latency)
+
+    parsed = urlparse(self.path)
+    path = parsed.path[3:] if parsed.path.startswith('/v1') else parsed.path
+    params = dict(parse_qsl(parsed.query))
+    length = int(self.headers.get('Content-Length') or 0)
+    if length:
+      params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+
+    status, body = 200, None
+    if path == '/markets/clock':
+      body = {'clock': {'date': dt.date.today().strftime('%Y-%m-%d'), 'state': fake.market_state,
+                        'timestamp': int(time.time()), 'next_change': '16:00',
+                        'next_state': 'postmarket' if fake.market_state == 'open' else 'open',
+                        'description': f'Market is {fake.market_state}'}}
+    elif path == '/markets/quotes':
+      greeks = params.get('greeks') == 'true'
+      quotes, unmatched = [], []
+      for sym in filter(None, params.get('symbols', '').split(',')):
+        q = fake.quote(sym, greeks)
+        (quotes if q else unmatched).append(q or sym)
+      body = {'quotes': {'quote': quotes[0] if len(quotes) == 1 else quotes}}
+      if unmatched:
+        body['quotes']['unmatched_symbols'] = {'symbol': unmatched}
+    elif path == '/markets/options/chains':
+      options = fake.chain(params.get('symbol', ''), params.get('expiration', ''), params.get('greeks') == 'true')
+      body = {'options': {'option': options} if options else None}
+    elif path == '/markets/options/expirations':
+      body = {'expirations': {'date': fake.expirations(params.get('symbol', ''))}}
+    elif path == '/markets/timesales':
+      body = {'series': {'data': fake.timesales(params.get('symbol', ''), params.get('start'))}}
+    elif path.endswith('/events/session') and method == 'POST':
+      body = {'stream': {'url': '', 'sessionid': uuid.uuid4().hex}}
+    else:
+      match = re.match(r'^/accounts/([^/]+)/(orders|positions)(?:/(\d+))?$', path)
+      if not match:
+        status, body = 404, {'fault': {'faultstring': f'Unknown path {path}'}}
+      elif match.group(2) == 'positions':
+        with fake._lock:
+          positions = [{'symbol': sym, 'quantity': qty, 'cost_basis': 0.0, 'id': i}
+                       for i, (sym, qty) in enumerate(fake.positions.items())]
+        body = {'positions': {'position': positions} if positions else 'null'}
+      elif method == 'POST' and not match.group(3):
+        body = fake.submit(params)
+        status = 400 if 'errors' in body else 200
+      elif method == 'GET' and not match.group(3):
+        orders = fake.list_orders()
+        body = {'orders': {'order': orders} if orders else 'null'}
+      elif method == 'GET' and match.group(3):
+        order = fake.get_order(match.group(3))
+        status, body = (200, {'order': order}) if order else (404, {'errors': {'error': ['Order not found']}})
+      elif method == 'PUT' and match.group(3):
+        body = fake.modify(match.group(3), params)
+        status, body = (200, body) if body else (400, {'errors': {'error': ['Order is not open']}})
+      elif method == 'DELETE' and match.group(3):
+        body = fake.cancel(match.group(3))
+        status = 200 if body else 404
+      else:
+        status, body = 405, {'fault': {'faultstring': 'Method not allowed'}}
+
+    payload = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(payload)))
+    self.end_headers()
+    try:
+      self.wfile.write(payload)
+    except (BrokenPipeError, ConnectionResetError):
+      pass  # client gave up (e.g. a read timeout under test)
+
+def _order_legs(form: Dict) -> List[Dict]:
+  """Tradier form fields -> [{'symbol', 'side', 'quantity'}] for option and multileg classes."""
+  if form.get('class') == 'multileg':
+    legs = []
+    for i in itertools.count():
+      if f'option_symbol[{i}]' not in form:
+        break
+      legs.append({'symbol': form[f'option_symbol[{i}]'], 'side': form[f'side[{i}]'],
+                   'quantity': float(form.get(f'quantity[{i}]', 1))})
+    return legs
+  if form.get('option_symbol'):
+    return [{'symbol': form['option_symbol'], 'side': form.get('side', 'buy_to_open'),
+             'quantity': float(form.get('quantity', 1))}]
+  return []
+
+def _public_order(order: Dict) -> Dict:
+  data = {k: v for k, v in order.items() if k != 'legs'}
+  if order['class'] == 'multileg':
+    data['leg'] = [{'option_symbol': leg['symbol'], 'side': leg['side'], 'quantity': leg['quantity']} for leg in order['legs']]
+  else:
+    data['option_symbol'] = order['legs'][0]['symbol']
+    data['side'] = order['legs'][0]['side']
+  return data
+
+def _occ(root: str, expiration: str, opt_type: str, strike: float) -> str:
+  return f"{root}{expiration[2:4]}{expiration[5:7]}{expiration[8:10]}{opt_type[0].upper()}{int(round(strike * 1000)):08d}"
+
+def _parse_occ(symbol: str) -> Optional[Tuple[str, str, str, float, str]]:
+  """-> (underlying, expiration, option_type, strike, root)"""
+  match = _OCC.match(symbol or '')
+  if not match:
+    return None
+  root, ymd, cp, strike = match.groups()
+  underlying = 'SPX' if root == 'SPXW' else root
+  expiration = f'20{ymd[:2]}-{ymd[2:4]}-{ymd[4:]}'
+  return underlying, expiration, 'call' if cp == 'C' else 'put', int(strike) / 1000.0, root
+
+def _black_scholes(spot: float, strike: float, t: float, sigma: float, is_call: bool):
+  """(price, delta, gamma, theta per day, vega per vol point), zero rates."""
+  t = max(t, 1e-6)
+  sqrt_t = math.sqrt(t)
+  d1 = (math.log(spot / strike) + 0.5 * sigma * sigma * t) / (sigma * sqrt_t)
+  d2 = d1 - sigma * sqrt_t
+  cdf = lambda x: 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+  pdf = math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi)
+  if is_call:
+    price = spot * cdf(d1) - strike * cdf(d2)
+    delta = cdf(d1)
+  else:
+    price = strike * cdf(-d2) - spot * cdf(-d1)
+    delta = cdf(d1) - 1.0
+  gamma = pdf / (spot * sigma * sqrt_t)
+  theta = -(spot * pdf * sigma) / (2 * sqrt_t) / 365.0
+  vega = spot * pdf * sqrt_t / 100.0
+  return max(price, 0.0), delta, gamma, theta, vega
+
+# --- WEBSOCKET FRAMING ---
+
+def _handshake(conn: socket.socket) -> bool:
+  request = b''
+  while b'\r\n\r\n' not in request:
+    chunk = conn.recv(4096)
+    if not chunk:
+      return False
+    request += chunk
+  headers = {}
+  for line in request.decode('latin-1').split('\r\n')[1:]:
+    if ':' in line:
+      name, value = line.split(':', 1)
+      headers[name.strip().lower()] = value.strip()
+  key = headers.get('sec-websocket-key')
+  if not key:
+    return False
+  accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+  conn.sendall((
+    'HTTP/1.1 101 Switching Protocols\r\n'
+    'Upgrade: websocket\r\n'
+    'Connection: Upgrade\r\n'
+    f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+  ).encode())
+  return True
+
+def _read_exact(conn: socket.socket, n: int) -> Optional[bytes]:
+  data = b''
+  while len(data) < n:
+    chunk = conn.recv(n - len(data))
+    if not chunk:
+      return None
+    data += chunk
+  return data
+
+def _read_frame(conn: socket.socket):
+  """Reads one client frame (always masked per RFC 6455). Returns (opcode, payload) or (None, None)."""
+  head = _read_exact(conn, 2)
+  if head is None:
+    return None, None
+  opcode = head[0] & 0x0F
+  length = head[1] & 0x7F
+  if length == 126:
+    length = struct.unpack('!H', _read_exact(conn, 2))[0]
+  elif length == 127:
+    length = struct.unpack('!Q', _read_exact(conn, 8))[0]
+  mask = _read_exact(conn, 4) if head[1] & 0x80 else b'\x00\x00\x00\x00'
+  payload = _read_exact(conn, length) if length else b''
+  if mask is None or payload is None:
+    return None, None
+  return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+def _encode_frame(payload, opcode: int = 0x1) -> bytes:
+  """Unmasked server frame, FIN set."""
+  if isinstance(payload, str):
+    payload = payload.encode('utf-8')
+  length = len(payload)
+  if length < 126:
+    header = struct.pack('!BB', 0x80 | opcode, length)
+  elif length < 65536:
+    header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+  else:
+    header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+  return header + payload
+
+def _close_quietly(sock: socket.socket) -> None:
+  # shutdown() first: close() alone does not wake a thread blocked in recv()
+  try:
+    sock.shutdown(socket.SHUT_RDWR)
+  except OSError:
+    pass
+  try:
+    sock.close()
+  except OSError:
+    pass
@@ -3,11 +3,19 @@ from anvil.tables import app_tables
 from shared import config
 from shared.classes import Cycle, Trade
 from shared.types import MarketData, EnvStatus, RuleSetDict
-from typing import Optional, Tuple, Dict, List
+from typing import Optional, Tuple, Dict, List, Union
 import datetime as dt
 import pytz
+import numpy as np
 
 from . import server_logging as logger
+from . import server_chain
+from . import server_spreads
+from . import server_volsurface
+from . import server_breaker
+from .server_chain import OptionChainFrame
+
+ChainLike = Union[List[Dict], OptionChainFrame]
 
 # --- ORCHESTRATION HELPERS ---
 
@@ -20,6 +28,15 @@ def can_run_automation(env_status: dict, settings:dict, EOD_overide: bool = Fals
     #print('not settings branch')
     return False
 
+  # Broker degraded: skip the run instead of spending it on calls that fail fast anyway.
+  # Half-open circuits pass, so the run's own calls act as the recovery probes.
+  open_circuits = [name for name, state in (env_status.get('broker_circuits') or {}).items() if state == server_breaker.OPEN]
+  if open_circuits:
+    logger.log(f"Broker circuit open ({', '.join(open_circuits)}); skipping run",
+               level=config.LOG_WARNING,
+               source=config.LOG_SOURCE_LIBS)
+    return False
+
   if EOD_overide:
     return True
     
@@ -151,6 +168,13 @@ def _is_entry_window_open(env_status: dict, rules: dict) -> bool:
 
   return minutes_since_open >= rules.get('trade_start_delay', 15)
 
+def is_shortlist_window(cycle: Cycle, env_status: EnvStatus) -> bool:
+  """True in the ENTRY_SHORTLIST_LEAD_MINUTES before the entry window opens."""
+  entry_start = int(cycle.rules.get('entry_time_est', 1500))
+  start_dt = dt.datetime.combine(env_status['now'].date(), dt.time(entry_start // 100, entry_start % 100))
+  lead_dt = start_dt - dt.timedelta(minutes=config.ENTRY_SHORTLIST_LEAD_MINUTES)
+  return lead_dt <= env_status['now'] < start_dt
+
 # --- OBJECT RETRIEVAL HELPERS ---
 def get_threatened_spread(cycle: Cycle, market_data: MarketData) -> Optional[Trade]:
   marks = market_data.get('spread_marks', {})
@@ -195,71 +219,79 @@ def get_scalpel_quantity(account_equity: float, debit_paid: float) -> int:
   return max(1, qty_effective)
 
 def calculate_scalpel_strikes(
-  chain: List[Dict], 
+  chain: ChainLike, 
   rules: Dict, 
   current_price: float, 
-  is_bullish: bool
+  is_bullish: bool,
+  fallbacks: int = None
 ) -> Optional[Dict]:
   """
   Finds the $5-wide OTM spread closest to the money that costs $1.20-$1.35.
+  Accepts a list chain or an OptionChainFrame; pairs are scored on the spread grid
+  (server_spreads), several widths at once when rules['spread_widths'] is set.
+  The result carries the next-best qualifying pairs, in order, under 'fallbacks'
+  (ENTRY_FALLBACK_PAIRS unless given); every pair has the quote_time it was priced from.
   """
   option_type = config.TRADIER_OPTION_TYPE_CALL if is_bullish else config.TRADIER_OPTION_TYPE_PUT
-  
-  # 1. Filter for correct side
-  side_chain = [opt for opt in chain if opt['option_type'] == option_type]
-  if not side_chain: 
-    return None
-  
-
-  # 2. Sort by Strike 
-  # Calls: Ascending (Lowest strike first = closest to money)
-  # Puts: Descending (Highest strike first = closest to money)
-  side_chain.sort(key=lambda x: x['strike'], reverse=not is_bullish)
-
-  width = float(rules.get('spread_width', 5.0))
   min_debit = float(rules.get('target_debit_min', 1.20))
   max_debit = float(rules.get('target_debit_max', 1.35))
 
-  # Helper to get the price we actually pay (Ask on Long, Bid on Short)
-  def get_debit(long_leg, short_leg):
-    l_ask = float(long_leg.get('ask') or long_leg.get('last') or 0)
-    s_bid = float(short_leg.get('bid') or short_leg.get('last') or 0)
-    return l_ask - s_bid
-
-  # 3. Iterate through strikes to find the pair
-  for long_leg in side_chain:
-    strike = long_leg['strike']
-
-    # Must be OTM
-    if is_bullish and strike <= current_price: 
-      continue # Call must be above price
-    if not is_bullish and strike >= current_price: 
-      continue # Put must be below price
-
-    # Find matching Short Leg ($5 wider)
-    target_short_strike = (strike + width) if is_bullish else (strike - width)
-    short_leg = next((opt for opt in side_chain if abs(opt['strike'] - target_short_strike) < 0.01), None)
-
-    if not short_leg: 
-      continue
-
-    # 4. Check if the price is in our 'Scalpel' window
-    debit = get_debit(long_leg, short_leg)
-    if min_debit <= debit <= max_debit:
-      # FOUND: This is the pair closest to the money that fits our budget
-      logger.log(f"Scalpel Pair Found: {long_leg['symbol']}/{short_leg['symbol']} at ${debit:.2f} debit", 
-                 level=config.LOG_INFO)
-      return {
-        'long_leg_data': long_leg,
-        'short_leg_data': short_leg,
-        'short_strike': short_leg['strike'],
-        'long_strike': long_leg['strike'],
-        'debit': debit,
-        'is_bullish': is_bullish
-      }
+  # 1-3. Every long paired with its short ($5 further OTM) for each width, priced at once
+  # Price we actually pay: Ask on Long, Bid on Short (the grid's natural debit)
+  surface = server_volsurface.get_surface() if config.VOL_SURFACE_ENABLED else None
+  grid = server_spreads.build_spread_grid(chain, option_type, _spread_widths(rules), current_price, is_debit=True,
+                                          surface=surface)
+
+  # 4. Must be OTM and inside our 'Scalpel' window; closest to the money wins
+  valid = grid.otm & (grid.natural >= min_debit) & (grid.natural <= max_debit)
+  fallbacks = config.ENTRY_FALLBACK_PAIRS if fallbacks is None else fallbacks
+  ranked = server_spreads.top_spreads(grid, valid, 'closest', k=1 + fallbacks)
+  if not ranked:
+    return None
 
-  return None
+  best = _scalpel_candidate(ranked[0], is_bullish)
+  best['fallbacks'] = [_scalpel_candidate(pair, is_bullish) for pair in ranked[1:]]
+  fair = f", fair ${best['fair_value']:.2f}" if best['fair_value'] is not None else ""
+  logger.log(f"Scalpel Pair Found: {best['long_leg_data']['symbol']}/{best['short_leg_data']['symbol']} "
+             f"at ${best['debit']:.2f} debit{fair} ({len(best['fallbacks'])} fallback(s))",
+             level=config.LOG_INFO)
+  return best
+
+def _scalpel_candidate(pair: Dict, is_bullish: bool) -> Dict:
+  """Spread-grid pair (debit side) in the shape the entry order and record_new_trade expect."""
+  long_leg, short_leg = pair['near_leg'], pair['far_leg']
+  return {
+    'long_leg_data': long_leg,
+    'short_leg_data': short_leg,
+    'short_strike': short_leg['strike'],
+    'long_strike': long_leg['strike'],
+    'debit': pair['price'],
+    'is_bullish': is_bullish,
+    'quote_time': pair['quote_time'],
+    'fair_value': pair['fair']
+  }
   
+def _spread_widths(rules: Dict) -> List[float]:
+  """rules['spread_widths'] (several, scored together) or the single rules['spread_width']."""
+  return [float(w) for w in (rules.get('spread_widths') or [rules.get('spread_width', 5.0)])]
+
+def build_entry_shortlist(chain: ChainLike, rules: Dict, current_price: float, size: int = None) -> Dict[str, List[str]]:
+  """
+  Pre-entry scan: per side, the `size` symbols whose strikes sit closest to where
+  calculate_scalpel_strikes would buy today (its long strike, else the current price).
+  Re-quoting only these at the trigger is enough to re-run the selector.
+  """
+  frame = server_chain.as_frame(chain)
+  size = size or config.ENTRY_SHORTLIST_SIZE
+  shortlist = {}
+  for is_bullish in (True, False):
+    option_type = config.TRADIER_OPTION_TYPE_CALL if is_bullish else config.TRADIER_OPTION_TYPE_PUT
+    candidate = calculate_scalpel_strikes(frame, rules, current_price, is_bullish)
+    anchor = candidate['long_strike'] if candidate else current_price
+    nearest = frame.index.outward(option_type, anchor)[:size]
+    shortlist[option_type] = [frame.symbol[i] for i in nearest[np.argsort(frame.strike[nearest], kind='stable')]]
+  return shortlist
+
 def find_closest_expiration(valid_dates: List[dt.date], target_dte: int) -> Optional[dt.date]:
   """Given a list of valid dates, finds the one closest to Today + Target DTE"""
   if not valid_dates: 
@@ -284,71 +316,76 @@ def check_roll_safety(market_data: MarketData, rules: Dict) -> Tuple[bool, str]:
   return True, "Roll Safety Valid"
 
 def calculate_roll_legs(
-  chain: List[Dict],
+  chain: ChainLike,
   current_short_strike: float,
   width: float,
   cost_to_close: float,
   rules: Dict,
-  current_price: float
+  current_price: float,
+  surface: 'server_volsurface.VolSurface' = None
 ) -> Optional[Dict]:
   """
     Scans for a 'Down & Out' roll. Maximizes distance.
     Finds the lowest strike that still generates enough credit to pay for 'cost_to_close'.
+    surface: legs without a two-sided quote are priced at its fair value instead of the last
+    trade, so strikes the chain did not quote can still be explored ('estimated' in the result).
     """
+  frame = server_chain.as_frame(chain)
   max_debit = float(rules.get('roll_max_debit', 0.0))
   min_dist_pct = float(rules.get('roll_min_dist_pct', 0.005))
   max_allowed_strike = current_price * (1 - min_dist_pct)
   
-  # 1. Filter and Sort
-  puts = [o for o in chain if o.get('option_type') == 'put']
-  if not puts: 
+  # 1. Puts sorted High to Low so we can find the "Lowest Valid" strike
+  shorts = frame.index.by_strike('put', descending=True)
+  if shorts.size == 0: 
     return None
-
-    # Sort High to Low so we can find the "Lowest Valid" strike
-  puts.sort(key=lambda x: x['strike'], reverse=True)
-
-  best_candidate = None
-  
-  def get_price(opt, side):
-    val = opt.get(side)
-    if val is None or val == 0: 
-      val = opt.get('last', 0)
-    return float(val)
-
-    # 2. Scan
-  for short_candidate in puts:
-    short_strike = short_candidate['strike']
-    if short_strike >= current_short_strike or short_strike > max_allowed_strike: 
-      continue
-  
-    target_long = short_strike - width
-    long_candidate = next((p for p in puts if abs(p['strike'] - target_long) < 0.05), None)
-    if not long_candidate: 
-      continue
-
-    # NEW MECHANICAL FIX: Ensure roots match (SPX vs SPXW)
-    if long_candidate.get('root_symbol') != short_candidate.get('root_symbol'):
-      continue # Skip this combination
-
-    credit_new = get_price(short_candidate, 'bid') - get_price(long_candidate, 'ask')
-    
-    net_price = credit_new - cost_to_close
-    if net_price >= (-max_debit):          
-      # Valid candidate found. Store it.
-      # We continue the loop to see if a LOWER strike (safer) also pays enough.
-      best_candidate = {
-        'short_leg': short_candidate,
-        'long_leg': long_candidate,
-        'new_credit': credit_new,
-        'net_price': net_price
-      }
-    else:
-      # Credit dropped too low. Since premiums drop as strikes drop,
-      # no further candidates will work. Stop scanning.
-      if best_candidate: 
-        break
-
-  return best_candidate
+  short_strikes = frame.strike[shorts]
+
+  # 2. Pair and price every candidate at once
+  # The index pairs within one root, so SPX and SPXW legs never mix
+  longs = frame.index.match(shorts, short_strikes - width, 0.05)
+  has_long = longs >= 0
+  safe_longs = np.where(has_long, longs, 0)
+
+  eligible = (
+    (short_strikes < current_short_strike) 
+    & (short_strikes <= max_allowed_strike) 
+    & has_long 
+  )
+  short_bid = frame.bid_or_last()[shorts]
+  long_ask = frame.ask_or_last()[safe_longs]
+  estimated = np.zeros(shorts.size, dtype=bool)
+  if surface is not None:
+    fair = server_volsurface.frame_fair_values(frame, current_price, surface)
+    quoted = (frame.bid > 0) & (frame.ask > 0)
+    short_model = ~quoted[shorts] & ~np.isnan(fair[shorts])
+    long_model = ~quoted[safe_longs] & ~np.isnan(fair[safe_longs])
+    short_bid = np.where(short_model, fair[shorts], short_bid)
+    long_ask = np.where(long_model, fair[safe_longs], long_ask)
+    estimated = short_model | long_model
+  credit_new = short_bid - long_ask
+  net_price = credit_new - cost_to_close
+  pays = eligible & (net_price >= (-max_debit))
+
+  # 3. Walk down from the first strike that pays; stop at the first one after it that doesn't.
+  # Premiums drop as strikes drop, so the last payer before that point is the safest valid roll.
+  pay_rows = np.flatnonzero(pays)
+  if pay_rows.size == 0:
+    return None
+  first_pay = pay_rows[0]
+  fail_rows = np.flatnonzero(eligible & ~pays)
+  fail_rows = fail_rows[fail_rows > first_pay]
+  if fail_rows.size:
+    pay_rows = pay_rows[pay_rows < fail_rows[0]]
+  best = pay_rows[-1]
+
+  return {
+    'short_leg': frame.leg(shorts[best]),
+    'long_leg': frame.leg(longs[best]),
+    'new_credit': float(credit_new[best]),
+    'net_price': float(net_price[best]),
+    'estimated': bool(estimated[best])
+  }
 
 def check_entry_conditions(
   cycle: Cycle,
@@ -404,26 +441,17 @@ def check_entry_conditions(
     if intraday_drop_pct < -gap_thresh:
       return False, f"Intraday drop {intraday_drop_pct:.1%} exceeds limit"
 
-  # --- 3. SHORT DAY CHECK (Logic) ---
-  # Tradier 'next_state_change' is usually "HH:MM" (24h)
-  # Standard close is 16:00. Early close is usually 13:00.
-  next_change_str = env_status.get('next_state_change', '16:00')
-  try:
-    # Parse hour from string "13:00"
-    close_hour = int(next_change_str.split(':')[0])
-
-    # If market closes before 15:00 (3 PM), it's a Short Day.
-    if close_hour < 15:
-      return False, f"Market closes early ({next_change_str}) - Entry Blocked"
-  except (ValueError, IndexError):
-    # If format is weird, assume standard day and proceed, or log warning
-    pass
+  # --- 3. SHORT DAY CHECK (Calendar) ---
+  # Early closes (13:00) come from server_calendar via env_status
+  if env_status.get('is_short_day'):
+    close_t = env_status.get('close_time') or config.MARKET_EARLY_CLOSE_TIME
+    return False, f"Market closes early ({close_t.strftime('%H:%M')}) - Entry Blocked"
 
   return True, "Entry valid"
 
 
 def calculate_spread_strikes(
-  chain: List[Dict],
+  chain: ChainLike,
   rules: Dict,
   option_type: str = config.TRADIER_OPTION_TYPE_PUT
 ) -> Optional[Tuple[float, float]]:
@@ -433,97 +461,36 @@ def calculate_spread_strikes(
   2. Filters for Credit between Min/Max rules.
   3. Selects the SAFEST (Lowest Strike) candidate that gets paid.
   """
-  side_chain = [opt for opt in chain if opt['option_type'] == option_type]
-  if not side_chain: 
-    return None
-  
-  # Helper to get price (Midpoint fallback to Last for Sandbox safety)
-  def get_prices(opt):
-    bid = float(opt.get('bid', 0) or 0)
-    ask = float(opt.get('ask', 0) or 0)
-    return bid, ask
-
-  def to_nickel(val):
-    """Rounds to nearest 0.05"""
-    return round(val * 20) / 20.0
-
-  spread_width = rules['spread_width']
   min_credit = rules['spread_min_premium']
   max_credit = rules['spread_max_premium']
+  # SPX rule of thumb: If bid/ask spread > 0.75, it's not a real quote
+  liquidity_threshold = rules.get('max_bid_ask_spread', config.MAX_BID_ASK_SPREAD)
 
-  valid_candidates = []
-  # DEBUG COUNTERS
-  reject_liquidity = 0
-  reject_price_low = 0
-  reject_price_high = 0
-  # 1. Scan all potential short legs
-  for short_leg in side_chain:
-    s_bid, s_ask = get_prices(short_leg)
-    if s_bid == 0 or s_ask == 0: 
-      continue
-
-    # SPX rule of thumb: If bid/ask spread > 0.75, it's not a real quote
-    liquidity_threshold = rules.get('max_bid_ask_spread', config.MAX_BID_ASK_SPREAD)
-    if (s_ask - s_bid) > liquidity_threshold: 
-      reject_liquidity += 1
-      continue
-
-    short_strike = short_leg['strike']
-
-    # Find matching Long Leg
-    if option_type == config.TRADIER_OPTION_TYPE_PUT:
-      long_strike = short_strike - spread_width
-    else:
-      long_strike = short_strike + spread_width
-
-      # Exact match check
-    long_leg = next((opt for opt in side_chain if abs(opt['strike'] - long_strike) < 0.01), None)
-    if not long_leg: 
-      continue
-
-    # 2. Check Price (The "Money Talks" Filter)
-    l_bid, l_ask = get_prices(long_leg)
-    if l_bid == 0 or l_ask == 0: 
-      continue
-    if (l_ask - l_bid) > liquidity_threshold: 
-      reject_liquidity += 1
-      continue
-    
-    # 2. Midpoint Calc
-    s_mid = (s_bid + s_ask) / 2.0
-    l_mid = (l_bid + l_ask) / 2.0
-    raw_credit = s_mid - l_mid
-    credit = to_nickel(raw_credit)
-
-    # Does it pay the rent?
-    if credit < min_credit:
-      reject_price_low += 1
-    elif credit > max_credit:
-      reject_price_high += 1
-    else:
-      valid_candidates.append({
-        'short_strike': short_strike,
-        'long_strike': long_strike,
-        'credit': credit
-      })
+  # 1. Every short paired with its long (exact width further OTM), all widths at once
+  grid = server_spreads.build_spread_grid(chain, option_type, _spread_widths(rules), None, is_debit=False)
 
-  if not valid_candidates:
-    # DEBUG PRINT
-    print(f"DEBUG REJECT: Scanned {len(side_chain)} legs.")
-    print(f"   Rejected Liquidity (>1.50 wide): {reject_liquidity}")
-    print(f"   Rejected Low Price (<{min_credit}): {reject_price_low}")
-    print(f"   Rejected High Price (>{max_credit}): {reject_price_high}")
-    return None
+  # 2. Both legs quoted and liquid; midpoint credit, rounded to the nickel
+  liquid = grid.liquid(liquidity_threshold)
+  credit = np.round(grid.mid * 20) / 20.0
 
-  # 3. Pick the Winner
-  # Strategy: "Maximize Distance". 
-  # Sort by Short Strike Ascending (Lowest first).
-  # The first item is the furthest OTM strike that meets our income requirement.
-  valid_candidates.sort(key=lambda x: x['short_strike'])
+  # 3. Does it pay the rent?
+  too_low = liquid & (credit < min_credit)
+  too_high = liquid & (credit > max_credit)
+  valid = liquid & ~too_low & ~too_high
 
-  best = valid_candidates[0]
+  # 4. Pick the Winner
+  # Strategy: "Maximize Distance". 
+  # The lowest short strike is the furthest OTM strike that meets our income requirement.
+  best = server_spreads.top_spreads(grid, valid, 'lowest_strike', k=1, price=credit)
+  if not best:
+    # DEBUG PRINT
+    print(f"DEBUG REJECT: Scanned {len(grid)} pairs.")
+    print(f"   Rejected Liquidity (>{liquidity_threshold} wide): {int(np.count_nonzero(~liquid))}")
+    print(f"   Rejected Low Price (<{min_credit}): {int(np.count_nonzero(too_low))}")
+    print(f"   Rejected High Price (>{max_credit}): {int(np.count_nonzero(too_high))}")
+    return None
 
-  return best['short_strike'], best['long_strike']
+  return best[0]['near_strike'], best[0]['far_strike']
   
 def validate_premium_and_size(
   short_leg: Dict,
@@ -576,7 +543,7 @@ def get_spread_quantity(
 
 def evaluate_entry(
   cycle: Cycle,
-  chain: List[Dict],
+  chain: ChainLike,
   market_data: MarketData,
   env_status: Dict,
   rules: Dict
@@ -602,8 +569,9 @@ def evaluate_entry(
     return False, {}, "No active (OPEN) hedge linked to cycle"
 
   # 3. Strike Selection
+  frame = server_chain.as_frame(chain)
   strikes = calculate_spread_strikes(
-    chain,
+    frame,
     rules=rules 
   )
   if not strikes:
@@ -612,8 +580,10 @@ def evaluate_entry(
   short_strike, long_strike = strikes
 
   # 4. Data Extraction
-  short_leg = next(leg for leg in chain if leg['strike'] == short_strike and leg['option_type'] == 'put')
-  long_leg = next(leg for leg in chain if leg['strike'] == long_strike and leg['option_type'] == 'put')
+  short_leg = frame.leg_at_strike('put', short_strike)
+  long_leg = frame.leg_at_strike('put', long_strike)
+  if not short_leg or not long_leg:
+    return False, {}, f"Strikes {short_strike}/{long_strike} missing from chain"
 
   # 5. Validation
   is_valid_prem, credit, prem_msg = validate_premium_and_size(
@@ -8,6 +8,8 @@ import json, pytz
 import requests
 
 from shared import config
+from . import server_calendar
+from . import server_env
 
 # Universal Logger Function
 @anvil.server.callable
@@ -36,7 +38,7 @@ def log(message: str, level: int = config.LOG_INFO, source: str = "System", cont
     
     if today_date.weekday() >= 5: 
       return 
-    if today_date in config.MARKET_HOLIDAYS: 
+    if server_calendar.is_holiday(today_date): 
       return
     if now_time < config.LOG_START_TIME or now_time > config.LOG_STOP_TIME: 
       return # Silent exit
@@ -45,14 +47,17 @@ def log(message: str, level: int = config.LOG_INFO, source: str = "System", cont
   # 1. CONSOLE (Immediate Print)
   if level >= config.LEVEL_CONSOLE:
     lvl_name = config.LOG_NAMES.get(level, "UNKNOWN")
-    # Format: [INFO] [System] Message...
-    print(f"[{lvl_name}] [{source}] {message}")
+    # Format: [INFO] [System] Message... ([INFO] [PROD] [System] ... when several envs run)
+    if len(server_env.automation_envs()) > 1:
+      print(f"[{lvl_name}] [{server_env.current_env()}] [{source}] {message}")
+    else:
+      print(f"[{lvl_name}] [{source}] {message}")
 
     # 2. DATABASE (Persistent Record)
   if level >= config.LEVEL_DB:
     anvil.server.launch_background_task(
       'persist_log_and_alert_async', 
-      message, level, source, context, config.ACTIVE_ENV
+      message, level, source, context, server_env.current_env()
     )
 
 # --- BACKGROUND TASKS ---
@@ -78,11 +83,11 @@ def persist_log_and_alert_async(message, level, source, context, environment):
 
     # 2. If Critical, send the alert (Pushover)
   if level >= config.LEVEL_ALERT:
-    send_alert_async(message, level, source) # Call your existing alert logic
+    send_alert_async(message, level, source, environment) # Call your existing alert logic
 
 @anvil.server.callable
 @anvil.server.background_task
-def send_alert_async(message, level, source):
+def send_alert_async(message, level, source, environment=None):
   """
     Handles slow notifications.
     Optimized for Email-to-SMS Gateways (Plain text, short).
@@ -100,7 +105,7 @@ def send_alert_async(message, level, source):
   if level >= config.LOG_CRITICAL:
     priority = 1 # High Priority (Red color, bypass silent mode often)
   
-    env_code = "P" if config.ACTIVE_ENV == config.ENV_PROD else "S"
+    env_code = "P" if (environment or server_env.current_env()) == config.ENV_PROD else "S"
   title = f"[{env_code}] {config.LOG_NAMES.get(level, 'ALERT')}: {source}"
   
   try:
@@ -160,7 +165,7 @@ def send_daily_digest():
     return
 
     # 3. Format Email Body
-  lines = [f"Daily Automation Digest ({config.ACTIVE_ENV})", ""]
+  lines = [f"Daily Automation Digest ({', '.join(server_env.automation_envs())})", ""]
 
   if criticals:
     lines.append("=== CRITICAL ERRORS (ACTION REQUIRED) ===")
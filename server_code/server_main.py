@@ -4,13 +4,15 @@ from anvil.tables import app_tables
 
 import datetime as dt
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, Dict, List
 
 from shared import config
 from shared.classes import Cycle, Trade, Leg
+from shared.types import EntryContext
 from . import server_libs  # The Brains (Clean Stubs)
 from . import server_api  # The Hands (Dirty Stubs)
-from . import server_db, server_logging as logger
+from . import server_db, server_env, server_metrics, server_logging as logger
 
 @anvil.server.callable
 @anvil.server.background_task
@@ -26,13 +28,32 @@ def run_automation_routine():
     return
   print('run_automation_routine: after _set_processing_lock, executing loop')
   try:
-    _execute_automation_loop()
+    envs = server_env.automation_envs()
+    if len(envs) == 1:
+      _run_env_automation(envs[0])
+    else:
+      # Side by side: each env has its own transport, streams and cycle; one lock covers the run
+      with ThreadPoolExecutor(max_workers=len(envs), thread_name_prefix='automation') as pool:
+        list(pool.map(_run_env_automation, envs))
     
   except Exception as e:
     logger.log(f"CRITICAL: Automation loop crashed: {e}", level=config.LOG_CRITICAL)
 
   finally:
     _set_processing_lock(False)
+    server_metrics.flush()
+
+def _run_env_automation(env: str) -> None:
+  """One automation pass for env. A crash is logged here so it cannot stop the other envs."""
+  with server_env.use_env(env):
+    try:
+      _execute_automation_loop()
+    except Exception as e:
+      logger.log(f"CRITICAL: Automation loop crashed ({env}): {e}", level=config.LOG_CRITICAL)
+
+def _account_equity() -> float:
+  settings = app_tables.settings.get()
+  return float(settings['total_account_equity'] or 50000)
 
 @anvil.tables.in_transaction
 def _set_processing_lock(value: bool) -> bool:
@@ -59,7 +80,7 @@ def _execute_automation_loop():
   settings_row = app_tables.settings.get()  
   is_dry_run = settings_row['dry_run']
   system_settings = dict(settings_row) if settings_row else {} # <--- Force conversion
-  current_env_account = config.ACTIVE_ENV # e.g., 'PROD' or 'SANDBOX'
+  current_env_account = server_env.current_env() # e.g., 'PROD' or 'SANDBOX'
   print('in _exec')
   env_status = server_api.get_environment_status()
   today = env_status['today']
@@ -81,7 +102,7 @@ def _execute_automation_loop():
   if cycle:
     has_trade = any(t for t in cycle.trades if t.status == config.STATUS_OPEN)
   else:
-    if server_db.check_cycle_closed_today(config.ACTIVE_ENV):
+    if server_db.check_cycle_closed_today(current_env_account):
       logger.log("System Idle - Cycle closed today (Panic/Manual). Waiting for tomorrow.", 
                  level=config.LOG_DEBUG, 
                  source=config.LOG_SOURCE_ORCHESTRATOR)
@@ -114,10 +135,6 @@ def _execute_automation_loop():
     logger.log(f"Cycle {cycle.id} created and hydrated. Proceeding immediately.", 
                level=config.LOG_INFO, 
                source=config.LOG_SOURCE_ORCHESTRATOR)
-  print('before market data snapshot')
-  market_data = server_api.get_market_data_snapshot(cycle)
-  print(f'market: {market_data}')
-    
   # 3. SYNC REALITY (Dirty)
   # Ensure DB matches Tradier before making decisions
   if config.ENFORCE_ZOMBIE_CHECKS:
@@ -160,34 +177,63 @@ def _execute_automation_loop():
       
   # 1. Get the state from our new library function
   state = server_libs.determine_scalpel_state(cycle, env_status)  
-  process_state_decision(cycle, state, env_status, is_dry_run)
+
+  # 2. Fetch market inputs (entry window pulls everything in one concurrent stage)
+  entry_context = None
+  if state == config.STATE_ENTRY_WINDOW:
+    entry_context = server_api.get_entry_context(cycle, env_status)
+    market_data = entry_context['market_data']
+  else:
+    market_data = server_api.get_market_data_snapshot(cycle)
+  print(f'market: {market_data}')
+
+  process_state_decision(cycle, 
+                         state, 
+                         env_status, 
+                         market_data=market_data, 
+                         is_dry_run=is_dry_run, 
+                         entry_context=entry_context)
   
 def process_state_decision(cycle: Cycle, 
                            decision_state: str, 
                            env_status, 
                            market_data: dict=None, 
-                           is_dry_run:bool=False) -> None:
+                           is_dry_run:bool=False,
+                           entry_context: EntryContext=None) -> None:
   # 2. Execute
   if decision_state == config.STATE_WAITING:
+    # Phase one of the entry: full-chain scan just before the window opens
+    if config.ENTRY_SHORTLIST_ENABLED and server_libs.is_shortlist_window(cycle, env_status):
+      server_api.prepare_entry_shortlist(cycle, env_status, account_equity=_account_equity())
     return
 
   if decision_state == config.STATE_ENTRY_WINDOW:
     logger.log("Entering Scalpel Entry Window. Checking Filters...", level=config.LOG_INFO)
 
-    # A. Fetch Market Environment (VIX/VWAP)
-    mkt = server_api.get_scalpel_environment()
+    # A. Market Environment (VIX/VWAP) + chain, fetched concurrently
+    if entry_context is None:
+      entry_context = server_api.get_entry_context(cycle, env_status)
+    mkt = entry_context['scalpel_env']
     if mkt['vix'] < cycle.rules.get('vix_min', 13.0):
       return # Too quiet
 
     # C. Filter: Directional Selection
-    chain = server_api.get_option_chain(date=env_status['today'])
+    chain = entry_context['chain']
     candidate = server_libs.calculate_scalpel_strikes(
       chain, cycle.rules, mkt['price'], mkt['is_bullish']
     )
+    if not candidate and entry_context.get('chain_source') == 'shortlist':
+      # Price left the shortlisted strikes: fall back to the full chain
+      logger.log("No candidate in entry shortlist. Rescanning full chain...", level=config.LOG_INFO)
+      chain = server_api.get_option_chain_frame(date=env_status['today'], near=mkt['price'])
+      candidate = server_libs.calculate_scalpel_strikes(
+        chain, cycle.rules, mkt['price'], mkt['is_bullish']
+      )
     vwap_pct = mkt.get('vwap_pct', 0.0)
     bias = 'CALL' if vwap_pct >= 0 else 'PUT'
     if candidate:
-      _execute_scalpel_entry(cycle, candidate, is_dry_run, entry_bias=bias, vwap_pct=vwap_pct)
+      _execute_scalpel_entry(cycle, candidate, is_dry_run, entry_bias=bias, vwap_pct=vwap_pct,
+                             preflight=entry_context.get('preflight'))
 
   elif decision_state == config.STATE_ACTIVE_HUNT:
     # Logic: We have an open trade, check if our $3.50 limit hit
@@ -196,8 +242,8 @@ def process_state_decision(cycle: Cycle,
       return
     trade = active_trades[0]
 
-    # Verify order status at broker
-    status, fill_px = server_api.wait_for_order_fill(trade.order_id_external, timeout_seconds=1)
+    # Verify order status (order event registry; REST only if the registry is not current)
+    status, fill_px = server_api.check_order_status(trade.order_id_external)
 
     if status == 'filled':
       server_db.close_trade(trade._row, fill_px, dt.datetime.now(dt.timezone.utc), trade.order_id_external)
@@ -212,9 +258,8 @@ def process_state_decision(cycle: Cycle,
     logger.log("Market Closed. Executing EOD Settlement...", level=config.LOG_INFO)
 
     # 2. Calculate Terminal Value
-    # Fetch final price of SPX
-    mkt = server_api.get_scalpel_environment()
-    final_px = mkt['price']
+    # Final price of SPX: last 1-minute close from the intraday accumulator (no full history pull)
+    final_px = server_api.get_session_last_price()
 
     # We need the strike to calculate payout
     # For a Bullish Call Spread: max(0, min(Width, SPX - Long_Strike))
@@ -251,8 +296,8 @@ def process_scalpel_entry_logic(cycle: Cycle,
     logger.log(f"VIX too low ({market_env['vix']}). Skipping.", level=config.LOG_INFO)
     return
 
-    # 2. Get Option Chain
-  chain = server_api.get_option_chain(date=env_status['today'])
+    # 2. Get Option Chain (columnar)
+  chain = server_api.get_option_chain_frame(date=env_status['today'], near=market_env['price'])
 
   # 3. Select Strikes
   candidate = server_libs.calculate_scalpel_strikes(
@@ -267,34 +312,45 @@ def process_scalpel_entry_logic(cycle: Cycle,
   # This will call our DRY_RUN interceptor automatically
   _execute_scalpel_entry(cycle, candidate, is_dry_run, entry_bias=bias, vwap_pct=vwap_pct)
 
-def _execute_scalpel_entry(cycle: Cycle, candidate: dict, is_dry_run:bool=False, entry_bias:str = None, vwap_pct:float=None) -> bool:
+def _execute_scalpel_entry(cycle: Cycle, candidate: dict, is_dry_run:bool=False, entry_bias:str = None, vwap_pct:float=None,
+                           preflight: dict = None) -> bool:
   """
     Quarter Kelly Sizing -> Buy Spread -> Record DB -> Place $3.50 Limit Sell.
+    preflight: the scan's order previews (server_api.preflight_entry_orders); a passing one
+    for this side supplies the payload template.
+    If the entry times out, candidate['fallbacks'] are tried in rank order, each re-quoted
+    on its own (two legs, one request) and skipped if it left the debit window.
     """
-  # 1. SIZING (Quarter Kelly)
-  settings = app_tables.settings.get()
-  account_equity = float(settings['total_account_equity'] or 50000)
-
-  qty = server_libs.get_scalpel_quantity(account_equity, candidate['debit'])
-  candidate['quantity'] = qty
-
-  logger.log(f"SCALPEL START: Sizing {qty} contracts for ${candidate['debit']:.2f} debit.", 
-             level=config.LOG_INFO)
-
-  # 2. BUY ENTRY
-  order_res = server_api.open_spread_position(candidate, is_debit=True, is_dry_run=is_dry_run)
-
-  # Reuse our 'Entry and Sync' logic (Mechanical Verification)
-  # Note: Pass the debit as the fallback price
-  new_trade = _execute_entry_and_sync(cycle, 
-                                      order_res, 
-                                      candidate, 
-                                      config.ROLE_INCOME, 
-                                      "Scalpel Entry", 
-                                      fill_px_fallback=candidate['debit'],
-                                      vwap_pct=vwap_pct,
-                                      entry_bias=entry_bias
-                                    )
+  entry_tag = server_api.order_tag(cycle.id, None, 'OPEN_SPREAD')
+  side = config.TRADIER_OPTION_TYPE_CALL if candidate.get('is_bullish') else config.TRADIER_OPTION_TYPE_PUT
+  checked = (preflight or {}).get(side)
+  template = checked['template'] if checked and checked['ok'] else None
+  if checked and not checked['ok']:
+    logger.log(f"Entry preflight for {side} was rejected ({checked['error']}); submitting anyway", level=config.LOG_WARNING)
+  min_debit = float(cycle.rules.get('target_debit_min', config.TARGET_DEBIT_MIN))
+  max_debit = float(cycle.rules.get('target_debit_max', config.TARGET_DEBIT_MAX))
+  equity = _account_equity()
+
+  pairs = [candidate] + list(candidate.get('fallbacks') or [])
+  new_trade, submitted = None, {}  # broker order id -> the pair it was placed for
+  for attempt, pair in enumerate(pairs):
+    if attempt > 0:
+      # The chain these were ranked from is older than the order that just timed out
+      pair = server_api.requote_spread_candidate(pair)
+      if not pair or not (min_debit <= pair['debit'] <= max_debit):
+        reason = f"debit ${pair['debit']:.2f} outside window" if pair else "no quote"
+        logger.log(f"Entry fallback {attempt}/{len(pairs) - 1} skipped: {reason}", level=config.LOG_INFO)
+        continue
+      logger.log(f"ENTRY FALLBACK {attempt}/{len(pairs) - 1}: "
+                 f"{pair['long_leg_data']['symbol']}/{pair['short_leg_data']['symbol']} at ${pair['debit']:.2f}",
+                 level=config.LOG_INFO)
+
+    # Same tag throughout: an earlier order whose cancel did not land is recovered, not doubled
+    new_trade, order_res = _submit_scalpel_entry(cycle, pair, equity, max_debit, entry_tag, template,
+                                                 is_dry_run, entry_bias, vwap_pct, submitted)
+    if new_trade or not order_res.get('id') or order_res.get('recovered'):
+      break  # filled, rejected, or an earlier order is still live
+    submitted[order_res['id']] = pair
 
   if new_trade:
     # 3. MONETIZE THE TOUCH (Immediate Limit Sell)
@@ -310,7 +366,8 @@ def _execute_scalpel_entry(cycle: Cycle, candidate: dict, is_dry_run:bool=False,
 
     # Place the $3.50 Limit Order immediately
     # We'll use a modified close_position that accepts a limit price
-    exit_res = server_api.close_position(new_trade, order_type='limit', limit_price=harvest_target, is_dry_run=is_dry_run)
+    harvest_tag = server_api.order_tag(cycle.id, new_trade.id, 'HARVEST')
+    exit_res = server_api.close_position(new_trade, order_type='limit', limit_price=harvest_target, is_dry_run=is_dry_run, tag=harvest_tag)
 
     if exit_res.get('id'):
       # Update the trade row with the active Order ID so we can track it
@@ -322,6 +379,53 @@ def _execute_scalpel_entry(cycle: Cycle, candidate: dict, is_dry_run:bool=False,
 
   return False
 
+def _submit_scalpel_entry(cycle: Cycle, candidate: dict, equity: float, max_debit: float, entry_tag: str,
+                         template: dict, is_dry_run: bool, entry_bias: str, vwap_pct: float, submitted: dict = None):
+  """
+    Sizes, submits and waits out one entry pair. Returns (new trade or None, execution report).
+    submitted: earlier pairs by order id; an order recovered by tag is synced with its own pair's
+    legs, and left unrecorded if it is not one of them (placed by an earlier run).
+    """
+  # 1. SIZING (Quarter Kelly)
+  qty = server_libs.get_scalpel_quantity(equity, candidate['debit'])
+  candidate['quantity'] = qty
+
+  logger.log(f"SCALPEL START: Sizing {qty} contracts for ${candidate['debit']:.2f} debit.", 
+             level=config.LOG_INFO)
+
+  # 2. BUY ENTRY
+  execution = None
+  if config.ENTRY_LADDER_ENABLED and not is_dry_run:
+    # Start near mid and walk toward the debit cap instead of paying the natural price up front
+    order_res, execution = server_api.ladder_spread_order(candidate, max(max_debit, candidate['debit']), tag=entry_tag,
+                                                          template=template)
+  else:
+    order_res = server_api.open_spread_position(candidate, is_debit=True, is_dry_run=is_dry_run, tag=entry_tag,
+                                                template=template)
+
+  if order_res.get('recovered'):
+    # The tag matched a live order whose cancel did not land: record what it actually holds
+    original = (submitted or {}).get(order_res['id'])
+    if not original:
+      logger.log(f"Entry order {order_res['id']} recovered by tag was not placed by this scan; not recording it",
+                 level=config.LOG_WARNING)
+      return None, order_res
+    candidate = original
+
+  # Reuse our 'Entry and Sync' logic (Mechanical Verification)
+  # Note: Pass the debit as the fallback price
+  new_trade = _execute_entry_and_sync(cycle, 
+                                      order_res, 
+                                      candidate, 
+                                      config.ROLE_INCOME, 
+                                      "Scalpel Entry", 
+                                      fill_px_fallback=candidate['debit'],
+                                      vwap_pct=vwap_pct,
+                                      entry_bias=entry_bias,
+                                      execution=execution
+                                    )
+  return new_trade, order_res
+
 # In server_main.py (Private helper)
 def _execute_settlement_and_sync(trade_obj: Trade, order_res: dict, action_desc: str, close_cycle: bool = False, fill_px_fallback: float=0.0) -> bool:
   """
@@ -363,17 +467,23 @@ def _execute_entry_and_sync(cycle: Cycle,
                             entry_reason: str = None, 
                             fill_px_fallback: float=0.0,
                             vwap_pct: float=0.0,
-                           entry_bias: str = None) -> bool:
+                           entry_bias: str = None,
+                           execution: dict = None) -> bool:
   """
     Unified handler for all position entries.
     Includes Safety: Cancels order on broker if timeout occurs.
+    execution: ladder stats (fill latency / slippage / steps) stored on the opening transaction.
+    The ladder has already waited and canceled, so with execution its settled status is used as is.
     """
   order_id = order_res.get('id')
   if not order_id: 
     return False
 
     # 1. Wait
-  status, fill_px = server_api.wait_for_order_fill(order_id, config.ORDER_TIMEOUT_SECONDS, fill_px_fallback)
+  if execution is not None:
+    status, fill_px = order_res.get('status'), float(order_res.get('fill_price') or 0.0)
+  else:
+    status, fill_px = server_api.wait_for_order_fill(order_id, config.ORDER_TIMEOUT_SECONDS, fill_px_fallback)
 
   if status == 'filled':
     # 2. Record (Inside Transaction)
@@ -387,12 +497,17 @@ def _execute_entry_and_sync(cycle: Cycle,
       fill_price=final_px,
       fill_time=dt.datetime.now(dt.timezone.utc),
       vwap_pct=vwap_pct,
-      entry_bias=entry_bias
+      entry_bias=entry_bias,
+      execution=execution
     )
       
     logger.log(f"SUCCESS: {action_desc} filled at ${final_px}", level=config.LOG_INFO)
     return new_trade
 
+  if execution is not None:
+    logger.log(f"UNFILLED: {action_desc} ladder ended {status}; order already canceled.", level=config.LOG_WARNING)
+    return None
+
     # 3. SAFETY: If entry didn't fill, we MUST cancel it on broker 
     # so we don't accidentally fill later and desync.
   logger.log(f"TIMEOUT: {action_desc} failed. Canceling order...", level=config.LOG_WARNING)
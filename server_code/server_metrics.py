@@ -0,0 +1,203 @@
+import datetime as dt
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from shared import config
+from . import server_db
+from . import server_logging as logger
+
+# Broker call metrics. BrokerTransport records every logical request (retries included)
+# into per-minute, per-endpoint windows held in memory; flush() writes them to the
+# broker_metrics table. Histograms use fixed log-spaced buckets, so windows from
+# different minutes or processes merge exactly and percentiles come from the merge.
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+# --- HISTOGRAM ---
+
+def bucket_index(seconds: float) -> int:
+  if seconds <= config.METRICS_BUCKET_MIN_SECONDS:
+    return 0
+  idx = math.ceil(math.log(seconds / config.METRICS_BUCKET_MIN_SECONDS) / math.log(config.METRICS_BUCKET_GROWTH))
+  return min(idx, config.METRICS_BUCKET_COUNT - 1)
+
+def bucket_upper(idx: int) -> float:
+  """Upper latency bound (seconds) of bucket idx."""
+  return config.METRICS_BUCKET_MIN_SECONDS * config.METRICS_BUCKET_GROWTH ** idx
+
+class LatencyHistogram:
+  """Sparse bucket counts {bucket index: calls}."""
+  def __init__(self, counts: Dict = None):
+    self.counts: Dict[int, int] = {}
+    self.merge(counts or {})
+
+  def add(self, seconds: float) -> None:
+    idx = bucket_index(seconds)
+    self.counts[idx] = self.counts.get(idx, 0) + 1
+
+  def merge(self, counts: Dict) -> None:
+    # Stored rows come back with string keys (simpleObject is JSON)
+    for idx, n in counts.items():
+      self.counts[int(idx)] = self.counts.get(int(idx), 0) + int(n)
+
+  @property
+  def total(self) -> int:
+    return sum(self.counts.values())
+
+  def percentile(self, q: float) -> float:
+    """Upper bound of the bucket holding the q-th (0..1) call; 0.0 when empty."""
+    total = self.total
+    if not total:
+      return 0.0
+    rank = max(math.ceil(q * total), 1)
+    seen = 0
+    for idx in sorted(self.counts):
+      seen += self.counts[idx]
+      if seen >= rank:
+        return bucket_upper(idx)
+    return bucket_upper(max(self.counts))
+
+  def to_state(self) -> Dict[str, int]:
+    return {str(idx): n for idx, n in sorted(self.counts.items())}
+
+# --- WINDOWS ---
+
+class EndpointWindow:
+  """Counters plus latency histogram for one endpoint over one minute (or any merge of those)."""
+  def __init__(self):
+    self.calls = 0
+    self.errors = 0
+    self.retries = 0
+    self.bytes = 0
+    self.latency_sum = 0.0
+    self.latency_max = 0.0
+    self.statuses: Dict[str, int] = {}
+    self.hist = LatencyHistogram()
+
+  def add(self, status: Optional[int], latency: float, nbytes: int, retries: int) -> None:
+    self.calls += 1
+    self.errors += 1 if status is None or status >= 400 else 0
+    self.retries += retries
+    self.bytes += nbytes
+    self.latency_sum += latency
+    self.latency_max = max(self.latency_max, latency)
+    key = str(status) if status is not None else 'network'
+    self.statuses[key] = self.statuses.get(key, 0) + 1
+    self.hist.add(latency)
+
+  def merge(self, row: Dict) -> None:
+    """Adds a stored broker_metrics row (or another window's to_row())."""
+    self.calls += row['calls'] or 0
+    self.errors += row['errors'] or 0
+    self.retries += row['retries'] or 0
+    self.bytes += row['bytes'] or 0
+    self.latency_sum += row['latency_sum'] or 0.0
+    self.latency_max = max(self.latency_max, row['latency_max'] or 0.0)
+    for key, n in (row['statuses'] or {}).items():
+      self.statuses[key] = self.statuses.get(key, 0) + n
+    self.hist.merge(row['buckets'] or {})
+
+  def to_row(self) -> Dict:
+    return {
+      'calls': self.calls,
+      'errors': self.errors,
+      'retries': self.retries,
+      'bytes': self.bytes,
+      'latency_sum': round(self.latency_sum, 6),
+      'latency_max': round(self.latency_max, 6),
+      'buckets': self.hist.to_state(),
+      'statuses': dict(self.statuses)
+    }
+
+# (minute, env, endpoint) -> window, until the next flush
+_WINDOWS: Dict[Tuple[dt.datetime, str, str], EndpointWindow] = {}
+_LOCK = threading.Lock()
+
+def endpoint_key(method: str, path: str, account_id: str = None) -> str:
+  """'GET /accounts/{account}/orders/{id}': account and numeric ids folded so calls group per endpoint."""
+  if account_id:
+    path = path.replace(f'/{account_id}', '/{account}')
+  return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+def record(env: str, endpoint: str, status: Optional[int], latency: float, nbytes: int = 0, retries: int = 0) -> None:
+  """One broker call as the caller saw it: final status (None = network error), total seconds, body bytes."""
+  if not config.METRICS_ENABLED:
+    return
+  minute = dt.datetime.now().replace(second=0, microsecond=0)
+  with _LOCK:
+    window = _WINDOWS.get((minute, env, endpoint))
+    if window is None:
+      window = _WINDOWS[(minute, env, endpoint)] = EndpointWindow()
+    window.add(status, latency, nbytes, retries)
+
+def flush() -> int:
+  """
+    Writes the in-memory windows to broker_metrics and prunes rows past retention.
+    Returns the number of rows written. Every run's process ends with the run, so call it
+    at the end of each one, from a thread that may use the DB.
+    """
+  global _WINDOWS
+  with _LOCK:
+    if not _WINDOWS:
+      return 0
+    windows, _WINDOWS = _WINDOWS, {}
+
+  rows = [dict(minute=minute, account=env, endpoint=endpoint, **window.to_row())
+          for (minute, env, endpoint), window in windows.items()]
+  try:
+    server_db.save_broker_metrics(rows)
+    server_db.prune_broker_metrics(dt.datetime.now() - dt.timedelta(days=config.METRICS_RETENTION_DAYS))
+  except Exception as e:
+    # Put them back for the next flush rather than losing the minute
+    with _LOCK:
+      for key, window in windows.items():
+        _WINDOWS.setdefault(key, EndpointWindow()).merge(window.to_row())
+    logger.log(f"Broker metrics flush failed: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+    return 0
+  return len(rows)
+
+def latency_report(minutes: int = 60, env: str = None) -> List[Dict]:
+  """
+    Per-endpoint calls, errors, retries, bytes and p50/p95/p99/max latency over the last
+    `minutes` (stored rows plus this process's unflushed windows), slowest total time first.
+    share = endpoint's share of all broker time in the period.
+    """
+  since = dt.datetime.now().replace(second=0, microsecond=0) - dt.timedelta(minutes=minutes - 1)
+  merged: Dict[Tuple[str, str], EndpointWindow] = {}
+  for row in server_db.get_broker_metrics(since, env):
+    merged.setdefault((row['account'], row['endpoint']), EndpointWindow()).merge(row)
+  with _LOCK:
+    pending = [(key, window.to_row()) for key, window in _WINDOWS.items()]
+  for (minute, window_env, endpoint), row in pending:
+    if minute >= since and (env is None or window_env == env):
+      merged.setdefault((window_env, endpoint), EndpointWindow()).merge(row)
+
+  total_time = sum(w.latency_sum for w in merged.values()) or 1.0
+  report = []
+  for (window_env, endpoint), w in merged.items():
+    report.append({
+      'env': window_env,
+      'endpoint': endpoint,
+      'calls': w.calls,
+      'errors': w.errors,
+      'retries': w.retries,
+      'avg_bytes': round(w.bytes / w.calls) if w.calls else 0,
+      'mean': round(w.latency_sum / w.calls, 4) if w.calls else 0.0,
+      # Bucket bounds can overshoot the slowest call seen; never report past it
+      'p50': round(min(w.hist.percentile(0.50), w.latency_max), 4),
+      'p95': round(min(w.hist.percentile(0.95), w.latency_max), 4),
+      'p99': round(min(w.hist.percentile(0.99), w.latency_max), 4),
+      'max': round(w.latency_max, 4),
+      'total_seconds': round(w.latency_sum, 3),
+      'share': round(w.latency_sum / total_time, 3),
+      'statuses': w.statuses
+    })
+  report.sort(key=lambda r: r['total_seconds'], reverse=True)
+  return report
+
+def reset() -> None:
+  """Drops unflushed windows (diagnostics)."""
+  with _LOCK:
+    _WINDOWS.clear()
@@ -0,0 +1,207 @@
+import datetime as dt
+import numpy as np
+import pytz
+from typing import Dict, List, Optional
+
+from shared import config
+from . import server_calendar
+from .server_chain import OptionChainFrame
+
+# Black-Scholes prices, implied volatility and greeks for whole chains at once.
+# Everything works on NumPy arrays (scalars broadcast), so a chain is one pass per Newton step.
+# Conventions follow Tradier's greeks: theta per calendar day, vega per 1 vol point.
+# Time to expiry runs to the minute, up to the expiration day's close (early closes included),
+# so 0DTE deltas stay meaningful through the afternoon.
+
+_MINUTES_PER_YEAR = 365.0 * 24 * 60
+_SQRT2 = np.sqrt(2.0)
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+
+# --- DISTRIBUTION ---
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+  """Complementary error function (Chebyshev fit, fractional error < 1.2e-7 everywhere, tails included)."""
+  z = np.abs(x)
+  t = 1.0 / (1.0 + 0.5 * z)
+  poly = -z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+    0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+  ans = t * np.exp(poly)
+  return np.where(x >= 0, ans, 2.0 - ans)
+
+def norm_cdf(x) -> np.ndarray:
+  return 0.5 * _erfc(-np.asarray(x, dtype=np.float64) / _SQRT2)
+
+def norm_pdf(x) -> np.ndarray:
+  x = np.asarray(x, dtype=np.float64)
+  return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+# --- TIME ---
+
+def year_fraction(expiration, now: dt.datetime = None) -> np.ndarray:
+  """
+    Years from now (naive ET wall clock, default: current ET time) until each expiration's
+    session close, counted in minutes; floored at one minute so expiring options still price.
+    expiration: date, 'YYYY-MM-DD', or an array/list of either.
+    """
+  if now is None:
+    now = dt.datetime.now(pytz.timezone('US/Eastern')).replace(tzinfo=None)
+  days = np.atleast_1d(np.asarray(expiration, dtype=object))
+  minutes = np.empty(days.size, dtype=np.float64)
+  closes: Dict = {}
+  for i, day in enumerate(days):
+    if day not in closes:
+      exp_date = dt.date.fromisoformat(day) if isinstance(day, str) else day
+      expiry = dt.datetime.combine(exp_date, server_calendar.close_time(exp_date) or config.MARKET_CLOSE_TIME)
+      closes[day] = (expiry - now).total_seconds() / 60.0
+    minutes[i] = closes[day]
+  return np.maximum(minutes, 1.0) / _MINUTES_PER_YEAR
+
+# --- PRICING ---
+
+def _d1_d2(spot, strike, t, sigma, rate):
+  vol_t = sigma * np.sqrt(t)
+  d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * t) / vol_t
+  return d1, d1 - vol_t
+
+def bs_price(spot, strike, t, sigma, is_call, rate: float = None) -> np.ndarray:
+  """European Black-Scholes value per share. is_call: bool or bool array."""
+  rate = config.PRICING_RISK_FREE_RATE if rate is None else rate
+  d1, d2 = _d1_d2(spot, strike, t, sigma, rate)
+  discount = np.exp(-rate * t)
+  call = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+  put = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+  return np.where(is_call, call, put)
+
+def greeks(spot, strike, t, sigma, is_call, rate: float = None) -> Dict[str, np.ndarray]:
+  """delta, gamma, theta (per day) and vega (per vol point); NaN wherever sigma is NaN."""
+  rate = config.PRICING_RISK_FREE_RATE if rate is None else rate
+  d1, d2 = _d1_d2(spot, strike, t, sigma, rate)
+  pdf = norm_pdf(d1)
+  discount = np.exp(-rate * t)
+  sqrt_t = np.sqrt(t)
+  decay = -spot * pdf * sigma / (2.0 * sqrt_t)
+  call_theta = decay - rate * strike * discount * norm_cdf(d2)
+  put_theta = decay + rate * strike * discount * norm_cdf(-d2)
+  return {
+    'delta': np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0),
+    'gamma': pdf / (spot * sigma * sqrt_t),
+    'theta': np.where(is_call, call_theta, put_theta) / 365.0,
+    'vega': spot * pdf * sqrt_t / 100.0
+  }
+
+def implied_vol(price, spot, strike, t, is_call, rate: float = None) -> np.ndarray:
+  """
+    Volatility that reproduces each price: Newton steps kept inside a shrinking bisection
+    bracket [PRICING_IV_MIN, PRICING_IV_MAX], all options iterated together.
+    NaN for prices outside the no-arbitrage bounds or not bracketed.
+    """
+  rate = config.PRICING_RISK_FREE_RATE if rate is None else rate
+  price, spot, strike, t, is_call = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in
+                                                          (price, spot, strike, t, is_call)))
+  is_call = is_call.astype(bool)
+  lo = np.full(price.shape, config.PRICING_IV_MIN)
+  hi = np.full(price.shape, config.PRICING_IV_MAX)
+  discount = np.exp(-rate * t)
+  intrinsic = np.where(is_call, np.maximum(spot - strike * discount, 0.0), np.maximum(strike * discount - spot, 0.0))
+  upper = np.where(is_call, spot, strike * discount)
+  ok = (price > intrinsic) & (price < upper) & (t > 0)
+  ok &= (bs_price(spot, strike, t, lo, is_call, rate) <= price) & (bs_price(spot, strike, t, hi, is_call, rate) >= price)
+
+  sigma = np.where(ok, 0.5 * (lo + hi), np.nan)
+  active = ok.copy()
+  for _ in range(config.PRICING_IV_MAX_ITER):
+    if not active.any():
+      break
+    s = sigma[active]
+    args = (spot[active], strike[active], t[active])
+    diff = bs_price(*args, s, is_call[active], rate) - price[active]
+    # Price rises with vol: a positive diff means the root is below s
+    lo[active] = np.where(diff < 0, s, lo[active])
+    hi[active] = np.where(diff > 0, s, hi[active])
+    vega = greeks(*args, s, is_call[active], rate)['vega'] * 100.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+      step = s - diff / vega
+    inside = np.isfinite(step) & (step > lo[active]) & (step < hi[active])
+    sigma[active] = np.where(inside, step, 0.5 * (lo[active] + hi[active]))
+    done = np.abs(diff) < config.PRICING_IV_TOLERANCE
+    active[np.flatnonzero(active)[done]] = False
+  return sigma
+
+# --- CHAINS ---
+
+def chain_greeks(chain, spot: float, now: dt.datetime = None, rate: float = None) -> Dict[str, np.ndarray]:
+  """
+    iv, delta, gamma, theta, vega per row of a chain (list or OptionChainFrame), from the
+    bid/ask mid (last without an ask). Deep ITM rows whose price does not invert take the IV of
+    the same strike's other side, else intrinsic-only greeks (delta +/-1, the rest 0).
+    Rows without a usable price or expiration get NaN.
+    """
+  frame = chain if isinstance(chain, OptionChainFrame) else OptionChainFrame.from_options(chain)
+  n = len(frame)
+  result = {name: np.full(n, np.nan) for name in ('iv', 'delta', 'gamma', 'theta', 'vega')}
+  expirations = [opt.get('expiration_date') for opt in frame.records]
+  priced = np.array([bool(e) for e in expirations], dtype=bool) if n else np.zeros(0, dtype=bool)
+  # A zero bid still leaves a real offer: far OTM options price at half the ask
+  mid = np.where(frame.ask > 0, (frame.bid + frame.ask) / 2.0, frame.last)
+  priced &= (mid > 0) & (frame.strike > 0)
+  if not spot or not priced.any():
+    return result
+
+  rows = np.flatnonzero(priced)
+  t = year_fraction([expirations[i] for i in rows], now)
+  is_call = frame.option_type[rows] == config.TRADIER_OPTION_TYPE_CALL
+  strikes = frame.strike[rows]
+  iv = implied_vol(mid[rows], spot, strikes, t, is_call, rate)
+  iv = _borrow_counterpart_iv(frame, rows, expirations, iv)
+  result['iv'][rows] = iv
+
+  values = greeks(spot, strikes, t, iv, is_call, rate)
+  intrinsic_only = np.isnan(iv) & np.where(is_call, strikes < spot, strikes > spot)
+  values['delta'][intrinsic_only] = np.where(is_call[intrinsic_only], 1.0, -1.0)
+  for name in ('gamma', 'theta', 'vega'):
+    values[name][intrinsic_only] = 0.0
+  for name, column in values.items():
+    result[name][rows] = column
+  return result
+
+def _borrow_counterpart_iv(frame: OptionChainFrame, rows: np.ndarray, expirations: List, iv: np.ndarray) -> np.ndarray:
+  """NaN IVs replaced by the solved IV of the other option type at the same root/expiration/strike."""
+  unsolved = np.isnan(iv)
+  if not unsolved.any():
+    return iv
+  keys = [(frame.root[r], expirations[r], float(frame.strike[r]), frame.option_type[r]) for r in rows]
+  solved = {key: iv[i] for i, key in enumerate(keys) if not unsolved[i]}
+  other = {config.TRADIER_OPTION_TYPE_CALL: config.TRADIER_OPTION_TYPE_PUT,
+           config.TRADIER_OPTION_TYPE_PUT: config.TRADIER_OPTION_TYPE_CALL}
+  iv = iv.copy()
+  for i in np.flatnonzero(unsolved):
+    root, expiration, strike, option_type = keys[i]
+    iv[i] = solved.get((root, expiration, strike, other.get(option_type)), np.nan)
+  return iv
+
+def fill_missing_greeks(options: List[Dict], spot: Optional[float], now: dt.datetime = None) -> int:
+  """
+    Computes greeks in place for the option dicts that have no broker delta (greeks=false
+    requests, or Tradier leaving them out): sets 'delta' and a 'greeks' dict shaped like the
+    broker's (mid_iv, delta, gamma, theta, vega). Returns how many options were filled.
+    """
+  missing = [opt for opt in options if opt.get('delta') is None]
+  if not missing or not spot:
+    return 0
+  computed = chain_greeks(missing, spot, now)
+  filled = 0
+  for i, opt in enumerate(missing):
+    if np.isnan(computed['delta'][i]):
+      continue
+    iv = computed['iv'][i]
+    opt['delta'] = round(float(computed['delta'][i]), 4)
+    opt['greeks'] = {
+      'delta': opt['delta'],
+      'gamma': round(float(computed['gamma'][i]), 6),
+      'theta': round(float(computed['theta'][i]), 4),
+      'vega': round(float(computed['vega'][i]), 4),
+      'mid_iv': None if np.isnan(iv) else round(float(iv), 4),
+      'source': 'local'
+    }
+    filled += 1
+  return filled
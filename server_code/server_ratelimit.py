@@ -0,0 +1,159 @@
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Mapping
+
+from shared import config
+
+# Caller priority for broker requests. Orders/fills > bot reads > dashboard reads.
+# Buckets live in process memory and Anvil gives every run its own process, so this only
+# paces calls within one process. Other runs' usage (and the account-wide limit) is seen
+# only through each response's X-Ratelimit-* headers; reserves then apply to that figure.
+_PRIORITY = contextvars.ContextVar('broker_request_priority', default=config.PRIORITY_BOT)
+
+@contextmanager
+def request_priority(priority: int):
+  """Runs the enclosed broker calls at `priority` (config.PRIORITY_*)."""
+  token = _PRIORITY.set(priority)
+  try:
+    yield
+  finally:
+    _PRIORITY.reset(token)
+
+def with_priority(priority: int):
+  """Decorator form of request_priority, e.g. for UI callables."""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with request_priority(priority):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def current_priority() -> int:
+  return _PRIORITY.get()
+
+# --- BUCKETS ---
+
+class RateBucket:
+  """
+    One Tradier rate-limit bucket (fixed window: `capacity` calls until `expiry`).
+    Starts from config defaults and is re-synced from X-Ratelimit-* headers.
+    Each priority keeps a reserve it may not dip into, so within this process
+    lower-priority traffic runs dry first; across processes the reserve only holds
+    once a response has reported the account's remaining calls.
+    """
+  def __init__(self, name: str, capacity: int, window_seconds: float):
+    self.name = name
+    self.capacity = capacity
+    self.window_seconds = window_seconds
+    self.available = capacity
+    self.expiry = time.monotonic() + window_seconds
+    self._lock = threading.Lock()
+    self._stats = {'acquired': 0, 'waits': 0, 'wait_seconds': 0.0, 'overruns': 0, 'throttled': 0}
+
+  def acquire(self, priority: int) -> float:
+    """Takes one call slot, waiting (up to the priority's max wait) if the reserve is hit. Returns seconds waited."""
+    start = time.monotonic()
+    deadline = start + config.RATE_LIMIT_MAX_WAIT_SECONDS.get(priority, 0.0)
+    reserve = config.RATE_LIMIT_RESERVE.get(priority, 0.0)
+    slept = False
+
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._refill(now)
+        floor = math.ceil(self.capacity * reserve)
+        if self.available > floor or now >= deadline:
+          if self.available <= floor:
+            self._stats['overruns'] += 1  # waited long enough; let the broker decide
+          self.available = max(self.available - 1, 0)
+          self._stats['acquired'] += 1
+          if not slept:
+            return 0.0
+          waited = now - start
+          self._stats['waits'] += 1
+          self._stats['wait_seconds'] += waited
+          return waited
+        sleep_for = min(self.expiry - now, deadline - now, 0.1)
+      slept = True
+      time.sleep(max(sleep_for, 0.005))
+
+  def observe(self, headers: Mapping[str, str], status_code: int = 200) -> None:
+    """Re-syncs from the broker's view of this bucket."""
+    try:
+      allowed = _int_header(headers, 'X-Ratelimit-Allowed')
+      available = _int_header(headers, 'X-Ratelimit-Available')
+      expiry = _int_header(headers, 'X-Ratelimit-Expiry')
+    except AttributeError:
+      return
+
+    with self._lock:
+      if allowed:
+        self.capacity = allowed
+      if expiry:
+        # Epoch milliseconds -> local monotonic clock
+        self.expiry = time.monotonic() + max(expiry / 1000.0 - time.time(), 0.0)
+      if available is not None:
+        self.available = available
+      if status_code == 429:
+        self._stats['throttled'] += 1
+        self.available = 0
+
+  def stats(self) -> Dict:
+    with self._lock:
+      data = dict(self._stats)
+      data.update({
+        'name': self.name,
+        'capacity': self.capacity,
+        'available': self.available,
+        'resets_in': round(max(self.expiry - time.monotonic(), 0.0), 1)
+      })
+    return data
+
+  def _refill(self, now: float) -> None:
+    if now >= self.expiry:
+      self.available = self.capacity
+      self.expiry = now + self.window_seconds
+
+# --- SCHEDULER ---
+
+class RequestScheduler:
+  """Routes each broker request to its endpoint-class bucket (market_data / trading / account)."""
+  def __init__(self):
+    self.buckets = {
+      name: RateBucket(name, capacity, config.RATE_LIMIT_WINDOW_SECONDS)
+      for name, capacity in config.RATE_LIMITS.items()
+    }
+
+  def acquire(self, method: str, path: str) -> float:
+    if not config.RATE_LIMIT_ENABLED:
+      return 0.0
+    cls = endpoint_class(method, path)
+    # Order placement/cancel always runs at order priority, whoever calls it
+    priority = config.PRIORITY_ORDER if cls == 'trading' else current_priority()
+    return self.buckets[cls].acquire(priority)
+
+  def observe(self, method: str, path: str, headers: Mapping[str, str], status_code: int = 200) -> None:
+    self.buckets[endpoint_class(method, path)].observe(headers, status_code)
+
+  def stats(self) -> Dict[str, Dict]:
+    return {name: bucket.stats() for name, bucket in self.buckets.items()}
+
+def endpoint_class(method: str, path: str) -> str:
+  """Tradier's rate-limit groups: market data, trading (order writes), everything else under the account."""
+  if path.startswith('/markets'):
+    return 'market_data'
+  if method != 'GET' and '/orders' in path:
+    return 'trading'
+  return 'account'
+
+def _int_header(headers: Mapping[str, str], name: str):
+  try:
+    val = headers.get(name)
+    return int(val) if val not in (None, '') else None
+  except ValueError:
+    return None
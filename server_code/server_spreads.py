@@ -0,0 +1,129 @@
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from shared import config
+from . import server_chain
+from . import server_volsurface
+
+# Vertical-spread grid: every (near, far) pair of one option type for a set of widths,
+# priced and masked in one vectorized pass over an OptionChainFrame.
+# The near leg is the one closer to the money, the far leg sits `width` further OTM
+# (calls: strike + width, puts: strike - width). A debit spread buys near / sells far;
+# a credit spread sells near / buys far.
+
+class SpreadGrid:
+  """
+    Struct-of-arrays over all pairs, one entry per (near row, width) that found a far leg.
+    Prices are per share: natural (cross the spread), mid, both positive for the
+    side being traded (debit paid or credit received).
+    """
+  def __init__(self, frame: server_chain.OptionChainFrame, option_type: str, spot: Optional[float],
+               near: np.ndarray, far: np.ndarray, width: np.ndarray, is_debit: bool,
+               surface: 'server_volsurface.VolSurface' = None):
+    self.frame = frame
+    self.option_type = option_type
+    self.spot = spot
+    self.is_debit = is_debit
+    self.near = near
+    self.far = far
+    self.width = width
+    self.near_strike = frame.strike[near]
+    self.far_strike = frame.strike[far]
+
+    bid_or_last, ask_or_last = frame.bid_or_last(), frame.ask_or_last()
+    near_mid = (frame.bid[near] + frame.ask[near]) / 2.0
+    far_mid = (frame.bid[far] + frame.ask[far]) / 2.0
+    self.natural = (ask_or_last[near] - bid_or_last[far]) if is_debit else (bid_or_last[near] - ask_or_last[far])
+    self.mid = near_mid - far_mid
+    # A pair is only as fresh as its older leg (NaN when neither leg carried a quote time)
+    self.quote_time = np.fmin(frame.quote_time[near], frame.quote_time[far])
+    # Model value of the pair from the IV surface (NaN without a surface or spot)
+    self.fair = np.full(near.size, np.nan)
+    if surface is not None and spot:
+      leg_fair = server_volsurface.frame_fair_values(frame, spot, surface)
+      self.fair = leg_fair[near] - leg_fair[far]
+
+    # Masks
+    self.quoted = (frame.bid[near] != 0) & (frame.ask[near] != 0) & (frame.bid[far] != 0) & (frame.ask[far] != 0)
+    self.near_spread = frame.ask[near] - frame.bid[near]
+    self.far_spread = frame.ask[far] - frame.bid[far]
+    # Without a reference price every pair counts as OTM and distances are unknown (NaN)
+    is_call = option_type == config.TRADIER_OPTION_TYPE_CALL
+    if spot is None:
+      self.otm = np.ones(near.size, dtype=bool)
+      self.distance = np.full(near.size, np.nan)
+    else:
+      self.otm = (self.near_strike > spot) if is_call else (self.near_strike < spot)
+      self.distance = np.abs(self.near_strike - spot)
+
+  def __len__(self) -> int:
+    return int(self.near.size)
+
+  def liquid(self, max_bid_ask: float) -> np.ndarray:
+    """Both legs quoted and no wider than max_bid_ask."""
+    return self.quoted & (self.near_spread <= max_bid_ask) & (self.far_spread <= max_bid_ask)
+
+  def candidate(self, i: int, price: np.ndarray = None, score: np.ndarray = None) -> Dict:
+    """Pair i as a dict (legs are the chain's option dicts)."""
+    price = self.natural if price is None else price
+    return {
+      'near_leg': self.frame.leg(self.near[i]),
+      'far_leg': self.frame.leg(self.far[i]),
+      'near_strike': float(self.near_strike[i]),
+      'far_strike': float(self.far_strike[i]),
+      'width': float(self.width[i]),
+      'price': float(price[i]),
+      'natural': float(self.natural[i]),
+      'mid': float(self.mid[i]),
+      'distance': float(self.distance[i]),
+      'quote_time': float(self.quote_time[i]) if not np.isnan(self.quote_time[i]) else None,
+      'fair': float(self.fair[i]) if not np.isnan(self.fair[i]) else None,
+      'score': float(score[i]) if score is not None else None
+    }
+
+# Objectives: grid (+ the price array being ranked) -> score per pair, lower ranks first
+Objective = Callable[[SpreadGrid, np.ndarray], np.ndarray]
+OBJECTIVES: Dict[str, Objective] = {
+  'closest': lambda g, price: g.distance,              # nearest the money (scalpel)
+  'furthest': lambda g, price: -g.distance,            # furthest OTM that qualifies (income spreads)
+  'cheapest': lambda g, price: price,
+  'richest': lambda g, price: -price,
+  'lowest_strike': lambda g, price: g.near_strike,
+  'price_per_width': lambda g, price: -price / g.width,  # most price per point of width
+  # Best price against the surface's fair value (pairs without one rank last)
+  'edge': lambda g, price: (price - g.fair) if g.is_debit else (g.fair - price),
+}
+
+def build_spread_grid(chain, option_type: str, widths: Union[float, Sequence[float]], spot: Optional[float],
+                      is_debit: bool = True, tol: float = 0.01,
+                      surface: 'server_volsurface.VolSurface' = None) -> SpreadGrid:
+  """
+    Pairs every strike of `option_type` with the strike `width` further OTM, for all widths
+    at once (one index match over near rows x widths). Pairs stay within one root.
+    surface: IV surface (server_volsurface) for the pairs' fair values and the 'edge' objective.
+    """
+  frame = server_chain.as_frame(chain)
+  widths = np.atleast_1d(np.asarray(widths, dtype=np.float64))
+  base = frame.index.by_strike(option_type)
+  near = np.tile(base, widths.size)
+  width = np.repeat(widths, base.size)
+  direction = 1.0 if option_type == config.TRADIER_OPTION_TYPE_CALL else -1.0
+  far = frame.index.match(near, frame.strike[near] + direction * width, tol)
+  paired = far >= 0
+  return SpreadGrid(frame, option_type, spot, near[paired], far[paired], width[paired], is_debit, surface)
+
+def top_spreads(grid: SpreadGrid, mask: np.ndarray, objective: Union[str, Objective] = 'closest',
+                k: int = None, price: np.ndarray = None) -> List[Dict]:
+  """
+    The k best pairs under `mask`, ranked by objective (name in OBJECTIVES or callable).
+    Ties keep grid order (width, then strike). price: what is ranked and reported (default natural).
+    """
+  k = k or config.SPREAD_GRID_TOP_K
+  price = grid.natural if price is None else price
+  rows = np.flatnonzero(mask)
+  if rows.size == 0:
+    return []
+  score_fn = OBJECTIVES[objective] if isinstance(objective, str) else objective
+  score = np.asarray(score_fn(grid, price), dtype=np.float64)
+  ranked = rows[np.argsort(score[rows], kind='stable')[:k]]
+  return [grid.candidate(i, price, score) for i in ranked]
@@ -0,0 +1,415 @@
+import json
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import websocket
+
+from shared import config
+from . import server_env
+from . import server_logging as logger
+from . import server_transport
+
+# OCC option symbols: ROOT + YYMMDD + C/P + strike*1000 (8 digits)
+_OCC_PATTERN = re.compile(r'^([A-Z]+)\d{6}[CP]\d{8}$')
+
+# --- QUOTE BOOK ---
+
+class QuoteBook:
+  """
+    Thread-safe in-memory book of the latest streamed quote per symbol.
+    Entries use the REST /markets/quotes field names (bid, ask, last, open, prevclose)
+    so snapshot code can read either source the same way.
+    """
+  def __init__(self):
+    self._quotes: Dict[str, Dict] = {}
+    self._updated: Dict[str, float] = {}
+    self._by_underlying: Dict[str, set] = {}
+    self._lock = threading.Lock()
+
+  def apply(self, event: Dict) -> None:
+    """Folds one streaming event (quote / trade / summary) into the book."""
+    symbol = event.get('symbol')
+    kind = event.get('type')
+    if not symbol or kind not in ('quote', 'trade', 'summary'):
+      return
+
+    if kind == 'quote':
+      fields = {'bid': _num(event.get('bid')), 'ask': _num(event.get('ask'))}
+    elif kind == 'trade':
+      fields = {'last': _num(event.get('last') or event.get('price'))}
+    else:
+      fields = {
+        'open': _num(event.get('open')),
+        'high': _num(event.get('high')),
+        'low': _num(event.get('low')),
+        'prevclose': _num(event.get('prevClose'))
+      }
+
+    with self._lock:
+      quote = self._quotes.get(symbol)
+      if quote is None:
+        quote = {'symbol': symbol}
+        self._quotes[symbol] = quote
+        self._by_underlying.setdefault(underlying_of(symbol), set()).add(symbol)
+      quote.update({k: v for k, v in fields.items() if v is not None})
+      self._updated[symbol] = time.monotonic()
+
+  def get(self, symbol: str, max_age: float = None, fields: Iterable[str] = ()) -> Optional[Dict]:
+    """Copy of the latest quote, or None if unknown, older than max_age seconds, or missing any of `fields`."""
+    with self._lock:
+      quote = self._quotes.get(symbol)
+      if quote is None:
+        return None
+      age = time.monotonic() - self._updated[symbol]
+      if max_age is not None and age > max_age:
+        return None
+      if any(f not in quote for f in fields):
+        return None
+      return dict(quote, age=age)
+
+  def get_many(self, symbols: Iterable[str], max_age: float = None, fields: Iterable[str] = ()) -> Optional[Dict[str, Dict]]:
+    """All-or-nothing read: returns None if any symbol is missing, stale or incomplete."""
+    result = {}
+    for symbol in symbols:
+      quote = self.get(symbol, max_age, fields)
+      if quote is None:
+        return None
+      result[symbol] = quote
+    return result
+
+  def for_underlying(self, underlying: str, max_age: float = None) -> Dict[str, Dict]:
+    """Every fresh quote whose symbol is the underlying itself or one of its options."""
+    with self._lock:
+      symbols = list(self._by_underlying.get(underlying, ()))
+    quotes = {s: self.get(s, max_age) for s in symbols}
+    return {s: q for s, q in quotes.items() if q is not None}
+
+  def clear(self) -> None:
+    with self._lock:
+      self._quotes.clear()
+      self._updated.clear()
+      self._by_underlying.clear()
+
+def underlying_of(symbol: str) -> str:
+  """'SPXW260119C05000000' -> 'SPX'; equities/indices map to themselves."""
+  match = _OCC_PATTERN.match(symbol or '')
+  if not match:
+    return symbol
+  root = match.group(1)
+  return config.OPTION_ROOT_UNDERLYING.get(root, root)
+
+# --- ORDER REGISTRY ---
+
+ORDER_TERMINAL_STATUSES = ('filled', 'canceled', 'rejected', 'expired')
+
+class OrderRegistry:
+  """
+    Thread-safe latest-known state per order id, fed by account order events
+    (or seeded from a REST order lookup). Waiters block on a condition instead of polling.
+    Entries keep Tradier's order field names (status, avg_fill_price, reason_description).
+    """
+  def __init__(self):
+    self._orders: Dict[str, Dict] = {}
+    self._cond = threading.Condition()
+
+  def apply(self, order: Dict) -> None:
+    """Merges an order event / REST order dict. Terminal states are never downgraded."""
+    order_id = order.get('id')
+    if order_id is None:
+      return
+    order_id = str(order_id)
+    with self._cond:
+      state = self._orders.setdefault(order_id, {'id': order_id})
+      if state.get('status') in ORDER_TERMINAL_STATUSES and order.get('status') not in ORDER_TERMINAL_STATUSES:
+        return
+      state.update({k: v for k, v in order.items() if v is not None and k != 'id'})
+      state['updated'] = time.monotonic()
+      self._cond.notify_all()
+
+  def track(self, order_id: str, status: str = 'pending') -> None:
+    """Registers a just-submitted order, unless an event for it already arrived."""
+    with self._cond:
+      if str(order_id) not in self._orders:
+        self._orders[str(order_id)] = {'id': str(order_id), 'status': status, 'updated': time.monotonic()}
+
+  def get(self, order_id: str) -> Optional[Dict]:
+    with self._cond:
+      state = self._orders.get(str(order_id))
+      return dict(state) if state else None
+
+  def wait(self, order_id: str, timeout: float) -> Optional[Dict]:
+    """Blocks until the order reaches a terminal status or timeout. Returns the latest state."""
+    order_id = str(order_id)
+    deadline = time.monotonic() + timeout
+    with self._cond:
+      while True:
+        state = self._orders.get(order_id)
+        if state and state.get('status') in ORDER_TERMINAL_STATUSES:
+          return dict(state)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return dict(state) if state else None
+        self._cond.wait(remaining)
+
+  def forget(self, predicate: Callable[[Dict], bool]) -> int:
+    with self._cond:
+      doomed = [k for k, v in self._orders.items() if predicate(v)]
+      for k in doomed:
+        del self._orders[k]
+    return len(doomed)
+
+# --- STREAM CLIENTS ---
+
+class _EventStream:
+  """
+    Background websocket reader with reconnect + jittered backoff.
+    Subclasses provide the subscription payload and handle decoded events.
+    """
+  session_path = ''
+  ws_path = ''
+
+  def __init__(self, env: str, ws_url: str = None, session_provider: Callable[[], str] = None):
+    self.env = env
+    self.ws_url = ws_url or f"{config.STREAM_WS_URLS[env]}{self.ws_path}"
+    self._session_provider = session_provider or self._create_session
+    self._ws = None
+    self._session_id = None
+    self._stop = threading.Event()
+    self._connected = threading.Event()
+    self._send_lock = threading.Lock()
+    self._thread = None
+    self.events_received = 0
+    self.connected_since = None
+
+  @property
+  def is_connected(self) -> bool:
+    return self._connected.is_set()
+
+  def start(self) -> None:
+    if self._thread and self._thread.is_alive():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name=f'{type(self).__name__}-{self.env}', daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._stop.set()
+    ws = self._ws
+    if ws is not None:
+      try:
+        ws.close()
+      except Exception:
+        pass
+
+  def wait_connected(self, timeout: float) -> bool:
+    return self._connected.wait(timeout)
+
+  # --- SUBCLASS HOOKS ---
+  def _subscription(self) -> Optional[Dict]:
+    raise NotImplementedError
+
+  def _on_event(self, event: Dict) -> None:
+    raise NotImplementedError
+
+  # --- INTERNALS ---
+  def _create_session(self) -> str:
+    """POST {session_path} -> stream session id (valid ~5 minutes, so one per connect)."""
+    t = server_transport.get_transport(self.env)
+    resp = t.post(self.session_path)
+    resp.raise_for_status()
+    return resp.json()['stream']['sessionid']
+
+  def _send_subscription(self) -> None:
+    payload = self._subscription()
+    ws = self._ws
+    if payload is None or ws is None or not self.is_connected:
+      return
+    payload['sessionid'] = self._session_id
+    with self._send_lock:
+      ws.send(json.dumps(payload))
+
+  def _run(self) -> None:
+    attempt = 0
+    while not self._stop.is_set():
+      try:
+        self._session_id = self._session_provider()
+        self._ws = websocket.create_connection(self.ws_url, timeout=config.STREAM_CONNECT_TIMEOUT_SECONDS)
+        self._ws.settimeout(None)
+        self._connected.set()
+        attempt = 0
+        self._send_subscription()
+        self.connected_since = time.monotonic()
+
+        while not self._stop.is_set():
+          message = self._ws.recv()
+          if not message:
+            break
+          # linebreak=true: one JSON object per line, possibly several per frame
+          for line in message.splitlines():
+            if line.strip():
+              self.events_received += 1
+              self._on_event(json.loads(line))
+
+      except Exception as e:
+        if not self._stop.is_set():
+          # DEBUG only: this runs off the request thread
+          logger.log(f"{type(self).__name__} ({self.env}) dropped: {e}", level=config.LOG_DEBUG, source=config.LOG_SOURCE_API)
+      finally:
+        self._connected.clear()
+        self.connected_since = None
+        if self._ws is not None:
+          try:
+            self._ws.close()
+          except Exception:
+            pass
+          self._ws = None
+
+      if not self._stop.is_set():
+        cap = min(config.STREAM_RECONNECT_MAX_SECONDS, 0.5 * (2 ** attempt))
+        attempt += 1
+        self._stop.wait(random.uniform(0, cap))
+
+class MarketStreamClient(_EventStream):
+  """Tradier market events stream (quote / trade / summary) feeding a QuoteBook."""
+  session_path = '/markets/events/session'
+  ws_path = '/markets/events'
+
+  def __init__(self, env: str, book: QuoteBook, ws_url: str = None, session_provider: Callable[[], str] = None):
+    super().__init__(env, ws_url, session_provider)
+    self.book = book
+    self._symbols = set()
+    self._symbols_lock = threading.Lock()
+
+  def subscribe(self, symbols: Iterable[str]) -> None:
+    """Adds symbols; re-sends the full subscription if anything changed (Tradier replaces the list)."""
+    with self._symbols_lock:
+      new = set(s for s in symbols if s) - self._symbols
+      if not new:
+        return
+      self._symbols |= new
+    self._send_subscription()
+
+  def _subscription(self) -> Optional[Dict]:
+    with self._symbols_lock:
+      symbols = sorted(self._symbols)
+    if not symbols:
+      return None
+    return {
+      'symbols': symbols,
+      'filter': list(config.STREAM_FILTERS),
+      'linebreak': True,
+      'validOnly': True
+    }
+
+  def _on_event(self, event: Dict) -> None:
+    self.book.apply(event)
+
+class AccountStreamClient(_EventStream):
+  """Tradier account events stream (order events) feeding an OrderRegistry."""
+  session_path = '/accounts/events/session'
+  ws_path = '/accounts/events'
+
+  def __init__(self, env: str, registry: OrderRegistry, ws_url: str = None, session_provider: Callable[[], str] = None):
+    super().__init__(env, ws_url, session_provider)
+    self.registry = registry
+
+  def is_current(self, state: Optional[Dict]) -> bool:
+    """
+      True if the registry entry can be trusted without a REST lookup:
+      terminal states always; live states only if recorded while this connection was up
+      (events sent during a disconnect are not replayed).
+      """
+    if not state:
+      return False
+    if state.get('status') in ORDER_TERMINAL_STATUSES:
+      return True
+    since = self.connected_since
+    return self.is_connected and since is not None and state.get('updated', 0) >= since
+
+  def _subscription(self) -> Optional[Dict]:
+    return {'events': ['order'], 'excludeAccounts': []}
+
+  def _on_event(self, event: Dict) -> None:
+    if event.get('event') == 'order':
+      self.registry.apply(event)
+
+# --- MODULE API ---
+
+# Keyed by environment like the streams that feed them: PROD and SANDBOX quote the same
+# symbols (with different delays) and number orders independently
+_BOOKS: Dict[str, QuoteBook] = {}
+_REGISTRIES: Dict[str, OrderRegistry] = {}
+_MARKET_STREAMS: Dict[str, MarketStreamClient] = {}
+_ACCOUNT_STREAMS: Dict[str, AccountStreamClient] = {}
+_LOCK = threading.Lock()
+
+def get_quote_book(env: str = None) -> QuoteBook:
+  env = env or server_env.current_env()
+  with _LOCK:
+    return _BOOKS.setdefault(env, QuoteBook())
+
+def get_order_registry(env: str = None) -> OrderRegistry:
+  env = env or server_env.current_env()
+  with _LOCK:
+    return _REGISTRIES.setdefault(env, OrderRegistry())
+
+def ensure_market_stream(symbols: List[str], env: str = None) -> Optional[MarketStreamClient]:
+  """
+    Starts (once per env) the market stream and adds symbols to it.
+    Returns None where streaming is disabled or unsupported (e.g. SANDBOX, or no persistent server).
+    """
+  env = env or server_env.current_env()
+  if not _streaming_available(env):
+    return None
+
+  book = get_quote_book(env)
+  with _LOCK:
+    client = _MARKET_STREAMS.get(env)
+    if client is None:
+      client = MarketStreamClient(env, book)
+      _MARKET_STREAMS[env] = client
+  client.subscribe(symbols)
+  client.start()
+  return client
+
+def ensure_account_stream(env: str = None) -> Optional[AccountStreamClient]:
+  """
+    Starts (once per env) the order event stream. None where streaming is disabled or
+    unsupported, or without a persistent server (a per-run registry starts empty, so every
+    fill check would fall through to REST after paying for the session).
+    """
+  env = env or server_env.current_env()
+  if not _streaming_available(env):
+    return None
+
+  registry = get_order_registry(env)
+  with _LOCK:
+    client = _ACCOUNT_STREAMS.get(env)
+    if client is None:
+      client = AccountStreamClient(env, registry)
+      _ACCOUNT_STREAMS[env] = client
+  client.start()
+  return client
+
+def stop_streams() -> None:
+  with _LOCK:
+    clients = list(_MARKET_STREAMS.values()) + list(_ACCOUNT_STREAMS.values())
+    _MARKET_STREAMS.clear()
+    _ACCOUNT_STREAMS.clear()
+  for client in clients:
+    client.stop()
+
+def _streaming_available(env: str) -> bool:
+  """Only a persistent server keeps a stream (and what it fed) from one run to the next."""
+  return config.STREAM_ENABLED and config.STREAM_PERSISTENT_SERVER and bool(config.STREAM_WS_URLS.get(env))
+
+def _num(val) -> Optional[float]:
+  try:
+    if val is None or val == '':
+      return None
+    return float(val)
+  except (ValueError, TypeError):
+    return None
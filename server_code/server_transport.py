@@ -0,0 +1,226 @@
+import anvil.secrets
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared import config
+from . import server_env
+from . import server_db
+from . import server_logging as logger
+from . import server_metrics
+from .server_ratelimit import RequestScheduler
+from .server_breaker import BreakerSet, BrokerUnavailable
+
+# One transport per environment (PROD / SANDBOX), built lazily
+_TRANSPORTS: Dict[str, 'BrokerTransport'] = {}
+_CREDENTIALS: Dict[str, Tuple[str, str, str]] = {}
+_LOCK = threading.Lock()
+
+class BrokerTransport:
+  """
+    Keep-alive HTTP transport for the Tradier REST API.
+    Owns the connection pool, auth headers, per-endpoint timeouts, GET retries,
+    the rate-limit scheduler (Tradier limits are per account token; this one paces
+    this process only, re-synced from response headers) and the
+    per-endpoint-class circuit breakers (open circuit -> BrokerUnavailable, no request).
+    Call sites pass paths relative to the endpoint (e.g. '/markets/quotes').
+    """
+  def __init__(self, env: str, api_key: str, account_id: str, endpoint: str):
+    self.env = env
+    self.account_id = account_id
+    self.endpoint = endpoint.rstrip('/')
+    self.scheduler = RequestScheduler()
+    self.breakers = BreakerSet()
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=config.API_POOL_CONNECTIONS, pool_maxsize=config.API_POOL_MAXSIZE)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+    self.session.headers.update({
+      'Authorization': f'Bearer {api_key}',
+      'Accept': 'application/json'
+    })
+
+  # --- PUBLIC VERBS ---
+  def get(self, path: str, params: Dict = None, **kwargs) -> requests.Response:
+    """Idempotent read. Retried with jittered backoff on network errors and retryable status codes."""
+    return self._request('GET', path, params=params, retry=True, **kwargs)
+
+  def post(self, path: str, data: Dict = None, **kwargs) -> requests.Response:
+    """Single attempt. Order submission must never be retried blindly."""
+    return self._request('POST', path, data=data, retry=False, **kwargs)
+
+  def put(self, path: str, data: Dict = None, **kwargs) -> requests.Response:
+    """Single attempt (order modification)."""
+    return self._request('PUT', path, data=data, retry=False, **kwargs)
+
+  def delete(self, path: str, **kwargs) -> requests.Response:
+    return self._request('DELETE', path, retry=False, **kwargs)
+
+  # --- INTERNALS ---
+  def url(self, path: str) -> str:
+    return f"{self.endpoint}{path}"
+
+  def _request(self, method: str, path: str, retry: bool = False, **kwargs) -> requests.Response:
+    """Sends with retries and records one metrics sample for the call as a whole (server_metrics)."""
+    start = time.perf_counter()
+    outcome = {'resp': None, 'attempts': 0}
+    try:
+      return self._send(method, path, retry, outcome, **kwargs)
+    finally:
+      if outcome['attempts']:
+        resp = outcome['resp']
+        server_metrics.record(
+          self.env,
+          server_metrics.endpoint_key(method, path, self.account_id),
+          resp.status_code if resp is not None else None,
+          time.perf_counter() - start,
+          len(resp.content) if resp is not None else 0,
+          outcome['attempts'] - 1
+        )
+
+  def _send(self, method: str, path: str, retry: bool, outcome: Dict, **kwargs) -> requests.Response:
+    kwargs.setdefault('timeout', _timeout_for(path))
+    attempts = config.API_MAX_RETRIES + 1 if retry else 1
+    url = self.url(path)
+
+    for attempt in range(attempts):
+      is_last = attempt == attempts - 1
+      if not self.breakers.allow(method, path):
+        raise BrokerUnavailable(f"{method} {path}: circuit open, broker call skipped")
+      waited = self.scheduler.acquire(method, path)
+      if waited > 0.5:
+        logger.log(f"{method} {path} held {waited:.2f}s by rate limiter",
+                   level=config.LOG_DEBUG,
+                   source=config.LOG_SOURCE_API)
+      outcome['resp'] = None
+      outcome['attempts'] += 1
+      try:
+        resp = self.session.request(method, url, **kwargs)
+        outcome['resp'] = resp
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        self.breakers.record(method, path, ok=False)
+        if is_last:
+          raise
+        logger.log(f"{method} {path} network error ({e}); retry {attempt + 1}/{attempts - 1}",
+                   level=config.LOG_DEBUG,
+                   source=config.LOG_SOURCE_API)
+        _backoff_sleep(attempt)
+        continue
+      except Exception:
+        # Any other failure (bad chunked body, cassette miss, ...) still settles the breaker,
+        # or a half-open probe slot would never be released
+        self.breakers.record(method, path, ok=False)
+        raise
+
+      self.scheduler.observe(method, path, resp.headers, resp.status_code)
+      # 429 is our own pacing, not broker health
+      self.breakers.record(method, path, ok=resp.status_code < 500)
+      if resp.status_code in config.API_RETRY_STATUS_CODES and not is_last:
+        logger.log(f"{method} {path} returned {resp.status_code}; retry {attempt + 1}/{attempts - 1}",
+                   level=config.LOG_DEBUG,
+                   source=config.LOG_SOURCE_API)
+        _backoff_sleep(attempt, resp.headers.get('Retry-After'))
+        continue
+      return resp
+
+    return resp
+
+def get_transport(env: str = None) -> BrokerTransport:
+  """Returns the pooled transport for an environment, building it (and caching secrets) on first use."""
+  env = env or server_env.current_env()
+  transport = _TRANSPORTS.get(env)
+  if transport is not None:
+    return transport
+
+  with _LOCK:
+    if env not in _TRANSPORTS:
+      api_key, account_id, endpoint_url = _get_credentials(env)
+      transport = BrokerTransport(env, api_key, account_id, endpoint_url)
+      persist_breakers(transport)
+      _TRANSPORTS[env] = transport
+    return _TRANSPORTS[env]
+
+def persist_breakers(transport: BrokerTransport, account: str = None) -> None:
+  """
+    Backs the transport's circuit breakers with the broker_breakers table (key: account,
+    default the transport's environment). Each server call and background task runs in its
+    own process, so a trip is only seen by the next run through this table.
+    """
+  account = account or transport.env
+
+  def _save(name: str, state: Dict) -> None:
+    try:
+      server_db.save_breaker_state(account, name, state)
+    except Exception as e:
+      # Never fail the broker call over it: this process still has the state
+      logger.log(f"Could not persist {name} breaker state: {e}", level=config.LOG_WARNING, source=config.LOG_SOURCE_API)
+
+  transport.breakers.share(server_db.get_breaker_states(account), _save)
+
+def reset_transport(env: str = None) -> None:
+  """Drops the cached transport and credentials (e.g. after rotating an API key)."""
+  env = env or server_env.current_env()
+  with _LOCK:
+    transport = _TRANSPORTS.pop(env, None)
+    _CREDENTIALS.pop(env, None)
+  if transport:
+    transport.session.close()
+
+@contextmanager
+def use_transport(transport: BrokerTransport):
+  """
+    Routes every broker call of transport.env through `transport` inside the block,
+    e.g. a BrokerTransport pointed at a server_fakes.FakeTradierServer for load tests.
+    """
+  with _LOCK:
+    previous = _TRANSPORTS.get(transport.env)
+    _TRANSPORTS[transport.env] = transport
+  try:
+    yield transport
+  finally:
+    with _LOCK:
+      if previous is not None:
+        _TRANSPORTS[transport.env] = previous
+      else:
+        _TRANSPORTS.pop(transport.env, None)
+    transport.session.close()
+
+# --- PRIVATE HELPERS ---
+
+def _get_credentials(env: str) -> Tuple[str, str, str]:
+  """Secrets are looked up once per process per environment."""
+  if env not in _CREDENTIALS:
+    api_key = anvil.secrets.get_secret(f'{env}_TRADIER_API_KEY')
+    account_id = anvil.secrets.get_secret(f'{env}_TRADIER_ACCOUNT')
+    endpoint_url = anvil.secrets.get_secret(f'{env}_ENDPOINT_URL')
+
+    if not api_key or not account_id or not endpoint_url:
+      raise ValueError(f"Missing API Credentials for {env}")
+    _CREDENTIALS[env] = (api_key, account_id, endpoint_url.rstrip('/'))
+  return _CREDENTIALS[env]
+
+def _timeout_for(path: str) -> Tuple[float, float]:
+  """Longest matching path prefix in config.API_TIMEOUTS wins."""
+  best_key = None
+  for prefix in config.API_TIMEOUTS:
+    if prefix != 'default' and path.startswith(prefix):
+      if best_key is None or len(prefix) > len(best_key):
+        best_key = prefix
+  return config.API_TIMEOUTS[best_key or 'default']
+
+def _backoff_sleep(attempt: int, retry_after: Optional[str] = None) -> None:
+  """Full-jitter exponential backoff, honouring Retry-After when the broker sends one."""
+  if retry_after:
+    try:
+      time.sleep(min(float(retry_after), config.API_BACKOFF_MAX_SECONDS))
+      return
+    except ValueError:
+      pass
+  cap = min(config.API_BACKOFF_MAX_SECONDS, config.API_BACKOFF_BASE_SECONDS * (2 ** attempt))
+  time.sleep(random.uniform(0, cap))
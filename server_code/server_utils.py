@@ -8,7 +8,7 @@ import anvil.server
 import datetime as dt
 
 from shared import config
-from . import server_api, server_db
+from . import server_api, server_db, server_env
 
 @anvil.server.callable
 def print_entire_db_schema():
@@ -83,7 +83,7 @@ def delete_logs_by_message(text):
 @anvil.server.callable
 def list_open_trades():
   print("--- OPEN TRADES IN DB ---")
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if not cycle:
     print("No active cycle.")
     return
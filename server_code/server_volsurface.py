@@ -0,0 +1,195 @@
+import datetime as dt
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+from shared import config
+from . import server_env
+from . import server_pricing
+from .server_chain import OptionChainFrame
+
+# Intraday implied-volatility surface per (environment, underlying), fed from every chain
+# download (server_api._load_chain) and shortlist re-quote. Points are keyed by expiration and
+# strike and stored with the log-moneyness ln(K/S) of the spot they were observed at, so the
+# surface moves with the underlying (sticky moneyness). A new observation of a strike replaces
+# the old one; points not refreshed within VOL_SURFACE_MAX_AGE_SECONDS are dropped.
+# Lookups interpolate linearly in log-moneyness within an expiration (flat past the wings)
+# and in total variance (iv^2 * t) across expirations.
+
+class VolSurface:
+  """IV points {expiration: {strike: (log-moneyness, iv, observed_at)}} for one underlying."""
+  def __init__(self, underlying: str):
+    self.underlying = underlying
+    self.spot = None
+    self.updated_at = None
+    self._points: Dict[str, Dict[float, Tuple[float, float, float]]] = {}
+    self._slices: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # sorted (k, iv) per expiration, rebuilt lazily
+    self._lock = threading.Lock()
+
+  # --- UPDATES ---
+  def update(self, expiration: str, strikes: np.ndarray, ivs: np.ndarray, spot: float, at: float = None) -> int:
+    """Merges observed IVs for one expiration; NaN IVs are ignored. Returns the number of points taken."""
+    at = time.time() if at is None else at
+    keep = np.isfinite(ivs) & (ivs > 0) & (strikes > 0)
+    moneyness = np.log(strikes[keep] / spot)
+    with self._lock:
+      points = self._points.setdefault(expiration, {})
+      for strike, k, iv in zip(strikes[keep], moneyness, ivs[keep]):
+        points[float(strike)] = (float(k), float(iv), at)
+      self._slices.pop(expiration, None)
+      self.spot = spot
+      self.updated_at = at
+    return int(np.count_nonzero(keep))
+
+  def prune(self, now: float = None) -> int:
+    """Drops points older than VOL_SURFACE_MAX_AGE_SECONDS; returns how many went."""
+    horizon = (time.time() if now is None else now) - config.VOL_SURFACE_MAX_AGE_SECONDS
+    dropped = 0
+    with self._lock:
+      for expiration in list(self._points):
+        points = self._points[expiration]
+        stale = [strike for strike, (_, _, at) in points.items() if at < horizon]
+        for strike in stale:
+          del points[strike]
+        if stale:
+          self._slices.pop(expiration, None)
+          dropped += len(stale)
+        if not points:
+          del self._points[expiration]
+    return dropped
+
+  # --- LOOKUPS ---
+  def expirations(self) -> List[str]:
+    with self._lock:
+      return sorted(e for e, points in self._points.items() if len(points) >= config.VOL_SURFACE_MIN_POINTS)
+
+  def iv(self, expiration: str, strike, spot: float, now: dt.datetime = None) -> np.ndarray:
+    """
+      Interpolated IV at each strike for the current spot; NaN when the surface has no
+      usable expiration. Expirations between observed ones blend total variance in time.
+      """
+    k = np.log(np.atleast_1d(np.asarray(strike, dtype=np.float64)) / spot)
+    expirations = self.expirations()
+    if not expirations:
+      return np.full(k.shape, np.nan)
+    if expiration in expirations:
+      return self._slice_iv(expiration, k)
+
+    times = server_pricing.year_fraction(expirations, now)
+    target = float(server_pricing.year_fraction(expiration, now)[0])
+    if target <= times[0]:
+      return self._slice_iv(expirations[0], k)
+    if target >= times[-1]:
+      return self._slice_iv(expirations[-1], k)
+    hi = int(np.searchsorted(times, target))
+    lo = hi - 1
+    var_lo = self._slice_iv(expirations[lo], k) ** 2 * times[lo]
+    var_hi = self._slice_iv(expirations[hi], k) ** 2 * times[hi]
+    weight = (target - times[lo]) / (times[hi] - times[lo])
+    return np.sqrt((var_lo + weight * (var_hi - var_lo)) / target)
+
+  def fair_value(self, option_type, strike, expiration: str, spot: float, now: dt.datetime = None) -> np.ndarray:
+    """Black-Scholes value per share at the surface's IV; NaN where the surface has none."""
+    strike = np.atleast_1d(np.asarray(strike, dtype=np.float64))
+    is_call = np.asarray(option_type) == config.TRADIER_OPTION_TYPE_CALL
+    sigma = self.iv(expiration, strike, spot, now)
+    t = server_pricing.year_fraction(expiration, now)
+    return server_pricing.bs_price(spot, strike, t, sigma, is_call)
+
+  def stats(self) -> Dict:
+    with self._lock:
+      return {
+        'underlying': self.underlying,
+        'spot': self.spot,
+        'updated_at': dt.datetime.fromtimestamp(self.updated_at).isoformat() if self.updated_at else None,
+        'expirations': {e: len(points) for e, points in sorted(self._points.items())}
+      }
+
+  def _slice_iv(self, expiration: str, k: np.ndarray) -> np.ndarray:
+    with self._lock:
+      cached = self._slices.get(expiration)
+      if cached is None:
+        if not self._points.get(expiration):
+          return np.full(k.shape, np.nan)  # pruned since expirations() was read
+        points = sorted(self._points[expiration].values())
+        cached = self._slices[expiration] = (np.array([p[0] for p in points]), np.array([p[1] for p in points]))
+    ks, ivs = cached
+    return np.interp(k, ks, ivs)  # flat past the outermost strikes
+
+# --- REGISTRY ---
+
+# (env, underlying) -> surface
+_SURFACES: Dict[Tuple[str, str], VolSurface] = {}
+_LOCK = threading.Lock()
+
+def get_surface(underlying: str = None, env: str = None) -> VolSurface:
+  """This environment's surface for `underlying` (default: the target underlying), created empty."""
+  env = env or server_env.current_env()
+  underlying = underlying or server_env.target_underlying(env)
+  with _LOCK:
+    surface = _SURFACES.get((env, underlying))
+    if surface is None:
+      surface = _SURFACES[(env, underlying)] = VolSurface(underlying)
+  return surface
+
+def update_from_chain(underlying: str, options: List[Dict], spot: float, now: dt.datetime = None) -> int:
+  """
+    Feeds one downloaded chain (or re-quoted subset) into the surface. Only two-sided OTM
+    quotes are used; IVs already priced locally (server_pricing greeks) are reused, the rest
+    are solved here. Returns the number of points taken.
+    """
+  if not options or not spot:
+    return 0
+  surface = get_surface(underlying)
+  surface.prune()
+  usable = [opt for opt in options
+            if float(opt.get('bid') or 0) > 0 and float(opt.get('ask') or 0) > 0 and opt.get('expiration_date')
+            and (float(opt['strike']) >= spot if opt.get('option_type') == config.TRADIER_OPTION_TYPE_CALL
+                 else float(opt['strike']) <= spot)]
+  if not usable:
+    return 0
+
+  ivs = np.array([_local_iv(opt) for opt in usable], dtype=np.float64)
+  unsolved = np.flatnonzero(np.isnan(ivs))
+  if unsolved.size:
+    ivs[unsolved] = server_pricing.chain_greeks([usable[i] for i in unsolved], spot, now)['iv']
+
+  strikes = np.array([float(opt['strike']) for opt in usable])
+  expirations = np.array([opt['expiration_date'] for opt in usable], dtype=object)
+  taken = 0
+  for expiration in set(expirations):
+    rows = expirations == expiration
+    taken += surface.update(expiration, strikes[rows], ivs[rows], spot)
+  return taken
+
+def fair_value(option_type, strike, expiration: str, spot: float, underlying: str = None) -> np.ndarray:
+  """Model value per share from the current surface (see VolSurface.fair_value)."""
+  return get_surface(underlying).fair_value(option_type, strike, expiration, spot)
+
+def frame_fair_values(frame: OptionChainFrame, spot: float, surface: VolSurface = None) -> np.ndarray:
+  """Surface fair value per frame row (NaN for rows without an expiration or surface coverage)."""
+  surface = surface or get_surface()
+  fair = np.full(len(frame), np.nan)
+  expirations = np.array([opt.get('expiration_date') or '' for opt in frame.records], dtype=object)
+  for expiration in set(expirations):
+    if expiration:
+      rows = np.flatnonzero(expirations == expiration)
+      fair[rows] = surface.fair_value(frame.option_type[rows], frame.strike[rows], expiration, spot)
+  return fair
+
+def surface_stats() -> List[Dict]:
+  with _LOCK:
+    surfaces = [(env, s) for (env, _), s in _SURFACES.items()]
+  return [dict(s.stats(), env=env) for env, s in surfaces]
+
+def reset() -> None:
+  with _LOCK:
+    _SURFACES.clear()
+
+def _local_iv(opt: Dict) -> float:
+  """IV computed by server_pricing for this quote (same time convention as the surface), else NaN."""
+  greeks = opt.get('greeks')
+  if isinstance(greeks, dict) and greeks.get('source') == 'local' and greeks.get('mid_iv') is not None:
+    return float(greeks['mid_iv'])
+  return np.nan
@@ -0,0 +1,88 @@
+import datetime as dt
+from typing import Dict, List, Optional
+
+from shared import config
+
+class VwapAccumulator:
+  """
+    Running session VWAP for one symbol/day: VWAP = Sum(Typical Price * Volume) / Sum(Volume).
+    Completed 1-minute bars are folded into cum_pv / cum_vol once and never re-read.
+    The newest bar may still be forming, so it is held as `pending` and only
+    committed when a later bar arrives; it still counts towards vwap / last_price.
+    State round-trips through to_state()/from_state() (server_db vwap_state rows).
+    """
+  def __init__(self, symbol: str, session_date: dt.date):
+    self.symbol = symbol
+    self.session_date = session_date
+    self.cum_pv = 0.0
+    self.cum_vol = 0.0
+    self.bar_count = 0
+    self.last_bar_time: Optional[dt.datetime] = None  # newest committed bar (ET wall clock, as Tradier sends it)
+    self.last_price = 0.0
+    self.pending: Optional[Dict] = None
+
+  @classmethod
+  def from_state(cls, symbol: str, session_date: dt.date, state: Optional[Dict]) -> 'VwapAccumulator':
+    acc = cls(symbol, session_date)
+    if state:
+      acc.cum_pv = float(state.get('cum_pv') or 0.0)
+      acc.cum_vol = float(state.get('cum_vol') or 0.0)
+      acc.bar_count = int(state.get('bar_count') or 0)
+      last_bar_time = state.get('last_bar_time')
+      acc.last_bar_time = dt.datetime.fromisoformat(last_bar_time) if last_bar_time else None
+      acc.last_price = float(state.get('last_price') or 0.0)
+    return acc
+
+  def to_state(self) -> Dict:
+    return {
+      'cum_pv': self.cum_pv,
+      'cum_vol': self.cum_vol,
+      'bar_count': self.bar_count,
+      'last_bar_time': self.last_bar_time.isoformat() if self.last_bar_time else None,
+      'last_price': self.last_price
+    }
+
+  def next_start(self) -> str:
+    """Timesales 'start' parameter: the minute after the newest committed bar."""
+    if self.last_bar_time is None:
+      return f"{self.session_date:%Y-%m-%d} {config.MARKET_OPEN_TIME:%H:%M}"
+    return (self.last_bar_time + dt.timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')
+
+  def fold(self, bars: List[Dict]) -> int:
+    """Adds bars newer than the last committed one. Returns how many were committed."""
+    fresh = []
+    for bar in bars:
+      bar_time = dt.datetime.fromisoformat(bar['time'])
+      if self.last_bar_time is None or bar_time > self.last_bar_time:
+        fresh.append((bar_time, bar))
+    if not fresh:
+      return 0
+    fresh.sort(key=lambda item: item[0])
+
+    *complete, (pending_time, pending) = fresh
+    for bar_time, bar in complete:
+      pv, vol = _bar_pv(bar)
+      self.cum_pv += pv
+      self.cum_vol += vol
+      self.bar_count += 1
+      self.last_bar_time = bar_time
+    self.pending = pending
+    self.last_price = float(pending['close'])
+    return len(complete)
+
+  @property
+  def vwap(self) -> float:
+    cum_pv, cum_vol = self.cum_pv, self.cum_vol
+    if self.pending is not None:
+      pv, vol = _bar_pv(self.pending)
+      cum_pv += pv
+      cum_vol += vol
+    return cum_pv / cum_vol if cum_vol > 0 else 0.0
+
+def _bar_pv(bar: Dict):
+  high = float(bar['high'])
+  low = float(bar['low'])
+  close = float(bar['close'])
+  vol = float(bar['volume'])
+  typical_price = (high + low + close) / 3.0
+  return typical_price * vol, vol
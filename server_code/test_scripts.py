@@ -3,13 +3,27 @@ import anvil.server
 import unittest
 from unittest.mock import MagicMock, patch
 import datetime as dt
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+from types import SimpleNamespace
+
+import requests
 
 from shared import config
 from . import server_libs
 from . import server_api
 from . import server_main
 from . import server_db
+from . import server_env
+from . import server_metrics
+from . import server_stream
+from . import server_cassette
+from . import server_transport
+from . import server_breaker
+from .server_fakes import FakeStreamServer, FakeTradierServer
 
 #from . server_client import start_new_cycle, get_campaign_dashboard, run_auto, close_campaign_manual
 from anvil.tables import app_tables
@@ -24,9 +38,9 @@ def diagnostic_preflight() -> str:
   print(f"Heartbeat updated to: {s['last_bot_heartbeat']}")
 
   # 2. Test Scaling Logic
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if cycle:
-    print(f"Active Env: {config.ACTIVE_ENV} | Underlying: {cycle.underlying}")
+    print(f"Active Env: {server_env.current_env()} | Underlying: {cycle.underlying}")
 
     # Access the rules property (which we optimized to a cached dict)
     rules = cycle.rules 
@@ -46,7 +60,7 @@ def diagnostic_preflight() -> str:
 
 @anvil.server.callable
 def diagnostic_batch_api() -> dict:
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if not cycle: 
     return {"error": "No active cycle"}
 
@@ -61,26 +75,352 @@ def diagnostic_batch_api() -> dict:
   print(f"Underlying: {snapshot.get('price')}")
   print(f"Hedge Last: {snapshot.get('hedge_last')}")
   print(f"Spread Marks: {snapshot.get('spread_marks')}")
+  endpoints = server_metrics.latency_report(minutes=1, env=server_env.current_env())
+  for row in endpoints:
+    print(f"  {row['endpoint']}: {row['calls']} calls | p50 {row['p50']}s | max {row['max']}s | {row['avg_bytes']} B")
 
   return {
     "duration": duration,
     "underlying": snapshot.get('price'),
-    "marks_count": len(snapshot.get('spread_marks', {}))
+    "marks_count": len(snapshot.get('spread_marks', {})),
+    "endpoints": endpoints
   }
   
 @anvil.server.callable
-def run_branch_test(scenario: str) -> str:
+def diagnostic_stream_book() -> dict:
+  """Round-trips quote/trade/summary events through the local stand-in stream into a QuoteBook."""
+  print("--- DIAGNOSTIC: STREAMING QUOTE BOOK ---")
+  server = FakeStreamServer().start()
+  book = server_stream.QuoteBook()
+  client = server_stream.MarketStreamClient(server_env.current_env(), book, ws_url=server.url, session_provider=server.session_provider)
+  option = 'SPXW260119P05800000'
+  try:
+    client.subscribe(['SPX', option])
+    client.start()
+    deadline = time.time() + 5
+    while server.client_count() == 0 and time.time() < deadline:
+      time.sleep(0.02)
+
+    server.publish({'type': 'summary', 'symbol': 'SPX', 'open': '5900.10', 'prevClose': '5890.00'})
+    server.publish({'type': 'trade', 'symbol': 'SPX', 'price': '5905.25', 'last': '5905.25'})
+    server.publish({'type': 'quote', 'symbol': option, 'bid': 1.10, 'ask': 1.20})
+    while book.get(option) is None and time.time() < deadline:
+      time.sleep(0.02)
+
+    start = time.perf_counter()
+    quotes = book.get_many(['SPX', option], config.STREAM_MAX_QUOTE_AGE_SECONDS)
+    read_us = (time.perf_counter() - start) * 1e6
+  finally:
+    client.stop()
+    server.stop()
+
+  print(f"Book: {quotes}")
+  print(f"Read time: {read_us:.1f} us | Events: {client.events_received}")
+  ok = bool(quotes) and quotes['SPX'].get('last') == 5905.25 and quotes[option].get('ask') == 1.20
+  print("SUCCESS: Stream feeds the book." if ok else "FAILURE: Book incomplete.")
+  return {'ok': ok, 'read_us': read_us, 'by_underlying': sorted(book.for_underlying('SPX'))}
+
+@anvil.server.callable
+def diagnostic_order_events() -> dict:
+  """Measures fill-detection latency through the local stand-in account stream and OrderRegistry."""
+  print("--- DIAGNOSTIC: ORDER EVENT REGISTRY ---")
+  server = FakeStreamServer().start()
+  registry = server_stream.OrderRegistry()
+  client = server_stream.AccountStreamClient(server_env.current_env(), registry, ws_url=server.account_url, session_provider=server.session_provider)
+  order_id = '900001'
+  try:
+    client.start()
+    deadline = time.time() + 5
+    while server.client_count() == 0 and time.time() < deadline:
+      time.sleep(0.02)
+
+    registry.track(order_id)
+    server.publish({'event': 'order', 'id': int(order_id), 'status': 'open', 'account': 'TEST'})
+    fill_sent = {}
+    def _fill():
+      time.sleep(0.25)
+      fill_sent['t'] = time.perf_counter()
+      server.publish({'event': 'order', 'id': int(order_id), 'status': 'filled', 'avg_fill_price': -3.5, 'account': 'TEST'})
+    threading.Thread(target=_fill, daemon=True).start()
+
+    state = registry.wait(order_id, 5)
+    latency_ms = (time.perf_counter() - fill_sent.get('t', time.perf_counter())) * 1000
+  finally:
+    client.stop()
+    server.stop()
+
+  ok = bool(state) and state.get('status') == 'filled'
+  print(f"State: {state}")
+  print(f"Fill detected {latency_ms:.1f} ms after the event was sent")
+  print("SUCCESS: Registry woke on the fill event." if ok else "FAILURE: Fill event not observed.")
+  return {'ok': ok, 'latency_ms': latency_ms}
+
+@anvil.server.callable
+def diagnostic_cassette_loop(name: str, mode: str = server_cassette.MODE_REPLAY, timing: str = server_cassette.TIMING_FAST) -> dict:
+  """
+    Runs one full automation loop with broker HTTP recorded to / replayed from a cassette.
+    Record once against the live API, then replay (fast or realtime) offline to benchmark/profile.
+    """
+  print(f"--- DIAGNOSTIC: CASSETTE LOOP ({mode}, {timing}) ---")
+  os.makedirs(config.CASSETTE_DIR, exist_ok=True)
+  path = os.path.join(config.CASSETTE_DIR, f"{name}.jsonl.gz")
+
+  start = time.perf_counter()
+  with server_cassette.use_cassette(path, mode=mode, timing=timing) as cassette:
+    server_main._execute_automation_loop()
+  duration = time.perf_counter() - start
+
+  stats = dict(cassette.stats, duration=duration, requests=len(server_cassette.read_cassette(path)))
+  print(f"Loop: {duration:.3f}s | {stats}")
+  return stats
+
+@anvil.server.callable
+def diagnostic_fake_broker_load(concurrency: int = 8, orders: int = 40, latency: float = 0.02) -> dict:
+  """
+    Load test of the order path against the local FakeTradierServer (no broker traffic):
+    chain -> open_spread_position -> wait_for_order_fill -> close_position, `orders` times
+    across `concurrency` threads. Streaming is off, so fills are found by REST polling.
+    """
+  print(f"--- DIAGNOSTIC: FAKE BROKER LOAD ({orders} orders x{concurrency}) ---")
+  env = server_env.current_env()
+  underlying = server_env.target_underlying(env)
+  fake = FakeTradierServer(latency=latency).start()
+  transport = server_transport.BrokerTransport(env, 'FAKE', 'FAKEACCT', fake.url)
+  stream_enabled = config.STREAM_ENABLED
+  config.STREAM_ENABLED = False
+  server_api.clear_chain_cache()
+
+  def _round_trip(n: int) -> dict:
+    start = time.perf_counter()
+    chain = server_api.get_option_chain(dt.date.today(), underlying)
+    puts = sorted((o for o in chain if o['option_type'] == 'put' and o['bid'] > 0), key=lambda o: o['strike'])
+    long_leg, short_leg = puts[len(puts) // 2 + n % 5], puts[len(puts) // 2 + n % 5 - 5]
+    # Alternate marketable and mid-priced limits, so some fills wait for the tape to move
+    natural = long_leg['ask'] - short_leg['bid']
+    mid = (long_leg['bid'] + long_leg['ask'] - short_leg['bid'] - short_leg['ask']) / 2
+    debit = round(natural if n % 2 == 0 else mid, 2)
+    trade_data = {'short_leg_data': short_leg, 'long_leg_data': long_leg, 'quantity': 1, 'debit': debit}
+
+    order = server_api.open_spread_position(trade_data, is_debit=True)
+    status, fill_px = server_api.wait_for_order_fill(order['id'], timeout_seconds=3)
+    if status != 'filled':
+      server_api.cancel_order(order['id'])
+      return {'seconds': time.perf_counter() - start, 'filled': False, 'closed': False}
+
+    trade = SimpleNamespace(quantity=1, legs=[
+      SimpleNamespace(side=config.LEG_SIDE_SHORT, occ_symbol=short_leg['symbol']),
+      SimpleNamespace(side=config.LEG_SIDE_LONG, occ_symbol=long_leg['symbol'])
+    ])
+    close = server_api.close_position(trade, order_type='market')
+    close_status, _ = server_api.wait_for_order_fill(close['id'], timeout_seconds=3)
+    return {'seconds': time.perf_counter() - start, 'filled': True, 'closed': close_status == 'filled'}
+
+  start = time.perf_counter()
+  try:
+    with server_transport.use_transport(transport):
+      with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_round_trip, range(orders)))
+  finally:
+    config.STREAM_ENABLED = stream_enabled
+    server_api.clear_chain_cache()
+    fake.stop()
+  duration = time.perf_counter() - start
+
+  latencies = sorted(r['seconds'] for r in results)
+  stats = {
+    'orders': orders,
+    'filled': sum(r['filled'] for r in results),
+    'closed': sum(r['closed'] for r in results),
+    'duration': duration,
+    'orders_per_sec': orders / duration if duration else 0.0,
+    'p50': latencies[len(latencies) // 2],
+    'p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+    'http_requests': fake.request_count,
+    'open_positions': len(fake.positions)
+  }
+  print(f"Round trips: {stats}")
+  return stats
+
+@anvil.server.callable
+def diagnostic_order_idempotency() -> dict:
+  """
+    Tagged order whose POST times out after the (fake) broker accepted it, then a second
+    submit of the same intent: both must resolve to the one order the broker holds.
+    """
+  print("--- DIAGNOSTIC: IDEMPOTENT ORDER SUBMISSION ---")
+  env = server_env.current_env()
+  fake = FakeTradierServer(tick_seconds=0).start()
+  transport = server_transport.BrokerTransport(env, 'FAKE', 'FAKEACCT', fake.url)
+  timeouts = dict(config.API_TIMEOUTS)
+  stream_enabled = config.STREAM_ENABLED
+  config.STREAM_ENABLED = False
+  config.API_TIMEOUTS['/accounts'] = (1.0, 0.3)
+  fake.submit_delay = 0.6
+
+  expiration = dt.date.today().strftime('%Y-%m-%d')
+  chain = fake.chain(server_env.target_underlying(env), expiration, greeks=False)
+  puts = sorted((o for o in chain if o['option_type'] == 'put'), key=lambda o: o['strike'])
+  trade_data = {'short_leg_data': puts[55], 'long_leg_data': puts[60], 'quantity': 1, 'debit': 0.05}
+  tag = server_api.order_tag(f"DIAG-{time.time()}", None, 'OPEN_SPREAD')
+  try:
+    with server_transport.use_transport(transport):
+      first = server_api.open_spread_position(dict(trade_data), is_debit=True, tag=tag)
+      fake.submit_delay = 0.0
+      second = server_api.open_spread_position(dict(trade_data), is_debit=True, tag=tag)
+  finally:
+    config.API_TIMEOUTS.clear()
+    config.API_TIMEOUTS.update(timeouts)
+    config.STREAM_ENABLED = stream_enabled
+    fake.stop()
+
+  intent = server_db.get_order_intent(tag)
+  ok = len(fake.orders) == 1 and first['id'] == second['id']
+  print(f"Broker orders: {len(fake.orders)} | first: {first['id']} | second: {second['id']} | intent: {intent}")
+  print("SUCCESS: One order per tag." if ok else "FAILURE: Duplicate or missing order.")
+  return {'ok': ok, 'orders': len(fake.orders), 'intent_status': intent and intent['status']}
+
+@anvil.server.callable
+def diagnostic_breaker_half_open() -> dict:
+  """
+    Breaker state must survive from one process to the next: every step runs on a fresh
+    transport loaded from broker_breakers (as each Anvil run would). A trip on the first is
+    seen as open by the second; its half-open probe fails with a non-network RequestException
+    (ChunkedEncodingError), which must re-open the circuit for the third, whose probe after
+    the next cooldown closes it for the fourth.
+    """
+  print("--- DIAGNOSTIC: BREAKER HALF-OPEN PROBE (shared state) ---")
+  env = server_env.current_env()
+  account = f"DIAG-{env}"
+  fake = FakeTradierServer(tick_seconds=0).start()
+  cooldown = config.BREAKER_COOLDOWN_SECONDS
+  config.BREAKER_COOLDOWN_SECONDS = 0.2
+  server_db.delete_breaker_states(account)
+  transports = []
+
+  def _fresh() -> server_transport.BrokerTransport:
+    transport = server_transport.BrokerTransport(env, 'FAKE', 'FAKEACCT', fake.url)
+    server_transport.persist_breakers(transport, account)
+    transports.append(transport)
+    return transport
+
+  def _breaker(transport):
+    return transport.breakers.breakers['market_data']
+
+  states, status = [], None
+  try:
+    first = _fresh()
+    for _ in range(config.BREAKER_MIN_CALLS):
+      _breaker(first).record(False)
+
+    second = _fresh()
+    states.append(_breaker(second).state)  # open, from the first
+    time.sleep(0.3)
+    states.append(_breaker(second).state)  # half_open
+    with patch.object(second.session, 'request', side_effect=requests.exceptions.ChunkedEncodingError('truncated body')):
+      try:
+        second.get('/markets/quotes', params={'symbols': 'SPX'})
+      except requests.exceptions.RequestException:
+        pass
+
+    third = _fresh()
+    states.append(_breaker(third).state)  # open again
+    time.sleep(0.3)
+    try:
+      status = third.get('/markets/quotes', params={'symbols': 'SPX'}).status_code
+    except requests.exceptions.RequestException as e:
+      status = type(e).__name__  # BrokerUnavailable: the slot was never released
+    states.append(_breaker(_fresh()).state)  # closed by the third's probe
+  finally:
+    config.BREAKER_COOLDOWN_SECONDS = cooldown
+    server_db.delete_breaker_states(account)
+    for transport in transports:
+      transport.session.close()
+    fake.stop()
+
+  expected = [server_breaker.OPEN, server_breaker.HALF_OPEN, server_breaker.OPEN, server_breaker.CLOSED]
+  ok = states == expected and status == 200
+  print(f"States: {states} | probe status: {status}")
+  print("SUCCESS: Breaker state shared and probe slot released." if ok else "FAILURE: Breaker state lost or probe leaked.")
+  return {'ok': ok, 'states': states}
+
+@anvil.server.callable
+def diagnostic_multi_env(rounds: int = 5) -> dict:
+  """
+    PROD and SANDBOX side by side in one process, each against its own FakeTradierServer:
+    every environment must only ever reach its own broker and trade its own underlying.
+    """
+  print(f"--- DIAGNOSTIC: MULTI-ENVIRONMENT ({rounds} rounds per env) ---")
+  envs = (config.ENV_PROD, config.ENV_SANDBOX)
+  fakes = {env: FakeTradierServer().start() for env in envs}
+  transports = [server_transport.BrokerTransport(env, 'FAKE', f'FAKE{env}', fakes[env].url) for env in envs]
+  stream_enabled = config.STREAM_ENABLED
+  config.STREAM_ENABLED = False
+  server_api.clear_chain_cache()
+
+  def _run(env: str) -> dict:
+    with server_env.use_env(env):
+      seen = set()
+      for n in range(rounds):
+        chain = server_api.get_option_chain(dt.date.today(), near=fakes[env].spots[server_env.target_underlying()])
+        seen.update(o['underlying'] for o in chain)
+        puts = sorted((o for o in chain if o['option_type'] == 'put'), key=lambda o: o['strike'])
+        long_leg, short_leg = puts[len(puts) // 2], puts[len(puts) // 2 - 5]
+        trade_data = {'short_leg_data': short_leg, 'long_leg_data': long_leg, 'quantity': 1,
+                      'debit': round(long_leg['ask'] - short_leg['bid'], 2)}
+        server_api.open_spread_position(trade_data, is_debit=True)
+        # Same symbol and order id in both environments: each must only ever read back its own
+        marker = float(envs.index(env) + 1)
+        server_stream.get_quote_book().apply({'type': 'quote', 'symbol': 'DIAG', 'bid': marker, 'ask': marker})
+        server_stream.get_order_registry().track('DIAG', status=env)
+      quote = server_stream.get_quote_book().get('DIAG') or {}
+      order = server_stream.get_order_registry().get('DIAG') or {}
+      return {'env': server_env.current_env(), 'underlyings': sorted(seen),
+              'quote_bid': quote.get('bid'), 'order_status': order.get('status')}
+
+  try:
+    with server_transport.use_transport(transports[0]), server_transport.use_transport(transports[1]):
+      with ThreadPoolExecutor(max_workers=len(envs)) as pool:
+        results = dict(zip(envs, pool.map(_run, envs)))
+  finally:
+    config.STREAM_ENABLED = stream_enabled
+    server_api.clear_chain_cache()
+    for fake in fakes.values():
+      fake.stop()
+
+  ok = True
+  for env in envs:
+    expected = server_env.target_underlying(env)
+    order_symbols = sorted({o['symbol'] for o in fakes[env].orders.values()})
+    streams_ok = (results[env]['quote_bid'] == float(envs.index(env) + 1) and results[env]['order_status'] == env)
+    env_ok = (results[env]['underlyings'] == [expected] and order_symbols == [expected]
+              and len(fakes[env].orders) == rounds and streams_ok)
+    ok = ok and env_ok
+    print(f"{env}: chain {results[env]['underlyings']} | orders {len(fakes[env].orders)} {order_symbols} | "
+          f"quote {results[env]['quote_bid']} order {results[env]['order_status']} | "
+          f"requests {fakes[env].request_count} | {'OK' if env_ok else 'CROSSED'}")
+  print("SUCCESS: Environments isolated." if ok else "FAILURE: Environment state leaked.")
+  return {'ok': ok, 'results': results}
+
+@anvil.server.callable
+def run_branch_test(scenario: str, cassette: str = None, cassette_mode: str = server_cassette.MODE_REPLAY) -> str:
   """
     Forces the bot into a specific state branch for testing.
     Scenarios: 'PANIC', 'ROLL_SPREAD', 'WINDFALL', 'HARVEST', 'HEDGE_ROLL'
+    cassette: optional cassette name; broker traffic is recorded/replayed instead of hitting the sandbox.
     """
+  if cassette:
+    path = os.path.join(config.CASSETTE_DIR, f"{cassette}.jsonl.gz")
+    os.makedirs(config.CASSETTE_DIR, exist_ok=True)
+    with server_cassette.use_cassette(path, mode=cassette_mode):
+      return run_branch_test(scenario)
+
   #if not config.DRY_RUN:
   #  return "ABORTED: You must set config.DRY_RUN = True before running branch tests!"
 
-  cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+  cycle = server_db.get_active_cycle(server_env.current_env())
   if not cycle: 
     server_main._execute_automation_loop()
-    cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+    cycle = server_db.get_active_cycle(server_env.current_env())
 
   if not cycle: 
     return "ERROR: Could not seed campaign. Check RuleSet table."
@@ -143,7 +483,7 @@ def run_branch_test(scenario: str) -> str:
   elif scenario == 'SCALPEL_WIN':
     # 1. Ensure an open trade exists with a DRY_ order ID
     # 2. MOCK THE FILL: Set time to 3:30 PM
-    cycle = server_db.get_active_cycle(config.ACTIVE_ENV)
+    cycle = server_db.get_active_cycle(server_env.current_env())
     env_status['now'] = dt.datetime.combine(dt.date.today(), dt.time(15, 30))
 
     # We don't need mock environment data because the bot 